@@ -1,21 +1,25 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
+import hashlib
+import json
 import logging
 import os
 
 # Importea la vista UDLA (archivo: depurador_streamlit.py)
 from depurador_streamlit import render_udla
 
-from utils.data_processor import depurar_datos, mapear_columnas
-from utils.excel_manager import actualizar_maestro, cargar_archivo_maestro
-from utils.history_manager import guardar_historial, cargar_historial, mostrar_estadisticas
+from utils.data_processor import depurar_csv_por_bloques, mapear_columnas
+from utils.excel_manager import actualizar_maestro, estadisticas_maestro
+from utils.history_manager import guardar_historial, cargar_resumen_historial, mostrar_estadisticas
+from utils.job_queue import cola_trabajos, clave_archivo, COMPLETADO, ERROR, ESTADOS_FINALES
+from utils.instrumentation import etapa, medir_ejecucion
 
 # ⭐ NUEVO: Importar funciones para conexión persistente (Anáhuac)
 # y mantener la función original para UDLA
 from utils.excel_integration_ui_persistent import (
     setup_excel_connection_persistent,
-    send_to_connected_excel,
+    encolar_envio_excel,
     integrate_ui_and_append  # Mantener para UDLA (compatibilidad)
 )
 
@@ -30,6 +34,124 @@ os.makedirs(HISTORY_DIR, exist_ok=True)
 DEFAULT_MAESTRO = os.path.join(DATA_DIR, "conglomerado_maestrias.xlsx")
 URL_BASE = "https://apmanager.aplatam.com/admin/Ventas/Consulta/Lead/"
 
+# Resultados de depuración cacheados entre reruns: la clave es el hash del archivo más
+# los parámetros del filtro (los argumentos con "_" no forman parte de la clave)
+CACHE_MAX_ENTRADAS = 8
+CACHE_TTL_SEGUNDOS = 3600
+
+def _hash_archivo(uploaded_file) -> str:
+    """SHA-256 del contenido subido, calculado una vez por archivo subido (file_id)."""
+    hashes = st.session_state.setdefault('hashes_archivos', {})
+    file_id = getattr(uploaded_file, 'file_id', None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    if file_id not in hashes:
+        hashes[file_id] = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    return hashes[file_id]
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL_SEGUNDOS, show_spinner=False)
+def _depurar_cacheado(hash_archivo: str, _uploaded_file, timestamp_referencia, start_from_prev_midnight, program_type, hours, days):
+    """(df_depurado, filas_originales, rendimiento por etapa) del archivo subido."""
+    _uploaded_file.seek(0)
+    with medir_ejecucion() as medicion:
+        df_depurado, filas_originales = depurar_csv_por_bloques(
+            _uploaded_file,
+            timestamp_referencia=timestamp_referencia,
+            start_from_prev_midnight=start_from_prev_midnight,
+            program_type=program_type,
+            hours=hours,
+            days=days,
+        )
+    return df_depurado, filas_originales, medicion.resumen()
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL_SEGUNDOS, show_spinner=False)
+def _mapear_cacheado(clave_depurado: tuple, _df_depurado, url_base):
+    """(df_mapeado, csv en bytes, rendimiento por etapa) para la depuración identificada por clave_depurado."""
+    with medir_ejecucion() as medicion:
+        df_mapeado = mapear_columnas(_df_depurado, url_base)
+        with etapa("csv_descarga"):
+            csv_bytes = df_mapeado.to_csv(index=False).encode('utf-8-sig')
+    return df_mapeado, csv_bytes, medicion.resumen()
+
+def _mostrar_rendimiento(rendimiento: dict):
+    """Expander con el tiempo y la memoria de cada etapa, exportable como JSON."""
+    if not rendimiento:
+        return
+    with st.expander("⏱️ Rendimiento"):
+        tabla = pd.DataFrame.from_dict(rendimiento, orient='index')
+        tabla.index.name = 'Etapa'
+        st.dataframe(tabla, use_container_width=True)
+        st.caption("Las etapas anidadas incluyen a las internas (ej. depurar_datos incluye parsear_fechas).")
+        st.download_button(
+            "📥 Descargar rendimiento (JSON)",
+            data=json.dumps(rendimiento, ensure_ascii=False, indent=2),
+            file_name=f"rendimiento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            on_click="ignore",
+        )
+
+# Trabajos en segundo plano (consolidación y envíos a Excel): la sesión solo consulta su estado
+INTERVALO_SONDEO_TRABAJOS = 2
+
+def _trabajo_consolidar(trabajo, df, archivo_maestro, periodo, only_manage_rezagados=False, info_depuracion=None):
+    """Consolida en el maestro (en la cola de ese archivo) y, si se indica, registra el historial."""
+    trabajo.progreso(0.05, "Consolidando en archivo maestro...")
+    with medir_ejecucion() as medicion:
+        added, moved = actualizar_maestro(df, archivo_maestro, periodo, only_manage_rezagados=only_manage_rezagados)
+    rendimiento = medicion.resumen()
+    if info_depuracion is not None:
+        trabajo.progreso(0.95, "Guardando historial...")
+        guardar_historial({**info_depuracion, 'filas_agregadas': added, 'rezagados_movidos': moved,
+                           'rendimiento': {**info_depuracion.get('rendimiento', {}), **rendimiento}}, HISTORY_DIR)
+    return {'agregadas': added, 'rezagados': moved, 'rendimiento': rendimiento}
+
+def _encolar_consolidacion(descripcion, df, archivo_maestro, periodo, **opciones):
+    id_trabajo = cola_trabajos().encolar(
+        "maestro", clave_archivo(archivo_maestro), _trabajo_consolidar, df, archivo_maestro, periodo,
+        descripcion=descripcion, bloquear_archivo=archivo_maestro, **opciones,
+    )
+    _seguir_trabajo(id_trabajo)
+
+def _seguir_trabajo(id_trabajo):
+    """Añade el trabajo al panel de la sesión; el panel lo sondea hasta que termine."""
+    st.session_state.setdefault('trabajos', []).append(id_trabajo)
+    st.session_state.setdefault('trabajos_activos', []).append(id_trabajo)
+
+def _panel_trabajos():
+    """Estado de los trabajos de esta sesión; se refresca solo mientras alguno está activo."""
+    ids = st.session_state.get('trabajos', [])
+    if not ids:
+        return
+    trabajos = cola_trabajos().estados(ids[-10:])
+    activos = [t['id'] for t in trabajos if t['estado'] not in ESTADOS_FINALES]
+    with st.expander("⏳ Trabajos en segundo plano", expanded=bool(activos)):
+        for t in reversed(trabajos):
+            if t['estado'] == 'pendiente':
+                st.info(f"🕒 {t['descripcion']}: en cola ({t['en_cola']} por delante)")
+            elif t['estado'] == 'en_curso':
+                st.progress(t['progreso'], text=f"{t['descripcion']}: {t['mensaje'] or 'en curso'}")
+            elif t['estado'] == COMPLETADO:
+                r = t['resultado'] or {}
+                if t['tipo'] == 'maestro':
+                    st.success(f"✅ {t['descripcion']}: {r.get('agregadas', 0)} registros añadidos, {r.get('rezagados', 0)} rezagados movidos")
+                else:
+                    st.success(f"✅ {t['descripcion']}: completado")
+            else:
+                st.error(f"❌ {t['descripcion']}: {t['mensaje']}")
+
+    # Al terminar un trabajo se actualiza el estado de la sesión y se redibuja la app completa
+    anteriores = st.session_state.get('trabajos_activos', [])
+    st.session_state['trabajos_activos'] = activos
+    terminados = [t for t in trabajos if t['id'] in anteriores and t['id'] not in activos]
+    for t in terminados:
+        if t['estado'] == COMPLETADO and (t['resultado'] or {}).get('rendimiento'):
+            st.session_state['rendimiento'] = {**st.session_state.get('rendimiento', {}), **t['resultado']['rendimiento']}
+        if t['tipo'] == 'excel':
+            if t['estado'] == COMPLETADO:
+                st.session_state.pop("excel_subida_pendiente", None)
+            elif t['estado'] == ERROR and t['resultado']:
+                st.session_state.excel_subida_pendiente = t['resultado']
+    if terminados:
+        st.rerun()
+
 def main():
     st.set_page_config(page_title="Sistema de Carga y Depuración CRM", layout="wide")
     st.title("🏢 Sistema de Carga y Depuración CRM")
@@ -78,6 +200,9 @@ def main():
         return
 
     # Para Maestrías y Licenciaturas seguimos con el flujo general
+    hay_activos = bool(st.session_state.get('trabajos_activos'))
+    st.fragment(run_every=INTERVALO_SONDEO_TRABAJOS if hay_activos else None)(_panel_trabajos)()
+
     tab1, tab2, tab3, tab4 = st.tabs(["📤 Carga de Datos", "📊 Dashboard", "🔄 Rezagados", "📈 Historial"])
 
     with tab1:
@@ -93,15 +218,17 @@ def main():
 
         if uploaded_file is not None:
             try:
-                # Timestamp de carga
-                timestamp_carga = datetime.now()
+                # Timestamp de carga: fijo por archivo subido, para que los reruns reutilicen la caché
+                timestamp_carga = st.session_state.setdefault('timestamps_carga', {}).setdefault(
+                    getattr(uploaded_file, 'file_id', None) or uploaded_file.name, datetime.now()
+                )
+                hash_archivo = _hash_archivo(uploaded_file)
                 
-                # Leer CSV
-                raw_df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, encoding='utf-8')
-                total_filas_originales = len(raw_df)
+                # Leer solo la cabecera para el preview; el CSV completo se procesa por bloques
+                preview_df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, encoding='utf-8', nrows=10)
+                uploaded_file.seek(0)
                 
                 st.success(f"✅ Archivo cargado: {uploaded_file.name}")
-                st.write(f"📊 Total de registros en CSV: **{total_filas_originales}**")
                 
             except Exception as e:
                 st.error(f"❌ No se pudo leer el CSV: {e}")
@@ -109,7 +236,7 @@ def main():
 
             if mostrar_preview:
                 st.subheader("👀 Preview del CSV Original")
-                st.dataframe(raw_df.head(10), use_container_width=True)
+                st.dataframe(preview_df, use_container_width=True)
 
             # Depuración
             st.markdown("---")
@@ -117,32 +244,28 @@ def main():
             
             with st.spinner("Procesando..."):
                 try:
-                    # Pasamos program_type a depurar_datos para que el procesador haga el comportamiento correcto
-                    if filtro_personalizado and rango_dias is not None:
-                        df_depurado = depurar_datos(raw_df,
-                                                    hours=None,
-                                                    days=int(rango_dias),
-                                                    timestamp_referencia=timestamp_carga,
-                                                    start_from_prev_midnight=start_from_prev_midnight,
-                                                    program_type=program_type)
-                    else:
-                        df_depurado = depurar_datos(raw_df,
-                                                    hours=int(rango_horas),
-                                                    days=None,
-                                                    timestamp_referencia=timestamp_carga,
-                                                    start_from_prev_midnight=start_from_prev_midnight,
-                                                    program_type=program_type)
-                except TypeError:
-                    # Fallback si la versión de depurar_datos no acepta start_from_prev_midnight/program_type
+                    # Pasamos program_type para que el procesador haga el comportamiento correcto
                     if filtro_personalizado and rango_dias is not None:
-                        df_depurado = depurar_datos(raw_df, hours=None, days=int(rango_dias), timestamp_referencia=timestamp_carga, program_type=program_type)
+                        filtro = {'hours': None, 'days': int(rango_dias)}
                     else:
-                        df_depurado = depurar_datos(raw_df, hours=int(rango_horas), days=None, timestamp_referencia=timestamp_carga, program_type=program_type)
+                        filtro = {'hours': int(rango_horas), 'days': None}
+                    clave_depurado = (hash_archivo, timestamp_carga, start_from_prev_midnight, program_type, filtro['hours'], filtro['days'])
+                    df_depurado, total_filas_originales, rendimiento = _depurar_cacheado(
+                        hash_archivo,
+                        uploaded_file,
+                        timestamp_carga,
+                        start_from_prev_midnight,
+                        program_type,
+                        filtro['hours'],
+                        filtro['days'],
+                    )
                 except Exception as e:
                     st.error(f"❌ Error durante la depuración: {e}")
                     st.exception(e)
                     st.stop()
             
+            st.write(f"📊 Total de registros en CSV: **{total_filas_originales}**")
+            
             if df_depurado is None or df_depurado.empty:
                 st.warning("⚠️ No hay registros después de la depuración / filtro de fechas.")
                 st.info("💡 Sugerencias:")
@@ -161,7 +284,8 @@ def main():
                     'filtro_horas': rango_horas if rango_dias is None else None,
                     'filtro_dias': rango_dias,
                     'periodo': periodo,
-                    'program_type': program_type
+                    'program_type': program_type,
+                    'rendimiento': rendimiento
                 }
                 guardar_historial(info_depuracion, HISTORY_DIR)
                 st.stop()
@@ -183,7 +307,8 @@ def main():
                     'filtro_horas': rango_horas if rango_dias is None else None,
                     'filtro_dias': rango_dias,
                     'periodo': periodo,
-                    'program_type': program_type
+                    'program_type': program_type,
+                    'rendimiento': rendimiento
                 }
                 guardar_historial(info_depuracion, HISTORY_DIR)
                 st.stop()
@@ -198,8 +323,13 @@ def main():
             
             with st.spinner("Mapeando columnas..."):
                 try:
-                    df_mapeado = mapear_columnas(df_depurado, url_base_input)
+                    df_mapeado, csv_depurado, rendimiento_mapeo = _mapear_cacheado(clave_depurado, df_depurado, url_base_input)
                     st.session_state['last_df_mapeado'] = df_mapeado
+                    rendimiento = {**rendimiento, **rendimiento_mapeo}
+                    # Las etapas de consolidación/envío se añaden al terminar esos trabajos
+                    if st.session_state.get('rendimiento_clave') != clave_depurado:
+                        st.session_state['rendimiento_clave'] = clave_depurado
+                        st.session_state['rendimiento'] = rendimiento
                     
                     st.success(f"✅ Datos mapeados: {len(df_mapeado)} registros")
                     
@@ -208,11 +338,10 @@ def main():
                     
                     col1, col2 = st.columns([1, 2])
                     with col1:
-                        csv_depurado = df_mapeado.to_csv(index=False, encoding='utf-8-sig')
                         filename = f"depurado_{program_type.replace(' ', '_')}_{uploaded_file.name.replace('.csv', '')}_{timestamp_carga.strftime('%Y%m%d_%H%M%S')}.csv"
                         st.download_button(
                             label="📥 Descargar CSV Depurado",
-                            data=csv_depurado.encode('utf-8-sig'),
+                            data=csv_depurado,
                             file_name=filename,
                             mime="text/csv",
                             help="Descarga el archivo depurado para copiar a Excel"
@@ -226,6 +355,8 @@ def main():
                     st.exception(e)
                     st.stop()
 
+                _mostrar_rendimiento(st.session_state.get('rendimiento'))
+
                 # ⭐ NUEVO: Exportar a Excel Online con conexión persistente (solo Maestrías/Licenciaturas)
                 st.markdown("---")
                 st.subheader("📤 Enviar a Excel Online")
@@ -236,17 +367,11 @@ def main():
                     
                     # Botón para enviar datos
                     if st.button("📊 Enviar datos depurados a Excel Online", type="primary", key=f"send_excel_{program_type}"):
-                        with st.spinner("📤 Enviando datos a Excel..."):
-                            success = send_to_connected_excel(
-                                df_to_append=df_mapeado,
-                                show_preview=True
-                            )
-                            
-                            if success:
-                                st.balloons()
-                                st.success("🎉 ¡Datos enviados exitosamente a Excel Online!")
-                            else:
-                                st.error("❌ Hubo un problema al enviar los datos")
+                        id_trabajo = encolar_envio_excel(df_mapeado)
+                        if id_trabajo:
+                            # El avance se muestra en 'Trabajos en segundo plano'
+                            _seguir_trabajo(id_trabajo)
+                            st.rerun()
                 else:
                     st.warning("⚠️ No hay ningún libro de Excel conectado")
                     st.info("💡 Configura la conexión en la barra lateral (📊 Conexión a Excel Online)")
@@ -256,40 +381,23 @@ def main():
                 st.subheader("💾 Consolidar en Excel Maestro")
                 
                 if st.button("🚀 Consolidar en Excel Maestro", type="primary"):
-                    with st.spinner("📝 Consolidando en archivo maestro..."):
-                        try:
-                            # Si quieres maestros separados por tipo, adapta actualizar_maestro para aceptar program_type.
-                            added, moved_rezagados = actualizar_maestro(df_mapeado, archivo_maestro, periodo)
-                        except Exception as e:
-                            st.error(f"❌ Error al consolidar: {e}")
-                            st.exception(e)
-                            st.stop()
-                    
-                    st.success(f"✅ **Consolidación completada!**")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.metric("Registros añadidos", added)
-                    with col2:
-                        st.metric("Rezagados movidos", moved_rezagados)
-                    
-                    st.info(f"💾 Archivo maestro guardado en: `{archivo_maestro}`")
-                    
-                    # Guardar historial
+                    # La consolidación corre en segundo plano, en cola con las demás del mismo maestro
                     info_depuracion = {
                         'timestamp': timestamp_carga.strftime('%Y-%m-%d %H:%M:%S'),
                         'archivo': uploaded_file.name,
                         'filas_originales': total_filas_originales,
                         'filas_depuradas': filas_depuradas,
-                        'filas_agregadas': added,
-                        'rezagados_movidos': moved_rezagados,
+                        'filas_agregadas': 0,
+                        'rezagados_movidos': 0,
                         'filtro_horas': rango_horas if rango_dias is None else None,
                         'filtro_dias': rango_dias,
                         'periodo': periodo,
-                        'program_type': program_type
+                        'program_type': program_type,
+                        'rendimiento': rendimiento
                     }
-                    guardar_historial(info_depuracion, HISTORY_DIR)
-                    st.success("📊 Historial actualizado")
+                    _encolar_consolidacion(f"Consolidar {uploaded_file.name} en {os.path.basename(archivo_maestro)}",
+                                           df_mapeado, archivo_maestro, periodo, info_depuracion=info_depuracion)
+                    st.rerun()
 
     with tab2:
         st.header("📊 Dashboard rápido")
@@ -297,21 +405,13 @@ def main():
         
         if st.button("🔍 Cargar estadísticas del maestro"):
             try:
-                sheets = cargar_archivo_maestro(archivo_maestro)
+                # Solo metadatos (dimensiones y encabezados), sin cargar el contenido de las hojas
+                resumen_data = estadisticas_maestro(archivo_maestro)
                 
-                if not sheets:
+                if not resumen_data:
                     st.warning("No se encontró el archivo maestro o está vacío")
                 else:
-                    st.success(f"✅ Archivo maestro cargado: {len(sheets)} hojas detectadas")
-                    
-                    # Crear tabla resumen
-                    resumen_data = []
-                    for name, df in sheets.items():
-                        resumen_data.append({
-                            'Hoja': name,
-                            'Registros': len(df),
-                            'Columnas': len(df.columns)
-                        })
+                    st.success(f"✅ Archivo maestro cargado: {len(resumen_data)} hojas detectadas")
                     
                     df_resumen = pd.DataFrame(resumen_data)
                     st.dataframe(df_resumen, use_container_width=True)
@@ -331,14 +431,13 @@ def main():
         
         if st.button("🔍 Ejecutar mover rezagados ahora", type="primary"):
             try:
-                # Cargar hojas
-                sheets = cargar_archivo_maestro(archivo_maestro)
-                if not sheets:
+                if not os.path.exists(archivo_maestro):
                     st.warning("No se encontró el archivo maestro")
                 else:
-                    # Llamamos a actualizar_maestro con df vacío para forzar la gestión de rezagados
-                    added, moved = actualizar_maestro(pd.DataFrame(), archivo_maestro, periodo, only_manage_rezagados=True)
-                    st.success(f"✅ Rezagados movidos: **{moved}**")
+                    # actualizar_maestro con df vacío fuerza la gestión de rezagados (en segundo plano)
+                    _encolar_consolidacion(f"Mover rezagados en {os.path.basename(archivo_maestro)}",
+                                           pd.DataFrame(), archivo_maestro, periodo, only_manage_rezagados=True)
+                    st.rerun()
             except Exception as e:
                 st.error(f"❌ Error moviendo rezagados: {e}")
                 st.exception(e)
@@ -347,11 +446,11 @@ def main():
         st.header("📈 Historial de Depuraciones")
         st.write("Registro histórico de todas las depuraciones realizadas")
         
-        # Cargar y mostrar historial
-        historial = cargar_historial(HISTORY_DIR)
+        # Cargar resumen precalculado y mostrar historial
+        resumen_historial = cargar_resumen_historial(HISTORY_DIR)
         
-        if historial:
-            mostrar_estadisticas(historial)
+        if resumen_historial['total']['depuraciones']:
+            mostrar_estadisticas(HISTORY_DIR, resumen_historial)
         else:
             st.info("📭 No hay historial de depuraciones aún")
 
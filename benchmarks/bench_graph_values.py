@@ -0,0 +1,84 @@
+"""
+Benchmark de la construcción del payload `values` para Graph: bucle con iterrows y
+búsqueda de columna por celda (implementación anterior de excel_online) vs.
+utils.graph_serializer.dataframe_a_valores, más la codificación JSON por fragmentos.
+
+Uso:
+    python -m benchmarks.bench_graph_values [--filas 50000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.data_processor import COLUMNAS_FINALES
+from utils.graph_serializer import cuerpo_filas, dataframe_a_valores, filas_json
+
+
+def valores_iterrows(df: pd.DataFrame, headers: list) -> list:
+    """Implementación anterior, como referencia."""
+    values = []
+    for _, row in df.iterrows():
+        row_vals = []
+        for h in headers:
+            match_col = next((c for c in df.columns if c.strip().lower() == str(h).strip().lower()), None)
+            if match_col:
+                row_vals.append("" if pd.isna(row[match_col]) else str(row[match_col]))
+            else:
+                row_vals.append("")
+        values.append(row_vals)
+    return values
+
+
+def cuerpos_recodificando(valores: list) -> list:
+    """Tamaño de cada fila con json.dumps y luego json.dumps de cada lote completo (doble codificación)."""
+    tamanos = [len(json.dumps(f, ensure_ascii=False).encode("utf-8")) for f in valores]
+    return [json.dumps({"index": None, "values": valores[i:i + 100]}, ensure_ascii=False) for i in range(0, len(valores), 100)], tamanos
+
+
+def cuerpos_por_fragmentos(valores: list) -> list:
+    """Cada fila se codifica una vez; los cuerpos se arman concatenando."""
+    filas = filas_json(valores)
+    tamanos = [len(f.encode("utf-8")) for f in filas]
+    return [cuerpo_filas(filas[i:i + 100]) for i in range(0, len(filas), 100)], tamanos
+
+
+def generar_df(filas: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({c: [f"{c} {i}" for i in range(filas)] for c in COLUMNAS_FINALES})
+    df["LEAD"] = rng.integers(1_000_000, 9_999_999, filas)
+    df.loc[rng.random(filas) < 0.1, "Email"] = None
+    return df
+
+
+def _medir(func, *args):
+    t0 = time.perf_counter()
+    resultado = func(*args)
+    return time.perf_counter() - t0, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=50_000)
+    args = parser.parse_args()
+
+    df = generar_df(args.filas)
+    headers = [h.upper() for h in COLUMNAS_FINALES[::-1]] + ["Sin columna"]
+
+    t_viejo, viejo = _medir(valores_iterrows, df, headers)
+    t_nuevo, nuevo = _medir(dataframe_a_valores, df, headers)
+    t_json_viejo, _ = _medir(cuerpos_recodificando, nuevo)
+    t_json_nuevo, _ = _medir(cuerpos_por_fragmentos, nuevo)
+
+    print(f"filas: {args.filas}, encabezados: {len(headers)}")
+    print(f"iterrows + next():       {t_viejo:8.3f} s")
+    print(f"dataframe_a_valores:     {t_nuevo:8.3f} s  ({t_viejo / t_nuevo:,.0f}x)")
+    print(f"JSON medir + recodificar:{t_json_viejo:8.3f} s")
+    print(f"JSON una vez por fila:   {t_json_nuevo:8.3f} s")
+    print(f"resultados iguales: {viejo == nuevo}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark de actualizar_maestro: reescritura completa vs. actualización incremental.
+
+Construye libros maestros con un número creciente de períodos históricos y mide
+cuánto tarda añadir el mismo lote de filas nuevas al período actual. Con la ruta
+incremental el tiempo debe depender del lote (y de las hojas del período) y no
+del tamaño total del libro.
+
+Uso:
+    python -m benchmarks.bench_maestro [--filas-periodo 5000] [--periodos 1 4 8] [--nuevas 200]
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from utils.data_processor import COLUMNAS_FINALES
+from utils.excel_manager import actualizar_maestro
+from utils.lead_index import IndiceLeads
+
+PERIODO_ACTUAL = "202592"
+
+
+def generar_lote(desde: int, hasta: int) -> pd.DataFrame:
+    df = pd.DataFrame({col: "" for col in COLUMNAS_FINALES}, index=range(hasta - desde))
+    df["LEAD"] = [str(i) for i in range(desde, hasta)]
+    df["Email"] = [f"alumno{i}@example.com" for i in range(desde, hasta)]
+    df["Nombre Apellido"] = "Apellido Nombre"
+    df["Programa"] = "Maestría en Administración"
+    df["PaidDate"] = "01/09/2025 10:00"
+    df["URL_Lead"] = "https://apmanager.aplatam.com/admin/Ventas/Consulta/Lead/" + df["LEAD"]
+    return df
+
+
+def construir_maestro(ruta: str, periodos: int, filas_periodo: int):
+    for p in range(periodos):
+        actualizar_maestro(generar_lote(p * filas_periodo, (p + 1) * filas_periodo), ruta, f"2024{p:02d}", incremental=False)
+    actualizar_maestro(generar_lote(10**7, 10**7 + filas_periodo), ruta, PERIODO_ACTUAL, incremental=False)
+
+
+def medir(ruta_base: str, nuevas: int, incremental: bool) -> float:
+    directorio = tempfile.mkdtemp()
+    try:
+        ruta = os.path.join(directorio, "maestro.xlsx")
+        shutil.copy(ruta_base, ruta)
+        if incremental:
+            # Estado estable: el índice de LEAD ya existe junto al libro
+            with IndiceLeads(ruta) as indice:
+                indice.asegurar_vigente()
+        lote = generar_lote(2 * 10**7, 2 * 10**7 + nuevas)
+        inicio = time.perf_counter()
+        actualizar_maestro(lote, ruta, PERIODO_ACTUAL, incremental=incremental)
+        return time.perf_counter() - inicio
+    finally:
+        shutil.rmtree(directorio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas-periodo", type=int, default=5000)
+    parser.add_argument("--periodos", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--nuevas", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'períodos':>9} {'tamaño MB':>10} {'completa s':>11} {'incremental s':>14}")
+    for periodos in args.periodos:
+        directorio = tempfile.mkdtemp()
+        try:
+            ruta = os.path.join(directorio, "maestro.xlsx")
+            construir_maestro(ruta, periodos, args.filas_periodo)
+            tamano = os.path.getsize(ruta) / 1e6
+            t_completa = medir(ruta, args.nuevas, incremental=False)
+            t_incremental = medir(ruta, args.nuevas, incremental=True)
+            print(f"{periodos:>9} {tamano:>10.2f} {t_completa:>11.3f} {t_incremental:>14.3f}")
+        finally:
+            shutil.rmtree(directorio)
+
+
+if __name__ == "__main__":
+    main()
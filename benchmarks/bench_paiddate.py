@@ -0,0 +1,113 @@
+"""
+Benchmark del parseo de PaidDate: cascada histórica de ocho formatos vs. el
+parseo por detección de formato de utils.data_processor._try_parse_dates.
+
+Uso:
+    python -m benchmarks.bench_paiddate [--filas 500000]
+"""
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.data_processor import _try_parse_dates, estadisticas_cache_fechas, limpiar_cache_fechas
+
+
+def _try_parse_dates_cascada(series: pd.Series) -> pd.Series:
+    """Implementación anterior (un pd.to_datetime por formato + apply por fila), como referencia."""
+    s = series.astype(str).replace({'': pd.NA, 'nan': pd.NA})
+    s = s.str.strip().replace({'\\u200b': ''}, regex=True)
+
+    formats = [
+        "%d/%m/%Y %H:%M:%S",
+        "%d/%m/%Y %H:%M",
+        "%d-%m-%Y %H:%M:%S",
+        "%d-%m-%Y %H:%M",
+        "%Y-%m-%d %H:%M:%S",
+        "%Y-%m-%d %H:%M",
+        "%d/%m/%Y",
+        "%Y-%m-%d",
+    ]
+
+    parsed = pd.to_datetime(pd.Series([pd.NaT] * len(s)), errors="coerce")
+    for fmt in formats:
+        try:
+            this_try = pd.to_datetime(s, format=fmt, dayfirst=True, errors="coerce")
+            parsed = parsed.fillna(this_try)
+        except Exception:
+            continue
+
+    if parsed.isna().sum() > 0:
+        fallback = pd.to_datetime(s, dayfirst=True, errors="coerce")
+        parsed = parsed.fillna(fallback)
+
+    def clean_iso(x):
+        if isinstance(x, str):
+            m = re.match(r".*?(\d{4}-\d{2}-\d{2}).*?(\d{2}:\d{2}(:\d{2})?).*", x)
+            if m:
+                return pd.to_datetime(m.group(1) + " " + m.group(2), dayfirst=False, errors="coerce")
+        return x
+
+    if parsed.isna().sum() > 0:
+        mask = parsed.isna()
+        if mask.any():
+            remaining = s[mask].apply(clean_iso)
+            parsed.loc[mask] = pd.to_datetime(remaining, errors="coerce")
+
+    return parsed
+
+
+def generar_fechas(filas: int, seed: int = 0) -> pd.Series:
+    """Serie sintética con la mezcla típica de un export vwCRMLeads."""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp("2025-01-01")
+    fechas = base + pd.to_timedelta(rng.integers(0, 300 * 24 * 60, filas), unit="min")
+    formato = rng.choice(6, size=filas, p=[0.77, 0.15, 0.04, 0.01, 0.02, 0.01])
+    valores = np.empty(filas, dtype=object)
+    valores[formato == 0] = fechas[formato == 0].strftime("%d/%m/%Y %H:%M")
+    valores[formato == 1] = fechas[formato == 1].strftime("%Y-%m-%d %H:%M:%S")
+    valores[formato == 2] = ""
+    valores[formato == 3] = fechas[formato == 3].strftime("Pagado %Y-%m-%dT%H:%M:%SZ")
+    # ISO con "T" mezclado con dd/mm: no debe leerse con el día primero
+    valores[formato == 4] = fechas[formato == 4].strftime("%Y-%m-%dT%H:%M:%S")
+    valores[formato == 5] = fechas[formato == 5].strftime("%Y-%m-%dT%H:%M")
+    return pd.Series(valores)
+
+
+def _medir(func, serie: pd.Series, repeticiones: int, preparar=None) -> tuple:
+    mejor = float("inf")
+    resultado = None
+    for _ in range(repeticiones):
+        if preparar is not None:
+            preparar()
+        inicio = time.perf_counter()
+        resultado = func(serie)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=500_000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    serie = generar_fechas(args.filas)
+    t_cascada, r_cascada = _medir(_try_parse_dates_cascada, serie, args.repeticiones)
+    t_nuevo, r_nuevo = _medir(_try_parse_dates, serie, args.repeticiones, preparar=limpiar_cache_fechas)
+    # Segunda carga del mismo export: todos los valores únicos ya están en caché
+    t_cache, _ = _medir(_try_parse_dates, serie, args.repeticiones)
+
+    iguales = r_cascada.astype("datetime64[ns]").equals(r_nuevo.astype("datetime64[ns]"))
+    print(f"filas: {args.filas}")
+    print(f"cascada:            {t_cascada:8.3f} s")
+    print(f"detección formato:  {t_nuevo:8.3f} s  ({t_cascada / t_nuevo:.1f}x)")
+    print(f"con caché caliente: {t_cache:8.3f} s  ({t_cascada / t_cache:.1f}x)")
+    print(f"resultados iguales: {iguales}")
+    print(f"caché de fechas:    {estadisticas_cache_fechas()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark de la limpieza UDLA: mapeo de encabezados por columna y reglas con
+.apply(lambda) (implementación anterior de render_udla) vs.
+depurador_streamlit.clean_udla (mapa precalculado y operaciones .str vectorizadas).
+
+Uso:
+    python -m benchmarks.bench_udla [--filas 1000000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from depurador_streamlit import COMMON_HEADER_MAP, TARGET_COLUMNS, clean_udla, merged_header_map, normalize_header
+
+
+def limpiar_con_apply(df: pd.DataFrame) -> pd.DataFrame:
+    """Implementación anterior, como referencia."""
+    header_map = merged_header_map("UDLA")
+    mapping = {}
+    for col in df.columns:
+        n = normalize_header(col)
+        mapped = header_map.get(n) or COMMON_HEADER_MAP.get(n)
+        if mapped:
+            mapping[col] = mapped
+
+    out = pd.DataFrame(columns=TARGET_COLUMNS)
+    for raw_col, mapped_col in mapping.items():
+        out[mapped_col] = df[raw_col].astype(str).fillna("")
+    for c in TARGET_COLUMNS:
+        if c not in out.columns:
+            out[c] = ""
+    out = out[TARGET_COLUMNS]
+
+    out["Identificación Alumno"] = out["Identificación Alumno"].astype(str).apply(lambda s: s.replace(" ", "").replace("-", ""))
+    out["Correo"] = out["Correo"].astype(str).apply(lambda s: s.strip().lower())
+    return out
+
+
+def generar_df(filas: int, seed: int = 3) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(1_000_000, 9_999_999, filas)
+    df = pd.DataFrame({
+        "Nombre": [f"Alumno {i}" for i in range(filas)],
+        "Email": [f"  Alumno.{i}@UDLA.edu.ec " for i in range(filas)],
+        "Identificación": [f"{i // 1000}-{i % 1000} 9" for i in ids],
+        "Nombre Pago": "Matrícula maestría",
+        "Otra columna": "x",
+    }, dtype="str")
+    return df
+
+
+def _medir(func, *args):
+    t0 = time.perf_counter()
+    resultado = func(*args)
+    return time.perf_counter() - t0, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    df = generar_df(args.filas)
+    t_viejo, viejo = _medir(limpiar_con_apply, df)
+    t_nuevo, nuevo = _medir(clean_udla, df)
+
+    print(f"filas: {args.filas}")
+    print(f"apply(lambda):  {t_viejo:8.3f} s")
+    print(f"clean_udla:     {t_nuevo:8.3f} s  ({t_viejo / t_nuevo:,.1f}x)")
+    print(f"resultados iguales: {viejo.equals(nuevo)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import streamlit as st
 import pandas as pd
-import io, csv, unicodedata, html, json
+import io, csv, codecs, functools, hashlib, unicodedata, html, json
 
 # NOTA: eliminé set_page_config y llamadas top-level para que este módulo
 # pueda importarse desde app.py sin interferir con la configuración principal.
 
+@functools.lru_cache(maxsize=1024)
 def normalize_header(s):
     if s is None:
         return ""
@@ -15,6 +16,8 @@ def normalize_header(s):
     s = " ".join(s.split())
     return s
 
+SNIFF_BYTES = 64 * 1024
+
 def detect_delimiter(sample):
     try:
         sniffer = csv.Sniffer()
@@ -25,13 +28,50 @@ def detect_delimiter(sample):
             return "\t"
         return ","
 
-def read_text_to_df(text):
-    sep = detect_delimiter(text)
+def detect_encoding(sample):
+    """Codificación a partir de los primeros bytes: BOM, UTF-8 si decodifica, si no latin-1."""
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    if sample.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return "utf-16"
+    try:
+        # decodificador incremental: un carácter multibyte cortado al final de la muestra no es error
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def _parse_csv(make_buffer, sep, encoding=None):
+    """
+    Parser C sobre el buffer; si el texto no es de la codificación detectada se reintenta
+    en latin-1, y solo los archivos mal formados pasan al parser python.
+    """
+    kwargs = {"encoding": encoding} if encoding else {}
+    try:
+        return pd.read_csv(make_buffer(), sep=sep, dtype=str, engine="c", **kwargs)
+    except UnicodeDecodeError:
+        kwargs["encoding"] = "latin-1"
+        try:
+            return pd.read_csv(make_buffer(), sep=sep, dtype=str, engine="c", **kwargs)
+        except (pd.errors.ParserError, ValueError):
+            pass
+    except (pd.errors.ParserError, ValueError):
+        pass
     try:
-        df = pd.read_csv(io.StringIO(text), sep=sep, engine='python', dtype=str)
+        return pd.read_csv(make_buffer(), sep=sep, engine='python', dtype=str, **kwargs)
     except Exception:
-        df = pd.read_csv(io.StringIO(text), sep=",", dtype=str, engine='python')
-    return df
+        return pd.read_csv(make_buffer(), sep=",", dtype=str, engine='python', **kwargs)
+
+def read_bytes_to_df(raw):
+    """Lee un CSV/TSV subido sin decodificarlo entero: codificación y separador se detectan con los primeros KB."""
+    sample = raw[:SNIFF_BYTES]
+    encoding = detect_encoding(sample)
+    sep = detect_delimiter(sample.decode(encoding, errors="replace"))
+    return _parse_csv(lambda: io.BytesIO(raw), sep, encoding)
+
+def read_text_to_df(text):
+    sep = detect_delimiter(text[:SNIFF_BYTES])
+    return _parse_csv(lambda: io.StringIO(text), sep)
 
 COMMON_HEADER_MAP = {
     "alumno":"Alumno","alum":"Alumno","estudiante":"Alumno","nombre alumno":"Alumno","nombre":"Alumno","alumno nombre":"Alumno","alumno completo":"Alumno",
@@ -54,58 +94,92 @@ def merged_header_map(vista_key):
 
 TARGET_COLUMNS = ["Alumno","Correo","Identificación Alumno","Nombre Pago"]
 
+# Mapa UDLA precalculado con las claves ya normalizadas (como se comparan los encabezados)
+UDLA_NORMALIZED_HEADER_MAP = {normalize_header(k): v for k, v in merged_header_map("UDLA").items()}
+
+def map_udla_columns(columns):
+    """{columna del archivo: columna destino}; si varias apuntan al mismo destino gana la última."""
+    return {col: UDLA_NORMALIZED_HEADER_MAP[n] for col in columns if (n := normalize_header(col)) in UDLA_NORMALIZED_HEADER_MAP}
+
+def clean_udla(df):
+    """
+    Función pura (sin Streamlit): deja solo TARGET_COLUMNS y aplica las reglas UDLA con
+    operaciones vectorizadas .str: la identificación sin espacios ni guiones y el correo
+    sin espacios en los extremos y en minúsculas. Los vacíos quedan como "".
+    """
+    sources = {mapped: col for col, mapped in map_udla_columns(df.columns).items()}
+    out = pd.DataFrame(
+        {c: df[sources[c]].fillna("").astype(str) if c in sources else "" for c in TARGET_COLUMNS},
+        index=df.index,
+    )
+    out["Identificación Alumno"] = out["Identificación Alumno"].str.replace(" ", "", regex=False).str.replace("-", "", regex=False)
+    out["Correo"] = out["Correo"].str.strip().str.lower()
+    return out
+
+# Resultados y exportaciones cacheados por hash del contenido (los argumentos con "_" no
+# forman parte de la clave); el TSV para el portapapeles solo se envía al navegador si
+# se pide y no supera CLIPBOARD_MAX_BYTES
+CACHE_MAX_ENTRIES = 4
+CLIPBOARD_MAX_BYTES = 5 * 1024 * 1024
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_udla(content_key, _content):
+    """DataFrame UDLA depurado a partir de bytes subidos o texto pegado."""
+    df = read_bytes_to_df(_content) if isinstance(_content, bytes) else read_text_to_df(_content)
+    return clean_udla(df)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def export_udla(content_key, _out, sep=","):
+    """CSV (o TSV con sep="\\t") en UTF-8; se genera la primera vez que se pide."""
+    return _out.to_csv(index=False, sep=sep).encode("utf-8")
+
 def render_udla():
     st.title("Depurador - UDLA maestrías")
     st.markdown("Sube o pega un CSV/TSV con encabezados. Se conservarán solo: Alumno, Correo, Identificación Alumno, Nombre Pago.")
     uploaded = st.file_uploader("Subir archivo CSV / TSV", type=["csv","txt"], accept_multiple_files=False)
     text_area = st.text_area("O pega aquí los datos (CSV/TSV) — incluye la fila de encabezados", height=180)
-    content_text = None
+    raw = None
     if uploaded is not None:
         try:
-            raw = uploaded.read()
-            try:
-                content_text = raw.decode("utf-8")
-            except Exception:
-                content_text = raw.decode("latin-1")
+            raw = uploaded.getvalue()
         except Exception as e:
             st.error(f"Error leyendo archivo: {e}")
-    if text_area and not content_text:
-        content_text = text_area
 
-    if not content_text:
+    if not raw and not text_area:
         st.info("Sube un archivo CSV/TSV o pega los datos para comenzar.")
         return
 
-    st.info("Procesando...")
-    df = read_text_to_df(content_text)
-
-    header_map = merged_header_map("UDLA")
-    mapping = {}
-    for col in df.columns:
-        n = normalize_header(col)
-        mapped = header_map.get(n) or COMMON_HEADER_MAP.get(n)
-        if mapped:
-            mapping[col] = mapped
-
-    out = pd.DataFrame(columns=TARGET_COLUMNS)
-    for raw_col, mapped_col in mapping.items():
-        out[mapped_col] = df[raw_col].astype(str).fillna("")
-
-    for c in TARGET_COLUMNS:
-        if c not in out.columns:
-            out[c] = ""
-    out = out[TARGET_COLUMNS]
-
-    # Reglas UDLA
-    out["Identificación Alumno"] = out["Identificación Alumno"].astype(str).apply(lambda s: s.replace(" ", "").replace("-", ""))
-    out["Correo"] = out["Correo"].astype(str).apply(lambda s: s.strip().lower())
+    content = raw if raw else text_area
+    key = content_hash(content)
+    with st.spinner("Procesando..."):
+        out = load_udla(key, content)
 
     st.subheader("Vista previa - datos depurados")
     st.dataframe(out.head(1000))
 
-    csv_bytes = out.to_csv(index=False).encode("utf-8")
-    tsv_text = out.to_csv(index=False, sep="\t")
-    st.download_button("Descargar CSV", data=csv_bytes, file_name="depurado_udla.csv", mime="text/csv")
+    # Descargas diferidas: el archivo se genera (y cachea) solo al pulsar el botón
+    col_csv, col_tsv = st.columns(2)
+    with col_csv:
+        st.download_button("Descargar CSV", data=lambda: export_udla(key, out), file_name="depurado_udla.csv", mime="text/csv", on_click="ignore")
+    with col_tsv:
+        st.download_button("Descargar TSV", data=lambda: export_udla(key, out, sep="\t"), file_name="depurado_udla.tsv", mime="text/tab-separated-values", on_click="ignore")
+
+    # El TSV para el portapapeles se incrusta en la página solo a pedido y con tope de tamaño
+    if st.session_state.get("udla_copy_key") != key:
+        if st.button("Preparar copia como TSV (pegar en Excel)"):
+            st.session_state["udla_copy_key"] = key
+        else:
+            return
+    tsv_bytes = export_udla(key, out, sep="\t")
+    if len(tsv_bytes) > CLIPBOARD_MAX_BYTES:
+        st.warning(f"El TSV ocupa {len(tsv_bytes) / 1024 / 1024:.1f} MB, demasiado para copiarlo desde el navegador. Usa 'Descargar TSV'.")
+        return
+    tsv_text = tsv_bytes.decode("utf-8")
 
     # Para evitar problemas de sintaxis por llaves en f-strings, serializamos el TSV a JSON
     # y concatenamos la cadena JS sin usar f-strings que interpretan { }.
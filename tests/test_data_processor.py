@@ -0,0 +1,89 @@
+"""
+_try_parse_dates (detección de formato) frente a la cascada histórica de ocho
+formatos que conserva benchmarks/bench_paiddate.py: mismos resultados para cada
+formato conocido, fechas inválidas, caracteres invisibles y columnas mezcladas.
+Las fechas ISO con 'T' son la excepción: la cascada las leía con dayfirst.
+"""
+import warnings
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from benchmarks.bench_paiddate import _try_parse_dates_cascada
+from utils import data_processor
+from utils.data_processor import _FORMATOS_FECHA, _detectar_formatos, _try_parse_dates, limpiar_cache_fechas
+
+# Días a ambos lados del 12 para que un día/mes invertido se note
+FECHAS = [datetime(2025, 1, 1, 8, 5, 7) + timedelta(days=3 * i, minutes=37 * i) for i in range(40)]
+FORMATOS_T = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M"]
+
+
+@pytest.fixture(autouse=True)
+def cache_vacia():
+    limpiar_cache_fechas()
+    yield
+    limpiar_cache_fechas()
+
+
+def _parsear(valores) -> tuple:
+    """(nuevo, cascada) para la misma serie, sin los avisos de dateutil del fallback."""
+    serie = pd.Series(valores, dtype=object)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return _try_parse_dates(serie), _try_parse_dates_cascada(serie)
+
+
+def _truncar(fecha: datetime, fmt: str) -> pd.Timestamp:
+    return pd.Timestamp(datetime.strptime(fecha.strftime(fmt), fmt))
+
+
+@pytest.mark.parametrize("fmt", [fmt for fmt, _ in _FORMATOS_FECHA if fmt not in FORMATOS_T])
+def test_cada_formato_igual_que_la_cascada(fmt):
+    nuevo, cascada = _parsear([f.strftime(fmt) for f in FECHAS])
+    assert nuevo.tolist() == cascada.tolist() == [_truncar(f, fmt) for f in FECHAS]
+
+
+@pytest.mark.parametrize("fmt", FORMATOS_T + ["%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S.123", "%Y-%m-%dT%H:%M:%S.123Z"])
+def test_iso_con_t_zona_y_milisegundos(fmt):
+    nuevo, cascada = _parsear([f.strftime(fmt) for f in FECHAS])
+    # Con zona o milisegundos se conserva hasta el segundo (PaidDate se guarda al minuto)
+    assert nuevo.tolist() == [_truncar(f, fmt.split(".")[0].rstrip("Z")) for f in FECHAS]
+    assert nuevo.dt.tz is None
+    # La cascada leía estas columnas con dayfirst: 2025-01-04 quedaba como 1 de abril
+    assert [pd.Timestamp(v).tz_localize(None) for v in cascada] != nuevo.tolist()
+
+
+@pytest.mark.parametrize("valor", ["31/02/2025 10:00", "31/02/2025", "31-02-2025 10:00:00", "2025-02-31 10:00",
+                                   "2025-02-30", "32/01/2025", "basura", "", "nan", None])
+def test_fecha_invalida_con_forma_de_formato(valor):
+    nuevo, cascada = _parsear([valor, "02/01/2025 10:30"])
+    assert pd.isna(nuevo[0]) and pd.isna(cascada[0])
+    assert nuevo[1] == cascada[1] == pd.Timestamp(2025, 1, 2, 10, 30)
+
+
+@pytest.mark.parametrize("valor", ["​02/01/2025 10:30", "02/01/2025 10:30​", "  02/01/2025​ 10:30 "])
+def test_espacio_de_ancho_cero(valor):
+    nuevo, cascada = _parsear([valor])
+    assert nuevo[0] == cascada[0] == pd.Timestamp(2025, 1, 2, 10, 30)
+
+
+def test_formato_raro_fuera_de_la_muestra():
+    valores = [(FECHAS[i % len(FECHAS)]).strftime("%d/%m/%Y %H:%M") for i in range(3000)]
+    serie = pd.Series(valores)
+    muestra = serie.sample(n=data_processor._TAMANO_MUESTRA_FECHAS, random_state=0)
+    fuera = [i for i in serie.index if i not in set(muestra.index)]
+    raros = {fuera[0]: "14-01-2025 10:30:15", fuera[1]: "2025-01-14 10:30", fuera[2]: "14/01/2025",
+             fuera[3]: "31/02/2025 10:00", fuera[4]: "​14/01/2025 10:30", fuera[5]: "2025-01-14"}
+    for i, valor in raros.items():
+        valores[i] = valor
+    # Precondición: la muestra (la misma que toma _parsear_fechas) solo ve un formato
+    assert _detectar_formatos(pd.Series(valores).loc[muestra.index].tolist()) == ["%d/%m/%Y %H:%M"]
+
+    nuevo, cascada = _parsear(valores)
+    assert nuevo.tolist()[:50] == cascada.tolist()[:50]
+    assert nuevo.isna().tolist() == cascada.isna().tolist()
+    assert nuevo.dropna().tolist() == cascada.dropna().tolist()
+    assert [nuevo[i] for i in raros] == [pd.Timestamp(2025, 1, 14, 10, 30, 15), pd.Timestamp(2025, 1, 14, 10, 30),
+                                         pd.Timestamp(2025, 1, 14), pd.NaT, pd.Timestamp(2025, 1, 14, 10, 30),
+                                         pd.Timestamp(2025, 1, 14)]
@@ -0,0 +1,136 @@
+"""
+Revisión incremental de rezagados en actualizar_maestro: qué filas de Ventas se
+examinan según los hashes de Estatus guardados y el CRC de la hoja, y que el índice
+de LEAD queda igual que el libro guardado. La reescritura completa no deja copias
+del maestro en disco.
+"""
+import logging
+import os
+import re
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from utils import excel_manager
+from utils.excel_manager import actualizar_maestro
+from utils.lead_index import IndiceLeads, hash_estatus
+from utils.xlsx_incremental import HojaXlsx
+
+PERIODO = "202592"
+VENTAS = f"Ventas Nuevas Maestrías {PERIODO}"
+REZAGADOS = f"Rezagados Maestrías {PERIODO}"
+
+
+@pytest.fixture
+def ruta(tmp_path, monkeypatch):
+    def completo(*args, **kwargs):
+        raise AssertionError("se reescribió el libro completo")
+    monkeypatch.setattr(excel_manager, "_actualizar_maestro_completo", completo)
+
+    ruta = str(tmp_path / "maestro.xlsx")
+    wb = Workbook()
+    ventas = wb.active
+    ventas.title = VENTAS
+    ventas.append(["LEAD", "Email", "Estatus"])
+    for i in range(1, 11):
+        ventas.append([str(i), f"alumno{i}@example.com", "Pospone" if i == 4 else "Inscrito"])
+    wb.create_sheet(REZAGADOS).append(["LEAD", "Email", "Estatus"])
+    wb.save(ruta)
+    return ruta
+
+
+@pytest.fixture
+def examinadas(caplog):
+    """Filas examinadas en cada revisión de rezagados (del log de actualizar_maestro)."""
+    caplog.set_level(logging.INFO, logger=excel_manager.__name__)
+
+    def leer():
+        return [int(m.group(1)) for m in re.finditer(r"Revisión de rezagados: (\d+) de", caplog.text)]
+    return leer
+
+
+def _lote(*leads, estatus="Inscrito") -> pd.DataFrame:
+    return pd.DataFrame({"LEAD": list(leads), "Email": [f"alumno{l}@example.com" for l in leads], "Estatus": estatus})
+
+
+def _comprobar_indice(ruta: str):
+    """La tabla leads coincide con el libro y los hashes de estatus con la hoja de Ventas."""
+    wb = load_workbook(ruta, read_only=True)
+    with IndiceLeads(ruta) as indice:
+        for hoja in (VENTAS, REZAGADOS):
+            filas = list(wb[hoja].iter_rows(values_only=True))
+            col = filas[0].index("LEAD")
+            assert indice.filas(hoja) == {f[col]: r for r, f in enumerate(filas[1:], start=2)}
+        encabezados, *filas = wb[VENTAS].iter_rows(values_only=True)
+        lead, estatus = encabezados.index("LEAD"), encabezados.index("Estatus")
+        assert indice.hashes_estatus(VENTAS) == {f[lead]: hash_estatus(f[estatus]) for f in filas}
+
+
+def _editar_fuera(ruta: str, lead: str, columna: int, valor: str):
+    """Edita una celda de Ventas con openpyxl, como haría alguien en Excel."""
+    wb = load_workbook(ruta)
+    ventas = wb[VENTAS]
+    fila = next(r for r in range(2, ventas.max_row + 1) if ventas.cell(r, 1).value == lead)
+    ventas.cell(fila, columna).value = valor
+    wb.save(ruta)
+
+
+def _leads(ruta: str, hoja: str) -> list:
+    return list(pd.read_excel(ruta, sheet_name=hoja, dtype=str)["LEAD"])
+
+
+def test_primera_revision_sin_hashes_examina_todo(ruta, examinadas):
+    assert actualizar_maestro(_lote("11"), ruta, PERIODO) == (1, 1)
+    assert examinadas() == [10]
+    assert _leads(ruta, VENTAS) == ["1", "2", "3", "5", "6", "7", "8", "9", "10", "11"]
+    assert _leads(ruta, REZAGADOS) == ["4"]
+    _comprobar_indice(ruta)
+
+
+def test_estatus_sin_cambios_no_se_examina(ruta, examinadas):
+    actualizar_maestro(_lote("11"), ruta, PERIODO)
+    # La hoja cambia fuera de la app (otro CRC), pero ningún Estatus
+    _editar_fuera(ruta, "5", 2, "otro@example.com")
+    actualizar_maestro(_lote("12", "13", estatus=["Inscrito", "Pospone"]), ruta, PERIODO)
+    assert examinadas() == [10, 0]
+    assert _leads(ruta, VENTAS)[-2:] == ["11", "12"]
+    assert _leads(ruta, REZAGADOS) == ["4", "13"]
+    _comprobar_indice(ruta)
+
+
+def test_estatus_editado_fuera_de_la_app(ruta, examinadas):
+    actualizar_maestro(_lote("11"), ruta, PERIODO)
+    _editar_fuera(ruta, "7", 3, "pOSPONE hasta enero")
+
+    assert actualizar_maestro(None, ruta, PERIODO, only_manage_rezagados=True) == (0, 1)
+    assert examinadas() == [10, 1]
+    assert "7" not in _leads(ruta, VENTAS)
+    assert _leads(ruta, REZAGADOS) == ["4", "7"]
+    _comprobar_indice(ruta)
+
+
+def test_mismo_crc_no_lee_la_hoja(ruta, examinadas, monkeypatch):
+    actualizar_maestro(None, ruta, PERIODO, only_manage_rezagados=True)
+    lecturas = []
+    filas = HojaXlsx.filas
+    monkeypatch.setattr(HojaXlsx, "filas", property(lambda hoja: lecturas.append(hoja.nombre) or filas.fget(hoja)))
+
+    assert actualizar_maestro(None, ruta, PERIODO, only_manage_rezagados=True) == (0, 0)
+    assert examinadas() == [10]
+    assert lecturas == []
+    _comprobar_indice(ruta)
+
+
+def test_reescritura_completa_no_deja_copias_del_maestro(tmp_path):
+    ruta = str(tmp_path / "maestro.xlsx")
+    excel_manager.actualizar_maestro(_lote("1", "2"), ruta, PERIODO, incremental=False)
+    # Copia dejada por una versión anterior con caché en disco
+    cache = tmp_path / ".cache_maestro"
+    cache.mkdir()
+    prefijo = excel_manager.hashlib.sha1(os.path.abspath(ruta).encode("utf-8")).hexdigest()[:16]
+    (cache / f"{prefijo}_1_2.pkl").write_bytes(b"datos personales")
+
+    excel_manager.actualizar_maestro(_lote("3"), ruta, PERIODO, incremental=False)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["maestro.xlsx"]
+    assert _leads(ruta, VENTAS) == ["1", "2", "3"]
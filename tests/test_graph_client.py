@@ -0,0 +1,278 @@
+"""
+GraphClient contra un servidor local: reintentos ante throttling (429/503 con
+Retry-After), 502/504 reintentados solo en métodos idempotentes y subida de filas
+secuencial y en orden, también al reanudar.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from utils import graph_client
+from utils.graph_client import GraphClient, SubidaInterrumpida, limpiar_caches_graph
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _responder(self):
+        servidor = self.server
+        longitud = int(self.headers.get("Content-Length") or 0)
+        cuerpo = self.rfile.read(longitud) if longitud else b""
+        with servidor.lock:
+            servidor.peticiones.append((self.command, self.path, cuerpo))
+            servidor.en_curso += 1
+            servidor.max_en_curso = max(servidor.max_en_curso, servidor.en_curso)
+        # No time.sleep: los tests lo sustituyen para registrar las esperas del cliente
+        threading.Event().wait(servidor.demora)
+        if servidor.guion:
+            status, headers, body = servidor.guion.pop(0)
+        elif self.path.endswith("$batch"):
+            status, headers, body = 200, {}, {"responses": self._batch(json.loads(cuerpo)["requests"])}
+        else:
+            status, headers, body = 200, {}, {}
+        with servidor.lock:
+            servidor.en_curso -= 1
+        datos = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        for nombre, valor in headers.items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _batch(self, subpeticiones: list) -> list:
+        """
+        rows/add en orden: 201 y las filas se añaden a servidor.filas, salvo los ids de
+        servidor.fallar (400); como en Graph, lo que depende de una sub-petición fallida es 424.
+        """
+        respuestas, fallidas = [], set()
+        for sub in subpeticiones:
+            if set(sub.get("dependsOn", [])) & fallidas:
+                status = 424
+            elif sub["id"] in self.server.fallar:
+                status = 400
+            else:
+                status = 201
+                self.server.filas.extend(sub["body"]["values"])
+            if status != 201:
+                fallidas.add(sub["id"])
+            respuestas.append({"id": sub["id"], "status": status, "headers": {}, "body": {}})
+        return respuestas
+
+    do_GET = do_POST = _responder
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.guion = []
+    srv.peticiones = []
+    srv.fallar = set()
+    srv.filas = []
+    srv.demora = 0.0
+    srv.lock = threading.Lock()
+    srv.en_curso = srv.max_en_curso = 0
+    hilo = threading.Thread(target=srv.serve_forever, daemon=True)
+    hilo.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(autouse=True)
+def caches_limpias():
+    limpiar_caches_graph()
+    yield
+    limpiar_caches_graph()
+
+
+@pytest.fixture
+def esperas(monkeypatch):
+    """Esperas pedidas a time.sleep por graph_client (sin dormir de verdad)."""
+    registradas = []
+    monkeypatch.setattr(graph_client.time, "sleep", registradas.append)
+    return registradas
+
+
+def _cliente(servidor, **opciones) -> GraphClient:
+    # backoff_base alto: si se ignorara Retry-After, las esperas serían mucho mayores
+    opciones = {"max_reintentos": 5, "backoff_base": 50.0, "backoff_max": 120.0, **opciones}
+    gc = GraphClient(graph_base=f"http://127.0.0.1:{servidor.server_port}", usar_sesion=False, **opciones)
+    gc.access_token = "token-de-prueba"
+    return gc
+
+
+def test_reintenta_429_y_503_respetando_retry_after(servidor, esperas):
+    servidor.guion = [
+        (429, {"Retry-After": "2"}, {"error": {"code": "TooManyRequests"}}),
+        (503, {"Retry-After": "1"}, {"error": {"code": "serviceNotAvailable"}}),
+        (200, {}, {"value": [{"name": "Hoja1"}]}),
+    ]
+    with _cliente(servidor) as gc:
+        datos = gc._json("GET", "me/drive/items/abc/workbook/worksheets")
+
+    assert datos == {"value": [{"name": "Hoja1"}]}
+    assert len(servidor.peticiones) == 3
+    assert esperas == [2.0, 1.0]
+
+
+def test_retry_after_acotado_por_backoff_max(servidor, esperas):
+    servidor.guion = [(429, {"Retry-After": "3600"}, {}), (200, {}, {})]
+    with _cliente(servidor, backoff_max=10.0) as gc:
+        gc._json("GET", "me")
+    assert esperas == [10.0]
+
+
+def test_sin_retry_after_usa_backoff_exponencial(servidor, esperas):
+    servidor.guion = [(503, {}, {}), (503, {}, {}), (200, {}, {})]
+    with _cliente(servidor, backoff_base=1.0) as gc:
+        gc._json("GET", "me")
+    assert len(esperas) == 2
+    assert 0.5 <= esperas[0] <= 1.0 and 1.0 <= esperas[1] <= 2.0
+
+
+def test_4xx_no_reintentable_falla_de_inmediato(servidor, esperas):
+    servidor.guion = [(404, {}, {"error": {"code": "itemNotFound"}}), (200, {}, {})]
+    with _cliente(servidor) as gc, pytest.raises(requests.HTTPError) as error:
+        gc._json("GET", "me/drive/items/abc")
+    assert error.value.response.status_code == 404
+    assert len(servidor.peticiones) == 1
+    assert esperas == []
+
+
+def test_se_rinde_tras_max_reintentos(servidor, esperas):
+    servidor.guion = [(503, {"Retry-After": "1"}, {})] * 10
+    with _cliente(servidor, max_reintentos=3) as gc, pytest.raises(requests.HTTPError) as error:
+        gc._json("POST", "me/drive/items/abc/workbook/createSession", json={"persistChanges": True})
+    assert error.value.response.status_code == 503
+    assert len(servidor.peticiones) == 4
+    assert esperas == [1.0, 1.0, 1.0]
+
+
+@pytest.mark.parametrize("status", [502, 504])
+def test_502_504_solo_se_reintentan_en_metodos_idempotentes(servidor, esperas, status):
+    servidor.guion = [(status, {}, {}), (200, {}, {}), (status, {}, {}), (200, {}, {})]
+    with _cliente(servidor) as gc:
+        gc._json("GET", "me/drive/items/abc/workbook/tables")
+        assert len(servidor.peticiones) == 2
+        # Una escritura pudo aplicarse aunque la pasarela responda 502/504: no se repite
+        with pytest.raises(requests.HTTPError) as error:
+            gc._json("POST", "me/drive/items/abc/workbook/tables/T1/rows/add", json={"values": [["1"]]})
+    assert error.value.response.status_code == status
+    assert len(servidor.peticiones) == 3
+    assert len(esperas) == 1
+
+
+def test_batch_502_solo_se_reintenta_si_todas_las_subpeticiones_son_idempotentes(servidor, esperas):
+    servidor.guion = [(502, {}, {}), (200, {}, {"responses": [{"id": "1", "status": 200, "headers": {}, "body": {}}]}),
+                      (502, {}, {})]
+    with _cliente(servidor) as gc:
+        gc.batch([{"id": "1", "method": "GET", "url": "/me"}])
+        assert len(servidor.peticiones) == 2
+        with pytest.raises(requests.HTTPError):
+            gc.batch([{"id": "1", "method": "GET", "url": "/me"},
+                      {"id": "2", "method": "POST", "url": "/me/drive/items/abc/workbook/tables/T1/rows/add",
+                       "body": {"values": [["1"]]}}])
+    assert len(servidor.peticiones) == 3
+
+
+def test_batch_subrespuesta_504_de_escritura_no_se_reintenta(servidor, esperas):
+    servidor.guion = [
+        (200, {}, {"responses": [
+            {"id": "1", "status": 504, "headers": {}, "body": {}},
+            {"id": "2", "status": 504, "headers": {}, "body": {}},
+            {"id": "3", "status": 503, "headers": {"Retry-After": "1"}, "body": {}},
+        ]}),
+        (200, {}, {"responses": [
+            {"id": "1", "status": 200, "headers": {}, "body": {}},
+            {"id": "3", "status": 201, "headers": {}, "body": {}},
+        ]}),
+    ]
+    with _cliente(servidor) as gc:
+        respuestas = gc.batch([{"id": "1", "method": "GET", "url": "/me"},
+                               {"id": "2", "method": "POST", "url": "/me/drive/items/abc/workbook/tables/T1/rows/add"},
+                               {"id": "3", "method": "POST", "url": "/me/drive/items/abc/workbook/tables/T1/rows/add"}],
+                              lanzar=False)
+
+    assert {i: r["status"] for i, r in respuestas.items()} == {"1": 200, "2": 504, "3": 201}
+    reenviadas = json.loads(servidor.peticiones[1][2])["requests"]
+    assert [s["id"] for s in reenviadas] == ["1", "3"]
+
+
+def test_batch_reintenta_solo_subpeticiones_con_throttling(servidor, esperas):
+    servidor.guion = [
+        (200, {}, {"responses": [
+            {"id": "1", "status": 200, "headers": {}, "body": {}},
+            {"id": "2", "status": 429, "headers": {"Retry-After": "3"}, "body": {}},
+        ]}),
+        (200, {}, {"responses": [{"id": "2", "status": 201, "headers": {}, "body": {}}]}),
+    ]
+    with _cliente(servidor) as gc:
+        respuestas = gc.batch([{"id": "1", "method": "GET", "url": "/me"},
+                               {"id": "2", "method": "GET", "url": "/me/drive"}])
+
+    assert {i: r["status"] for i, r in respuestas.items()} == {"1": 200, "2": 201}
+    assert esperas == [3.0]
+    reenviadas = json.loads(servidor.peticiones[1][2])["requests"]
+    assert [s["id"] for s in reenviadas] == ["2"]
+
+
+def test_upload_rows_secuencial_y_en_orden(servidor, esperas):
+    servidor.demora = 0.02
+    valores = [[str(i), f"alumno{i}@example.com"] for i in range(450)]
+    avance = []
+    with _cliente(servidor) as gc:
+        subidas = gc.upload_rows("ITEM0123456789", "tables/T1", valores, max_filas=10,
+                                 progreso=lambda hechas, total: avance.append(hechas))
+
+    assert subidas == 450
+    assert servidor.max_en_curso == 1
+    assert len(servidor.peticiones) == 3  # 45 fragmentos en llamadas $batch de 20
+    assert servidor.filas == valores
+    assert avance == [200, 400, 450]
+
+
+def test_upload_rows_interrumpida_reanuda_sin_huecos_ni_duplicados(servidor, esperas):
+    valores = [[str(i)] for i in range(450)]
+    servidor.fallar = {"filas25"}
+    with _cliente(servidor) as gc, pytest.raises(SubidaInterrumpida) as error:
+        gc.upload_rows("ITEM0123456789", "tables/T1", valores, max_filas=10)
+    # Falla el fragmento 25 de la segunda llamada: lo confirmado es el prefijo 0..24 y no
+    # se envía la tercera llamada
+    assert error.value.completados == list(range(25))
+    assert error.value.filas_completadas == 250
+    assert len(servidor.peticiones) == 2
+    assert servidor.filas == valores[:250]
+
+    servidor.fallar = set()
+    with _cliente(servidor) as gc:
+        gc.upload_rows("ITEM0123456789", "tables/T1", valores, max_filas=10, omitir=error.value.completados)
+    assert servidor.filas == valores
+
+
+def test_caches_de_metadatos_separadas_por_identidad(servidor, esperas):
+    url = "https://contoso.sharepoint.com/:x:/g/personal/ana/EAbc"
+    servidor.guion = [
+        (200, {}, {"id": "ITEM1", "parentReference": {"driveId": "D1"}}),
+        (200, {}, {"value": [{"name": "Hoja de Ana"}]}),
+        (200, {}, {"id": "ITEM1", "parentReference": {"driveId": "D1"}}),
+        (200, {}, {"value": [{"name": "Hoja de Ana"}]}),
+    ]
+    with _cliente(servidor, cuenta="oid-ana.tid") as ana, _cliente(servidor, cuenta="oid-luis.tid") as luis:
+        ana.get_workbook_worksheets(url)
+        ana.get_workbook_worksheets(url)
+        assert len(servidor.peticiones) == 2  # la segunda consulta de Ana sale de la caché
+
+        # Luis resuelve la URL y pide las hojas con su propio token, sin reutilizar lo de Ana
+        luis.access_token = "token-de-luis"
+        luis.get_workbook_worksheets(url)
+    assert len(servidor.peticiones) == 4
+    assert [p[1].split("?")[0] for p in servidor.peticiones[2:]] == [
+        "/shares/u!aHR0cHM6Ly9jb250b3NvLnNoYXJlcG9pbnQuY29tLzp4Oi9nL3BlcnNvbmFsL2FuYS9FQWJj/driveItem",
+        "/drives/D1/items/ITEM1/workbook/worksheets",
+    ]
@@ -0,0 +1,76 @@
+"""
+Paginación del historial: mismas páginas que leyendo el JSONL completo, pero
+decodificando solo los registros de la página (más, como mucho, un paso del índice).
+"""
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from utils import history_manager
+from utils.history_manager import (ARCHIVO_HISTORIAL, ARCHIVO_RESUMEN, cargar_historial, cargar_resumen_historial,
+                                   guardar_historial, leer_pagina_historial)
+
+TOTAL = 173
+
+
+def _registro(i: int) -> dict:
+    return {'timestamp': f'2025-09-{i % 28 + 1:02d} 10:00:00', 'archivo': f'leads_{i}.csv',
+            'filas_originales': 100, 'filas_depuradas': i % 100, 'periodo': '202592'}
+
+
+def _paginas_esperadas(registros: list, tamano: int) -> list:
+    recientes = list(reversed(registros))
+    return [recientes[i:i + tamano] for i in range(0, len(recientes), tamano)]
+
+
+@pytest.fixture
+def history_dir(tmp_path):
+    directorio = str(tmp_path)
+    for i in range(TOTAL):
+        guardar_historial(_registro(i), directorio)
+    return directorio
+
+
+@pytest.mark.parametrize("tamano", [50, 7, 200])
+def test_paginas_iguales_a_leer_todo(history_dir, tamano):
+    esperadas = _paginas_esperadas(cargar_historial(history_dir), tamano)
+    for pagina, esperada in enumerate(esperadas):
+        assert leer_pagina_historial(history_dir, pagina, tamano) == esperada
+    assert leer_pagina_historial(history_dir, len(esperadas), tamano) == []
+
+
+def test_pagina_solo_decodifica_sus_registros(history_dir, monkeypatch):
+    resumen = cargar_resumen_historial(history_dir)
+    llamadas = []
+
+    def loads(linea):
+        llamadas.append(linea)
+        return json.loads(linea)
+
+    monkeypatch.setattr(history_manager, "json", SimpleNamespace(loads=loads, dumps=json.dumps))
+    for pagina in range(4):
+        llamadas.clear()
+        leer_pagina_historial(history_dir, pagina, resumen=resumen)
+        assert len(llamadas) < 2 * history_manager._TAMANO_PAGINA
+
+
+def test_lineas_corruptas_y_resumen_antiguo(history_dir):
+    with open(os.path.join(history_dir, ARCHIVO_HISTORIAL), 'a', encoding='utf-8') as f:
+        f.write('{"incompleto": \n\n')
+    guardar_historial(_registro(TOTAL), history_dir)
+
+    # Resumen de una versión anterior, sin posiciones: se reconstruye
+    ruta_resumen = os.path.join(history_dir, ARCHIVO_RESUMEN)
+    with open(ruta_resumen, encoding='utf-8') as f:
+        resumen = json.load(f)
+    del resumen['desplazamientos']
+    with open(ruta_resumen, 'w', encoding='utf-8') as f:
+        json.dump(resumen, f)
+
+    registros = cargar_historial(history_dir)
+    assert len(registros) == TOTAL + 1
+    assert cargar_resumen_historial(history_dir)['total']['depuraciones'] == TOTAL + 1
+    for pagina, esperada in enumerate(_paginas_esperadas(registros, 50)):
+        assert leer_pagina_historial(history_dir, pagina) == esperada
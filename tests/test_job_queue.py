@@ -0,0 +1,103 @@
+"""
+ColaTrabajos: los trabajos de un recurso se ejecutan de uno en uno y en orden sobre
+un pool compartido, y al arrancar solo se interrumpen los trabajos de procesos que ya
+no existen (varias colas sobre la misma base simulan varios procesos de la app).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from utils.job_queue import COMPLETADO, EN_CURSO, INTERRUMPIDO, PENDIENTE, ColaTrabajos
+
+
+def _esperar_estado(cola, id_trabajo, estados, limite=5.0):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        estado = cola.estado(id_trabajo)
+        if estado["estado"] in estados:
+            return estado
+        time.sleep(0.01)
+    raise AssertionError(f"{id_trabajo} sigue en {cola.estado(id_trabajo)['estado']}")
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "trabajos.sqlite")
+
+
+@pytest.fixture
+def liberar():
+    evento = threading.Event()
+    yield evento
+    evento.set()
+
+
+def test_no_interrumpe_trabajos_de_otro_proceso_vivo(ruta, liberar):
+    cola_a = ColaTrabajos(ruta)
+    en_curso = cola_a.encolar("prueba", "recurso", lambda trabajo: liberar.wait(5))
+    pendiente = cola_a.encolar("prueba", "recurso", lambda trabajo: "ok")
+    _esperar_estado(cola_a, en_curso, {EN_CURSO})
+
+    cola_b = ColaTrabajos(ruta)  # otra instancia de la app con la misma base
+    assert [e["estado"] for e in cola_b.estados([en_curso, pendiente])] == [EN_CURSO, PENDIENTE]
+
+    liberar.set()
+    assert _esperar_estado(cola_a, pendiente, {COMPLETADO})["resultado"] == "ok"
+
+
+def test_interrumpe_trabajos_de_procesos_terminados(ruta, liberar):
+    cola_a = ColaTrabajos(ruta)
+    id_trabajo = cola_a.encolar("prueba", "recurso", lambda trabajo: liberar.wait(5))
+    _esperar_estado(cola_a, id_trabajo, {EN_CURSO})
+    cola_a._archivo_vivo.close()  # el proceso terminó: el sistema libera su bloqueo
+    # Filas de una versión anterior, sin propietario
+    with sqlite3.connect(ruta) as con:
+        con.execute("INSERT INTO trabajos (id, tipo, recurso, estado, creado) VALUES ('viejo', 'prueba', 'r', ?, 0)",
+                    (PENDIENTE,))
+
+    cola_b = ColaTrabajos(ruta)
+    assert [e["estado"] for e in cola_b.estados([id_trabajo, "viejo"])] == [INTERRUMPIDO, INTERRUMPIDO]
+    # El archivo del proceso terminado se limpia; queda solo el de cola_b
+    assert os.listdir(ruta + ".procesos") == [f"{cola_b.propietario}.lock"]
+
+
+def test_un_recurso_en_orden_y_recursos_distintos_en_paralelo(ruta):
+    cola = ColaTrabajos(ruta, max_hilos=3)
+    lock = threading.Lock()
+    orden, en_curso, maximos = [], {}, {}
+
+    def trabajo(_, recurso, n):
+        with lock:
+            en_curso[recurso] = en_curso.get(recurso, 0) + 1
+            maximos[recurso] = max(maximos.get(recurso, 0), en_curso[recurso])
+            orden.append((recurso, n))
+        time.sleep(0.01)
+        with lock:
+            en_curso[recurso] -= 1
+        return n
+
+    ids = [cola.encolar("prueba", recurso, trabajo, recurso, n) for n in range(5) for recurso in ("a", "b", "c")]
+    for id_trabajo in ids:
+        _esperar_estado(cola, id_trabajo, {COMPLETADO})
+
+    assert maximos == {"a": 1, "b": 1, "c": 1}
+    for recurso in ("a", "b", "c"):
+        assert [n for r, n in orden if r == recurso] == list(range(5))
+    # Ningún recurso conserva cola ni hilo propio una vez vacío
+    assert cola._pendientes == {}
+    assert len(cola._pool._threads) <= 3
+
+
+def test_recurso_sigue_tras_un_trabajo_fallido(ruta):
+    cola = ColaTrabajos(ruta)
+
+    def falla(_):
+        raise RuntimeError("sin conexión")
+
+    fallido = cola.encolar("prueba", "recurso", falla)
+    siguiente = cola.encolar("prueba", "recurso", lambda _: "ok")
+    assert _esperar_estado(cola, siguiente, {COMPLETADO})["resultado"] == "ok"
+    assert cola.estado(fallido)["mensaje"] == "sin conexión"
@@ -0,0 +1,40 @@
+"""
+ejecutar_pipeline con la depuración sustituida por DataFrames ya mapeados: los LEAD
+repetidos entre archivos cuentan una vez y --excel-url exige --hoja y --cuenta.
+"""
+import pandas as pd
+import pytest
+
+from utils import pipeline
+
+
+def _mapeado(*leads) -> pd.DataFrame:
+    return pd.DataFrame({"LEAD": list(leads), "Email": [f"alumno{l}@example.com" for l in leads]})
+
+
+def test_leads_repetidos_entre_archivos_cuentan_una_vez(tmp_path, monkeypatch):
+    resultados = [("a.csv", _mapeado("1", "2", "3"), 10, {}), ("b.csv", _mapeado("3", "4"), 8, {})]
+    monkeypatch.setattr(pipeline, "depurar_archivos", lambda rutas, procesos, **opciones: (resultados, {}))
+    consolidados = []
+    monkeypatch.setattr(pipeline, "actualizar_maestro",
+                        lambda df, ruta, periodo: consolidados.append(df) or (len(df), 0))
+
+    resumen = pipeline.ejecutar_pipeline(["a.csv", "b.csv"], maestro=str(tmp_path / "maestro.xlsx"),
+                                         history_dir=str(tmp_path / "history"))
+
+    assert list(consolidados[0]["LEAD"]) == ["1", "2", "3", "4"]
+    assert resumen["filas_depuradas"] == 4
+    assert resumen["filas_originales"] == 18
+
+
+@pytest.mark.parametrize("argumentos", [["--excel-url", "URL", "--cuenta", "ana@example.com"],
+                                        ["--excel-url", "URL", "--hoja", "Hoja1"]])
+def test_excel_url_requiere_hoja_y_cuenta(tmp_path, argumentos):
+    with pytest.raises(SystemExit) as salida:
+        pipeline.main([str(tmp_path), *argumentos])
+    assert salida.value.code == 2
+
+
+def test_ejecutar_pipeline_no_omite_el_envio_en_silencio():
+    with pytest.raises(ValueError):
+        pipeline.ejecutar_pipeline([], excel_url="URL", cuenta_excel="ana@example.com")
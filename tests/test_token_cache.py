@@ -0,0 +1,108 @@
+"""
+Caché de tokens: los tokens silenciosos son siempre de la cuenta indicada (nunca de otra
+cuenta del caché del proceso) y el caché solo se guarda en disco con una clave que no
+está junto a él.
+"""
+import base64
+import json
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+from utils import token_cache
+from utils.graph_client import GraphClient
+from utils.token_cache import CacheTokensCifrada, adquirir_token_silencioso, cuenta_de_resultado
+
+ANA = {"home_account_id": "oid-ana.tid", "username": "ana@example.com", "local_account_id": "oid-ana", "realm": "tid"}
+LUIS = {"home_account_id": "oid-luis.tid", "username": "luis@example.com", "local_account_id": "oid-luis", "realm": "tid"}
+
+
+class _AppFalsa:
+    """Lo que usa el módulo de msal.PublicClientApplication, con dos cuentas en el caché."""
+
+    def __init__(self, cuentas=(LUIS, ANA)):
+        self.cuentas = list(cuentas)
+        self.token_cache = None
+        self.pedidos = []
+
+    def get_accounts(self):
+        return list(self.cuentas)
+
+    def acquire_token_silent(self, scopes, account):
+        self.pedidos.append(account["home_account_id"])
+        return {"access_token": f"token-{account['username']}", "expires_in": 3600}
+
+
+def _client_info(uid: str, utid: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"uid": uid, "utid": utid}).encode()).decode().rstrip("=")
+
+
+def test_silencioso_solo_para_la_cuenta_indicada():
+    app = _AppFalsa()
+    assert adquirir_token_silencioso(app, ["User.Read"], "oid-ana.tid")["access_token"] == "token-ana@example.com"
+    assert adquirir_token_silencioso(app, ["User.Read"], "ANA@example.com")["access_token"] == "token-ana@example.com"
+    assert adquirir_token_silencioso(app, ["User.Read"], None) is None
+    assert adquirir_token_silencioso(app, ["User.Read"], "otra@example.com") is None
+    assert app.pedidos == ["oid-ana.tid", "oid-ana.tid"]
+
+
+def test_cuenta_de_resultado_del_device_code():
+    app = _AppFalsa()
+    assert cuenta_de_resultado(app, {"client_info": _client_info("oid-ana", "tid")}) == "oid-ana.tid"
+    # Sin client_info: la cuenta del caché con el oid y tenant del id token
+    assert cuenta_de_resultado(app, {"id_token_claims": {"oid": "oid-ana", "tid": "tid"}}) == "oid-ana.tid"
+    assert cuenta_de_resultado(app, {"id_token_claims": {"oid": "oid-ana", "tid": "otro"}}) is None
+
+
+def test_graph_client_sin_cuenta_no_toma_otra_del_cache():
+    gc = GraphClient()
+    gc.app = _AppFalsa()
+    assert gc.adquirir_token_silencioso() is None
+    assert gc.app.pedidos == []
+
+
+def test_graph_client_queda_ligado_a_la_cuenta_del_device_code():
+    gc = GraphClient()
+    gc.app = _AppFalsa()
+    gc.registrar_token({"access_token": "t", "expires_in": 3600, "client_info": _client_info("oid-ana", "tid")})
+    assert gc.cuenta == "oid-ana.tid"
+    assert gc.adquirir_token_silencioso() == "token-ana@example.com"
+    assert gc.app.pedidos == ["oid-ana.tid"]
+
+    # Un nuevo inicio de sesión sin cuenta identificable no conserva la anterior
+    gc.registrar_token({"access_token": "t2", "expires_in": 3600})
+    assert gc.cuenta is None
+    assert gc.adquirir_token_silencioso() is None
+
+
+@pytest.fixture
+def sin_clave(monkeypatch):
+    monkeypatch.delenv("MSAL_CACHE_KEY", raising=False)
+    monkeypatch.setattr(token_cache, "keyring", None)
+
+
+def _cache_con_cambios(ruta: str) -> CacheTokensCifrada:
+    cache = CacheTokensCifrada(ruta)
+    cache.deserialize(json.dumps({"AccessToken": {}, "Account": {"a": {"username": "ana@example.com"}}}))
+    cache.has_state_changed = True
+    return cache
+
+
+def test_sin_clave_no_se_persiste(tmp_path, sin_clave):
+    ruta = str(tmp_path / "tokens.bin")
+    cache = _cache_con_cambios(ruta)
+    cache.guardar()
+    assert not cache.persistente
+    assert os.listdir(tmp_path) == []
+
+
+def test_con_clave_se_guarda_cifrado(tmp_path, sin_clave, monkeypatch):
+    monkeypatch.setenv("MSAL_CACHE_KEY", Fernet.generate_key().decode())
+    ruta = str(tmp_path / "tokens.bin")
+    _cache_con_cambios(ruta).guardar()
+
+    assert os.listdir(tmp_path) == ["tokens.bin"]
+    with open(ruta, "rb") as f:
+        assert b"ana@example.com" not in f.read()
+    assert "ana@example.com" in CacheTokensCifrada(ruta).serialize()
@@ -0,0 +1,201 @@
+"""
+LibroXlsx.resumen_hoja frente a cargar las hojas con pandas/openpyxl (lo que hacía
+antes el Dashboard), y la actualización incremental del maestro comprobada con
+openpyxl: filas añadidas y eliminadas, rezagados con sus tipos, fórmulas y celdas
+combinadas, y hojas no tocadas idénticas byte a byte.
+"""
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.workbook.defined_name import DefinedName
+
+from utils import excel_manager
+from utils.excel_manager import actualizar_maestro, estadisticas_maestro
+from utils.xlsx_incremental import LibroNoIncremental, LibroXlsx
+
+
+def _forma_openpyxl(ruta: str) -> dict:
+    return {nombre: df.shape for nombre, df in pd.read_excel(ruta, sheet_name=None, dtype=str).items()}
+
+
+def _forma_resumen(ruta: str) -> dict:
+    with LibroXlsx(ruta) as libro:
+        return {n: (r["filas"], r["columnas"]) for n in libro.nombres_hojas for r in [libro.resumen_hoja(n)]}
+
+
+@pytest.fixture
+def libro(tmp_path):
+    ruta = str(tmp_path / "maestro.xlsx")
+    wb = Workbook()
+    datos = wb.active
+    datos.title = "Datos"
+    datos.append(["LEAD", "Email", "Programa"])
+    for i in range(25):
+        datos.append([str(i), f"alumno{i}@example.com", "Maestría"])
+    solo_encabezados = wb.create_sheet("Solo encabezados")
+    solo_encabezados.append(["LEAD", "Email"])
+    wb.create_sheet("Vacía")
+    wb.save(ruta)
+    return ruta
+
+
+def test_resumen_igual_que_openpyxl(libro):
+    assert _forma_resumen(libro) == _forma_openpyxl(libro)
+
+
+def test_hoja_vacia_es_0x0(libro):
+    with LibroXlsx(libro) as l:
+        assert l.resumen_hoja("Vacía") == {"filas": 0, "columnas": 0, "encabezados": []}
+
+
+def test_hoja_sin_sheetdata(tmp_path):
+    ruta = str(tmp_path / "vacio.xlsx")
+    with pd.ExcelWriter(ruta, engine="openpyxl") as writer:
+        pd.DataFrame().to_excel(writer, sheet_name="Vacía", index=False)
+    assert _forma_resumen(ruta) == _forma_openpyxl(ruta) == {"Vacía": (0, 0)}
+
+
+def test_estadisticas_tras_actualizacion_incremental(tmp_path):
+    ruta = str(tmp_path / "maestro.xlsx")
+
+    def lote(desde, hasta):
+        return pd.DataFrame({"LEAD": [str(i) for i in range(desde, hasta)], "Email": "a@example.com",
+                             "PaidDate": "01/09/2025 10:00"})
+
+    actualizar_maestro(lote(0, 10), ruta, "202592", incremental=False)
+    actualizar_maestro(lote(10, 15), ruta, "202592")
+
+    esperado = _forma_openpyxl(ruta)
+    obtenido = {e["Hoja"]: (e["Registros"], e["Columnas"]) for e in estadisticas_maestro(ruta)}
+    assert obtenido == esperado
+
+
+# --- Actualización incremental: añadir, eliminar y renumerar, mover rezagados ---
+
+PERIODO = "202592"
+VENTAS = f"Ventas Nuevas Maestrías {PERIODO}"
+REZAGADOS = f"Rezagados Maestrías {PERIODO}"
+HISTORICO = "Ventas Nuevas Maestrías 202591"
+ENCABEZADOS_VENTAS = ["LEAD", "Email", "PaidDate", "Programa", "Monto de pago", "Estatus", "Notas", "Total"]
+
+
+def _maestro(ruta: str, estatus=("", "Pospone", "", ""), extra=None):
+    """Ventas con fechas y números reales (estilos de openpyxl), Rezagados vacía y un histórico."""
+    wb = Workbook()
+    ventas = wb.active
+    ventas.title = VENTAS
+    ventas.append(ENCABEZADOS_VENTAS)
+    for i, e in enumerate(estatus):
+        ventas.append([str(i + 1), f"alumno{i + 1}@example.com", datetime(2025, 1, 2 + i), "Maestría", 100 * (i + 1), e])
+        ventas.cell(row=i + 2, column=3).number_format = "dd/mm/yyyy"
+    wb.create_sheet(REZAGADOS).append(["LEAD", "Email", "PaidDate", "Monto de pago", "Estatus"])
+    historico = wb.create_sheet(HISTORICO)
+    historico.append(["LEAD", "Email"])
+    historico.append(["900", "viejo@example.com"])
+    if extra:
+        extra(wb)
+    wb.save(ruta)
+
+
+def _partes(ruta: str) -> dict:
+    with zipfile.ZipFile(ruta) as z:
+        return {n: z.read(n) for n in z.namelist()}
+
+
+def _registros(ws) -> list:
+    """Filas de datos como {encabezado: celda}."""
+    encabezados = [c.value for c in ws[1]]
+    return [{e: c for e, c in zip(encabezados, fila) if e} for fila in ws.iter_rows(min_row=2)]
+
+
+@pytest.fixture
+def sin_reescritura(monkeypatch):
+    """Falla si actualizar_maestro cae a la reescritura completa."""
+    def completo(*args, **kwargs):
+        raise AssertionError("se reescribió el libro completo")
+    monkeypatch.setattr(excel_manager, "_actualizar_maestro_completo", completo)
+
+
+def test_mueve_rezagado_conservando_tipos_y_hojas_intactas(tmp_path, sin_reescritura):
+    ruta = str(tmp_path / "maestro.xlsx")
+    _maestro(ruta)
+    antes = _partes(ruta)
+    nuevas = pd.DataFrame({"LEAD": ["5", "6"], "Email": ["n5@example.com", "n6@example.com"], "Estatus": ["", "Pospone"]})
+
+    assert actualizar_maestro(nuevas, ruta, PERIODO) == (2, 2)
+
+    wb = load_workbook(ruta)
+    ventas = _registros(wb[VENTAS])
+    assert [(f["LEAD"].value, f["PaidDate"].value, f["Monto de pago"].value) for f in ventas] == [
+        ("1", datetime(2025, 1, 2), 100),
+        ("3", datetime(2025, 1, 4), 300),
+        ("4", datetime(2025, 1, 5), 400),
+        ("5", None, None),
+    ]
+    assert [c.row for c in (f["LEAD"] for f in ventas)] == [2, 3, 4, 5]
+
+    rezagados = _registros(wb[REZAGADOS])
+    assert [f["LEAD"].value for f in rezagados] == ["2", "6"]
+    movida = rezagados[0]
+    assert movida["PaidDate"].value == datetime(2025, 1, 3)
+    assert movida["PaidDate"].number_format == "dd/mm/yyyy"
+    assert movida["Monto de pago"].value == 200
+    assert movida["Estatus"].value == "Pospone"
+
+    # Solo cambian las partes de Ventas y Rezagados
+    despues = _partes(ruta)
+    with LibroXlsx(ruta) as libro:
+        tocadas = {libro._partes[VENTAS], libro._partes[REZAGADOS]}
+    assert {n for n in antes if antes[n] != despues[n]} == tocadas
+
+
+def _formula_y_combinadas(wb):
+    ws = wb[VENTAS]
+    for r in range(2, 6):
+        ws[f"H{r}"] = f"=E{r}*2"
+    ws.merge_cells("F3:G3")
+
+
+def test_anadir_conserva_formulas_y_combinadas(tmp_path, sin_reescritura):
+    ruta = str(tmp_path / "maestro.xlsx")
+    _maestro(ruta, estatus=("", "", "", ""), extra=_formula_y_combinadas)
+
+    assert actualizar_maestro(pd.DataFrame({"LEAD": ["5"], "Email": ["n5@example.com"]}), ruta, PERIODO) == (1, 0)
+
+    ventas = load_workbook(ruta)[VENTAS]
+    assert [ventas[f"H{r}"].value for r in range(2, 6)] == ["=E2*2", "=E3*2", "=E4*2", "=E5*2"]
+    assert [str(rango) for rango in ventas.merged_cells.ranges] == ["F3:G3"]
+    assert ventas["A6"].value == "5"
+
+
+def _hipervinculo(wb):
+    wb[VENTAS]["B3"].hyperlink = "mailto:alumno2@example.com"
+
+
+def _filtro(wb):
+    wb[VENTAS].auto_filter.ref = "A1:H5"
+
+
+def _nombre_definido(wb):
+    wb.defined_names["Montos"] = DefinedName("Montos", attr_text=f"'{VENTAS}'!$E$2:$E$5")
+
+
+def _formula_en_otra_hoja(wb):
+    wb[HISTORICO]["C2"] = f"='{VENTAS}'!E4"
+
+
+@pytest.mark.parametrize("extra", [_formula_y_combinadas, _hipervinculo, _filtro, _nombre_definido, _formula_en_otra_hoja])
+def test_eliminar_filas_con_referencias_no_es_incremental(tmp_path, extra):
+    ruta = str(tmp_path / "maestro.xlsx")
+    _maestro(ruta, extra=extra)
+    with LibroXlsx(ruta) as libro, pytest.raises(LibroNoIncremental):
+        libro.hoja(VENTAS).eliminar_filas([3])
+
+    # actualizar_maestro cae a la reescritura completa y el rezagado se mueve igual
+    assert actualizar_maestro(None, ruta, PERIODO, only_manage_rezagados=True) == (0, 1)
+    hojas = pd.read_excel(ruta, sheet_name=None, dtype=str)
+    assert list(hojas[VENTAS]["LEAD"]) == ["1", "3", "4"]
+    assert list(hojas[REZAGADOS]["LEAD"]) == ["2"]
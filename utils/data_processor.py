@@ -2,16 +2,25 @@ import pandas as pd
 from datetime import datetime, timedelta
 import logging
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from .instrumentation import etapa, iterar_medido, medido
 
 logger = logging.getLogger(__name__)
 
 
-def _find_column(df: pd.DataFrame, candidates):
+@lru_cache(maxsize=128)
+def _normalizar_encabezados(columnas: tuple) -> dict:
     """
-    Busca en df.columns cualquiera de las cadenas en candidates (case-insensitive).
-    Devuelve el nombre real de la columna si encuentra, sino None.
+    Diccionario encabezado normalizado (trim + minúsculas) -> nombre real.
+    Se calcula una sola vez por layout de encabezados.
     """
-    cols_low = {str(c).strip().lower(): c for c in df.columns}
+    return {str(c).strip().lower(): c for c in columnas}
+
+
+def _buscar_columna(cols_low: dict, candidates):
     # Búsqueda exacta (normalizada)
     for cand in candidates:
         key = str(cand).strip().lower()
@@ -26,54 +35,250 @@ def _find_column(df: pd.DataFrame, candidates):
     return None
 
 
-def _try_parse_dates(series: pd.Series) -> pd.Series:
+def _find_column(df: pd.DataFrame, candidates):
     """
-    Intenta parsear una serie de strings con múltiples formatos posibles.
-    Devuelve una serie datetime (na si no se puede parsear).
+    Busca en df.columns cualquiera de las cadenas en candidates (case-insensitive).
+    Devuelve el nombre real de la columna si encuentra, sino None.
     """
-    s = series.astype(str).replace({'': pd.NA, 'nan': pd.NA})
-    s = s.str.strip().replace({'\\u200b': ''}, regex=True)
-
-    formats = [
-        "%d/%m/%Y %H:%M:%S",
-        "%d/%m/%Y %H:%M",
-        "%d-%m-%Y %H:%M:%S",
-        "%d-%m-%Y %H:%M",
-        "%Y-%m-%d %H:%M:%S",
-        "%Y-%m-%d %H:%M",
-        "%d/%m/%Y",
-        "%Y-%m-%d",
-    ]
-
-    parsed = pd.to_datetime(pd.Series([pd.NaT] * len(s)), errors="coerce")
-
-    for fmt in formats:
-        try:
-            this_try = pd.to_datetime(s, format=fmt, dayfirst=True, errors="coerce")
-            parsed = parsed.fillna(this_try)
-        except Exception:
-            continue
+    return _buscar_columna(_normalizar_encabezados(tuple(df.columns)), candidates)
+
+
+# Formatos conocidos de PaidDate, en el orden de prioridad histórico, junto con
+# el patrón que reconoce su "forma" sin necesidad de invocar strptime.
+_FORMATOS_FECHA = [
+    ("%d/%m/%Y %H:%M:%S", r"\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{1,2}:\d{1,2}"),
+    ("%d/%m/%Y %H:%M", r"\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{1,2}"),
+    ("%d-%m-%Y %H:%M:%S", r"\d{1,2}-\d{1,2}-\d{4} \d{1,2}:\d{1,2}:\d{1,2}"),
+    ("%d-%m-%Y %H:%M", r"\d{1,2}-\d{1,2}-\d{4} \d{1,2}:\d{1,2}"),
+    ("%Y-%m-%d %H:%M:%S", r"\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{1,2}:\d{1,2}"),
+    ("%Y-%m-%d %H:%M", r"\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{1,2}"),
+    ("%Y-%m-%dT%H:%M:%S", r"\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2}"),
+    ("%Y-%m-%dT%H:%M", r"\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}"),
+    ("%d/%m/%Y", r"\d{1,2}/\d{1,2}/\d{4}"),
+    ("%Y-%m-%d", r"\d{4}-\d{1,2}-\d{1,2}"),
+]
+_FORMATOS_FECHA_RE = [(fmt, re.compile(patron)) for fmt, patron in _FORMATOS_FECHA]
+_ISO_EMBEBIDO_RE = r"(\d{4}-\d{2}-\d{2}).*?(\d{2}:\d{2}(?::\d{2})?)"
+_TAMANO_MUESTRA_FECHAS = 1000
+
+
+def _detectar_formatos(muestra) -> list:
+    """
+    Devuelve los formatos de _FORMATOS_FECHA presentes en la muestra, en orden de prioridad.
+    """
+    detectados = set()
+    for valor in muestra:
+        for fmt, patron in _FORMATOS_FECHA_RE:
+            if patron.fullmatch(valor):
+                detectados.add(fmt)
+                break
+    return [fmt for fmt, _ in _FORMATOS_FECHA if fmt in detectados]
 
-    if parsed.isna().sum() > 0:
-        fallback = pd.to_datetime(s, dayfirst=True, errors="coerce")
-        parsed = parsed.fillna(fallback)
 
-    def clean_iso(x):
-        if isinstance(x, str):
-            m = re.match(r".*?(\d{4}-\d{2}-\d{2}).*?(\d{2}:\d{2}(:\d{2})?).*", x)
-            if m:
-                return pd.to_datetime(m.group(1) + " " + m.group(2), dayfirst=False, errors="coerce")
-        return x
+class _CacheFechas:
+    """
+    Caché LRU acotada (texto crudo -> Timestamp/NaT) compartida por todo el proceso.
+    Sobrevive a los reruns de Streamlit y a cargas sucesivas dentro de la sesión.
+    """
 
-    if parsed.isna().sum() > 0:
-        mask = parsed.isna()
-        if mask.any():
-            remaining = s[mask].apply(clean_iso)
-            parsed.loc[mask] = pd.to_datetime(remaining, errors="coerce")
+    def __init__(self, max_entradas: int = 200_000):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, claves) -> tuple:
+        """Devuelve (encontrados: dict, faltantes: list) para las claves pedidas."""
+        encontrados = {}
+        faltantes = []
+        with self._lock:
+            for clave in claves:
+                if clave in self._datos:
+                    self._datos.move_to_end(clave)
+                    encontrados[clave] = self._datos[clave]
+                else:
+                    faltantes.append(clave)
+            self.hits += len(encontrados)
+            self.misses += len(faltantes)
+        return encontrados, faltantes
+
+    def guardar(self, valores: dict):
+        with self._lock:
+            for clave, valor in valores.items():
+                self._datos[clave] = valor
+                self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entradas': len(self._datos),
+                'max_entradas': self.max_entradas,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_cache_fechas = _CacheFechas()
+
+
+def estadisticas_cache_fechas() -> dict:
+    """Contadores de la caché de PaidDate (hits, misses, entradas, hit_ratio)."""
+    return _cache_fechas.estadisticas()
+
+
+def limpiar_cache_fechas():
+    """Vacía la caché de PaidDate y reinicia sus contadores."""
+    _cache_fechas.limpiar()
+
+
+def _parsear_fechas(s: pd.Series) -> pd.Series:
+    """
+    Parsea una serie de strings ya limpios (sin nulos).
+
+    Toma una muestra para detectar qué formatos se usan realmente, agrupa las
+    filas por formato con operaciones vectorizadas y parsea cada grupo una sola
+    vez. Las filas que no encajan en ningún formato conocido pasan primero por la
+    extracción de fecha ISO embebida (año-mes-día) y solo lo que quede, por el parseo
+    flexible (dayfirst), que leería "2025-01-02T10:30" como 1 de febrero.
+    """
+    parsed = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    pendientes = pd.Series(True, index=s.index)
+    if s.empty:
+        return parsed
+
+    muestra = s.sample(n=min(_TAMANO_MUESTRA_FECHAS, len(s)), random_state=0)
+    detectados = _detectar_formatos(muestra.tolist())
+    # Primero los formatos vistos en la muestra; el resto solo se prueba sobre lo que sobre.
+    orden = detectados + [fmt for fmt, _ in _FORMATOS_FECHA if fmt not in detectados]
+    patrones = dict(_FORMATOS_FECHA)
+
+    for fmt in orden:
+        if not pendientes.any():
+            break
+        candidatos = s[pendientes]
+        coincide = candidatos.str.fullmatch(patrones[fmt]).fillna(False).astype(bool)
+        if not coincide.any():
+            continue
+        grupo = candidatos[coincide]
+        parsed.loc[grupo.index] = pd.to_datetime(grupo, format=fmt, errors="coerce")
+        # Las filas con la forma correcta pero fecha inválida (ej. 31/02) siguen pendientes
+        pendientes.loc[grupo.index] = parsed.loc[grupo.index].isna()
+
+    if pendientes.any():
+        restantes = s[pendientes]
+        partes = restantes.str.extract(_ISO_EMBEBIDO_RE)
+        encontrados = partes[0].notna() & partes[1].notna()
+        if encontrados.any():
+            iso = partes.loc[encontrados, 0] + " " + partes.loc[encontrados, 1]
+            parsed.loc[iso.index] = pd.to_datetime(iso, format="ISO8601", errors="coerce")
+            pendientes.loc[iso.index] = parsed.loc[iso.index].isna()
+
+    if pendientes.any():
+        restantes = s[pendientes]
+        fallback = pd.to_datetime(restantes, dayfirst=True, errors="coerce")
+        parsed.loc[restantes.index] = fallback
 
     return parsed
 
 
+def _try_parse_dates(series: pd.Series) -> pd.Series:
+    """
+    Intenta parsear una serie de strings con múltiples formatos posibles.
+    Devuelve una serie datetime (na si no se puede parsear).
+
+    Solo se limpian y parsean los valores únicos (pd.factorize) que no estén ya en
+    la caché de proceso; el resultado se reconstruye a partir de los códigos.
+    """
+    codes, uniques = pd.factorize(series)
+    s = pd.Series(uniques, dtype=object).astype(str).replace({'': pd.NA, 'nan': pd.NA})
+    s = s.str.strip().str.replace('\u200b', '', regex=False)
+    unicos = [None if pd.isna(u) else str(u) for u in s]
+
+    conocidos, faltantes = _cache_fechas.obtener([u for u in unicos if u is not None])
+    if faltantes:
+        nuevos = _parsear_fechas(pd.Series(faltantes, dtype=object))
+        nuevos = dict(zip(faltantes, nuevos.tolist()))
+        _cache_fechas.guardar(nuevos)
+        conocidos.update(nuevos)
+
+    valores_unicos = pd.DatetimeIndex(
+        [pd.NaT if u is None else conocidos[u] for u in unicos], dtype="datetime64[ns]"
+    )
+    parsed = valores_unicos.take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(parsed, index=series.index)
+
+
+# Candidatos (en orden de preferencia) para cada campo lógico del export vwCRMLeads
+CANDIDATOS_COLUMNAS = {
+    'PaidDate': ['PaidDate', 'paiddate', 'paid_date', 'Paid Date', 'FechaPago', 'Fecha Pago', 'paid', 'fecha_pago', 'Fecha'],
+    'Nombre': ['Nombre', 'nombre', 'name'],
+    'Apellido': ['Apellido', 'apellido', 'last_name', 'lastname', 'apellido_paterno', 'Apellido Paterno'],
+    'LEAD': ['LEAD', 'Lead', 'Id', 'ID', 'id'],
+    'Operador': ['Operador', 'operador', 'Asesor', 'Asesor de ventas', 'AsesorVentas'],
+    'Email': ['Email', 'email', 'Correo', 'correo'],
+    'Telefono': ['Telefono Movil', 'TelefonoMovil', 'Telefono', 'telefono movil', 'telefono_movil', 'movil'],
+    'Programa': ['Programa', 'programa', 'Plan'],
+}
+
+COLUMNAS_FINALES = [
+    'Asesor de ventas', 'WEB ID', 'ID', 'NIP', 'LEAD', 'Email',
+    'Nombre Apellido', 'Telefono Movil', 'Programa', 'PaidDate',
+    'Materias Pagadas', 'Monto de pago', 'Campaña', 'Factura',
+    'Correo Anáhuac', 'URL_Lead'
+]
+
+
+@lru_cache(maxsize=128)
+def _resolver_esquema(columnas: tuple) -> tuple:
+    """
+    Esquema compilado de un layout de encabezados: ((campo, columna_real | None), ...).
+    Se cachea por la tupla de encabezados, así que exportaciones repetidas con el
+    mismo layout no vuelven a resolver columnas.
+    """
+    cols_low = _normalizar_encabezados(columnas)
+    return tuple((campo, _buscar_columna(cols_low, candidatos)) for campo, candidatos in CANDIDATOS_COLUMNAS.items())
+
+
+def _resolver_columnas(df: pd.DataFrame) -> dict:
+    """
+    Resuelve cada campo lógico de CANDIDATOS_COLUMNAS a la columna real de df (o None).
+    """
+    columnas = dict(_resolver_esquema(tuple(df.columns)))
+    logger.debug(f"Caché de esquemas: {_resolver_esquema.cache_info()}")
+    return columnas
+
+
+def _ventana_temporal(timestamp_referencia: datetime, hours: int = None, days: int = None, start_from_prev_midnight: bool = False) -> tuple:
+    """
+    Devuelve (fecha_inicio, fecha_fin) de la ventana a conservar, o (None, None) si no se filtra.
+    """
+    if start_from_prev_midnight:
+        prev_midnight = (timestamp_referencia - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        logger.info(f"Filtrando desde medianoche del día anterior: {prev_midnight} -> {timestamp_referencia}")
+        return prev_midnight, timestamp_referencia
+    if hours is not None:
+        fecha_inicio = timestamp_referencia - timedelta(hours=hours)
+        logger.info(f"Filtrando últimas {hours} horas: {fecha_inicio} -> {timestamp_referencia}")
+        return fecha_inicio, timestamp_referencia
+    if days is not None:
+        fecha_inicio = timestamp_referencia - timedelta(days=days)
+        logger.info(f"Filtrando últimos {days} días: {fecha_inicio} -> {timestamp_referencia}")
+        return fecha_inicio, timestamp_referencia
+    return None, None
+
+
+@medido("depurar_datos")
 def depurar_datos(df: pd.DataFrame, hours: int = 24, days: int = None, timestamp_referencia: datetime = None, start_from_prev_midnight: bool = False, program_type: str = None, **kwargs) -> pd.DataFrame:
     """
     Depura el DataFrame del CSV vwCRMLeads.
@@ -84,9 +289,12 @@ def depurar_datos(df: pd.DataFrame, hours: int = 24, days: int = None, timestamp
       - start_from_prev_midnight (bool): si True, ignora `hours` y toma desde la medianoche del día anterior hasta timestamp_referencia.
       - program_type (str): opcional, aceptado para compatibilidad con llamadas que lo pasen desde app.py.
       - **kwargs: se aceptan otros argumentos adicionales sin romper la función.
+
+    Plan de ejecución: (1) resolver columnas, (2) parsear solo la columna de fecha,
+    (3) aplicar la ventana temporal, y (4) normalizar strings y construir columnas
+    únicamente sobre las filas que sobreviven al filtro.
     """
     try:
-        df = df.copy()
         if timestamp_referencia is None:
             timestamp_referencia = datetime.now()
 
@@ -98,12 +306,10 @@ def depurar_datos(df: pd.DataFrame, hours: int = 24, days: int = None, timestamp
         if kwargs:
             logger.debug(f"Argumentos adicionales recibidos en **kwargs: {list(kwargs.keys())}")
 
-        # Normalizar nombres de columnas (trim)
-        df.columns = [str(c).strip() for c in df.columns]
-
-        # Encontrar columna de PaidDate
-        paid_candidates = ['PaidDate', 'paiddate', 'paid_date', 'Paid Date', 'FechaPago', 'Fecha Pago', 'paid', 'fecha_pago', 'Fecha']
-        paid_col = _find_column(df, paid_candidates)
+        # 1) Normalizar nombres de columnas (trim) y resolver los campos lógicos
+        df = df.set_axis([str(c).strip() for c in df.columns], axis=1)
+        columnas = _resolver_columnas(df)
+        paid_col = columnas['PaidDate']
 
         if not paid_col:
             logger.warning("No se encontró columna PaidDate. Columnas disponibles: %s", list(df.columns))
@@ -111,117 +317,94 @@ def depurar_datos(df: pd.DataFrame, hours: int = 24, days: int = None, timestamp
 
         logger.info(f"Columna detectada para fecha: '{paid_col}' - primeras 5: {df[paid_col].head(5).tolist()}")
 
-        # Parsear PaidDate con múltiples estrategias
-        parsed = _try_parse_dates(df[paid_col])
-        df['_PaidDate_parsed'] = parsed
+        # 2) Parsear PaidDate con múltiples estrategias (única columna que se procesa completa)
+        with etapa("parsear_fechas"):
+            parsed = _try_parse_dates(df[paid_col])
+        logger.info(f"Caché de fechas: {estadisticas_cache_fechas()}")
 
-        n_valid = df['_PaidDate_parsed'].notna().sum()
+        valida = parsed.notna()
+        n_valid = int(valida.sum())
         logger.info(f"Fechas parseadas válidas: {n_valid} / {len(df)}")
         if n_valid > 0:
-            logger.info(f"Rango fechas parseadas: {df['_PaidDate_parsed'].min()} -> {df['_PaidDate_parsed'].max()}")
+            logger.info(f"Rango fechas parseadas: {parsed.min()} -> {parsed.max()}")
         else:
             logger.warning("Ninguna fecha pudo ser parseada correctamente. Revisar formato en el CSV.")
 
-        # Establecer PaidDate con el valor parsed (datetime)
-        df['PaidDate'] = df['_PaidDate_parsed']
-
-        # Eliminar filas sin PaidDate válido
-        antes_sin_fecha = len(df)
-        df = df[df['PaidDate'].notna()]
-        despues_sin_fecha = len(df)
-        if antes_sin_fecha != despues_sin_fecha:
-            logger.info(f"Eliminadas {antes_sin_fecha - despues_sin_fecha} filas sin PaidDate válido.")
+        if n_valid != len(df):
+            logger.info(f"Eliminadas {len(df) - n_valid} filas sin PaidDate válido.")
 
-        if df.empty:
+        if n_valid == 0:
             logger.info("No quedan registros con PaidDate válido después de eliminar nulos.")
             return pd.DataFrame()
 
-        # APLICAR FILTRO TEMPORAL (incluye <= timestamp_referencia)
-        antes = len(df)
-        if start_from_prev_midnight:
-            prev_midnight = (timestamp_referencia - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            fecha_inicio = prev_midnight
-            fecha_fin = timestamp_referencia
-            logger.info(f"Filtrando desde medianoche del día anterior: {fecha_inicio} -> {fecha_fin}")
-            df = df[(df['PaidDate'] >= fecha_inicio) & (df['PaidDate'] <= fecha_fin)]
-        else:
-            if hours is not None:
-                fecha_limite = timestamp_referencia - timedelta(hours=hours)
-                fecha_inicio = fecha_limite
-                fecha_fin = timestamp_referencia
-                logger.info(f"Filtrando últimas {hours} horas: {fecha_inicio} -> {fecha_fin}")
-                df = df[(df['PaidDate'] >= fecha_inicio) & (df['PaidDate'] <= fecha_fin)]
-            elif days is not None:
-                fecha_limite = timestamp_referencia - timedelta(days=days)
-                fecha_inicio = fecha_limite
-                fecha_fin = timestamp_referencia
-                logger.info(f"Filtrando últimos {days} días: {fecha_inicio} -> {fecha_fin}")
-                df = df[(df['PaidDate'] >= fecha_inicio) & (df['PaidDate'] <= fecha_fin)]
-        despues = len(df)
-        logger.info(f"Filtro temporal aplicado: {antes} -> {despues} ({antes - despues} eliminados)")
-
-        if df.empty:
+        # 3) APLICAR FILTRO TEMPORAL (incluye <= timestamp_referencia) como máscara
+        with etapa("filtro_ventana"):
+            fecha_inicio, fecha_fin = _ventana_temporal(timestamp_referencia, hours=hours, days=days,
+                                                        start_from_prev_midnight=start_from_prev_midnight)
+            mask = valida
+            if fecha_inicio is not None:
+                mask = mask & (parsed >= fecha_inicio) & (parsed <= fecha_fin)
+            despues = int(mask.sum())
+        logger.info(f"Filtro temporal aplicado: {n_valid} -> {despues} ({n_valid - despues} eliminados)")
+
+        if despues == 0:
             logger.info("Después del filtro temporal no quedan registros.")
             return pd.DataFrame()
 
+        # 4) Materializar solo las filas supervivientes y las columnas que se usan
+        necesarias = [c for c in columnas.values() if c] + [c for c in COLUMNAS_FINALES if c in df.columns]
+        df = df.loc[mask, list(dict.fromkeys(necesarias))].copy()
+        df['PaidDate'] = parsed[mask]
+
         # Crear Nombre Apellido (Apellido + Nombre) si es posible
-        nombre_col = _find_column(df, ['Nombre', 'nombre', 'name'])
-        apellido_col = _find_column(df, ['Apellido', 'apellido', 'last_name', 'lastname', 'apellido_paterno', 'Apellido Paterno'])
+        nombre_col = columnas['Nombre']
+        apellido_col = columnas['Apellido']
         if 'Nombre Apellido' not in df.columns:
-            if apellido_col and nombre_col and apellido_col in df.columns and nombre_col in df.columns:
+            if apellido_col and nombre_col:
                 df['Nombre Apellido'] = (df[apellido_col].fillna('').astype(str).str.strip() + ' ' +
                                          df[nombre_col].fillna('').astype(str).str.strip()).str.strip()
-            elif nombre_col and nombre_col in df.columns:
+            elif nombre_col:
                 df['Nombre Apellido'] = df[nombre_col].astype(str).str.strip()
-            elif apellido_col and apellido_col in df.columns:
+            elif apellido_col:
                 df['Nombre Apellido'] = df[apellido_col].astype(str).str.strip()
             else:
                 df['Nombre Apellido'] = ''
 
         # Normalizar LEAD
-        lead_col = _find_column(df, ['LEAD', 'Lead', 'Id', 'ID', 'id'])
-        if lead_col and lead_col in df.columns:
-            df['LEAD'] = df[lead_col].astype(str).str.strip()
-        else:
-            df['LEAD'] = ''
+        lead_col = columnas['LEAD']
+        df['LEAD'] = df[lead_col].astype(str).str.strip() if lead_col else ''
 
         # Eliminar duplicados por LEAD
-        if 'LEAD' in df.columns and df['LEAD'].astype(str).str.strip().replace('', pd.NA).notna().any():
+        if df['LEAD'].replace('', pd.NA).notna().any():
             antes_dup = len(df)
-            df = df.drop_duplicates(subset=['LEAD'], keep='first')
+            with etapa("deduplicar"):
+                df = df.drop_duplicates(subset=['LEAD'], keep='first')
             despues_dup = len(df)
             logger.info(f"Duplicados por LEAD eliminados: {antes_dup - despues_dup}")
 
         # Normalizar otras columnas solicitadas
-        operador_col = _find_column(df, ['Operador', 'operador', 'Asesor', 'Asesor de ventas', 'AsesorVentas'])
-        df['Asesor de ventas'] = df[operador_col].astype(str).str.strip() if operador_col and operador_col in df.columns else ''
-        email_col = _find_column(df, ['Email', 'email', 'Correo', 'correo'])
-        df['Email'] = df[email_col].astype(str).str.strip() if email_col and email_col in df.columns else ''
-        telefono_col = _find_column(df, ['Telefono Movil', 'TelefonoMovil', 'Telefono', 'telefono movil', 'telefono_movil', 'movil'])
-        df['Telefono Movil'] = df[telefono_col].astype(str).str.strip() if telefono_col and telefono_col in df.columns else ''
-        programa_col = _find_column(df, ['Programa', 'programa', 'Plan'])
-        df['Programa'] = df[programa_col].astype(str).str.strip() if programa_col and programa_col in df.columns else ''
+        operador_col = columnas['Operador']
+        df['Asesor de ventas'] = df[operador_col].astype(str).str.strip() if operador_col else ''
+        email_col = columnas['Email']
+        df['Email'] = df[email_col].astype(str).str.strip() if email_col else ''
+        telefono_col = columnas['Telefono']
+        df['Telefono Movil'] = df[telefono_col].astype(str).str.strip() if telefono_col else ''
+        programa_col = columnas['Programa']
+        df['Programa'] = df[programa_col].astype(str).str.strip() if programa_col else ''
 
         # Columnas finales requeridas
-        columnas_finales = [
-            'Asesor de ventas', 'WEB ID', 'ID', 'NIP', 'LEAD', 'Email',
-            'Nombre Apellido', 'Telefono Movil', 'Programa', 'PaidDate',
-            'Materias Pagadas', 'Monto de pago', 'Campaña', 'Factura',
-            'Correo Anáhuac', 'URL_Lead'
-        ]
-        for col in columnas_finales:
+        for col in COLUMNAS_FINALES:
             if col not in df.columns:
                 df[col] = ''
 
         # Formatear PaidDate como texto DD/MM/YYYY HH:MM
-        df['PaidDate'] = pd.to_datetime(df['PaidDate'], errors='coerce')
         df['PaidDate'] = df['PaidDate'].dt.strftime('%d/%m/%Y %H:%M').fillna('')
 
         # Construir URL_Lead
         url_base = "https://apmanager.aplatam.com/admin/Ventas/Consulta/Lead/"
         df['URL_Lead'] = df['LEAD'].apply(lambda x: url_base + str(x).strip() if str(x).strip() != '' else '')
 
-        df_final = df[columnas_finales].reset_index(drop=True)
+        df_final = df[COLUMNAS_FINALES].reset_index(drop=True)
 
         logger.info(f"=== DEPURACIÓN COMPLETADA: {len(df_final)} registros ===")
         return df_final
@@ -231,6 +414,65 @@ def depurar_datos(df: pd.DataFrame, hours: int = 24, days: int = None, timestamp
         raise
 
 
+def depurar_csv_por_bloques(fuente, chunksize: int = 100_000, hours: int = 24, days: int = None, timestamp_referencia: datetime = None, start_from_prev_midnight: bool = False, program_type: str = None, **kwargs) -> tuple:
+    """
+    Variante en streaming de depurar_datos para CSV vwCRMLeads que no caben en memoria.
+    Lee el CSV por bloques de `chunksize` filas, aplica a cada bloque el parseo de PaidDate
+    y el filtro temporal, y descarta los LEAD ya vistos en bloques anteriores. Solo se
+    conservan las filas que sobreviven, ya con las columnas finales, así que la memoria
+    pico depende del resultado filtrado y no del tamaño del CSV.
+    Parámetros: `fuente` es una ruta o un buffer (ej. el archivo subido en Streamlit);
+    el resto igual que depurar_datos.
+    Devuelve (df_depurado, filas_originales).
+    """
+    try:
+        if timestamp_referencia is None:
+            timestamp_referencia = datetime.now()
+
+        lector = pd.read_csv(fuente, dtype=str, keep_default_na=False, encoding='utf-8', chunksize=chunksize)
+        leads_vistos = set()
+        partes = []
+        filas_originales = 0
+
+        for n_bloque, bloque in enumerate(iterar_medido(lector, "leer_csv"), start=1):
+            filas_originales += len(bloque)
+            depurado = depurar_datos(bloque,
+                                     hours=hours,
+                                     days=days,
+                                     timestamp_referencia=timestamp_referencia,
+                                     start_from_prev_midnight=start_from_prev_midnight,
+                                     program_type=program_type,
+                                     **kwargs)
+            if depurado.empty:
+                logger.info(f"Bloque {n_bloque}: {len(bloque)} filas -> 0 supervivientes")
+                continue
+
+            # Deduplicación entre bloques: conjunto acumulado de LEAD ya aceptados
+            with etapa("deduplicar"):
+                repetido = depurado['LEAD'].isin(leads_vistos)
+                depurado = depurado[~repetido]
+                leads_vistos.update(l for l in depurado['LEAD'] if l != '')
+            partes.append(depurado)
+            logger.info(f"Bloque {n_bloque}: {len(bloque)} filas -> {len(depurado)} supervivientes ({int(repetido.sum())} LEAD repetidos de bloques anteriores)")
+
+        if not partes:
+            logger.info(f"=== DEPURACIÓN POR BLOQUES COMPLETADA: 0 registros de {filas_originales} ===")
+            return pd.DataFrame(), filas_originales
+
+        df_final = pd.concat(partes, ignore_index=True)
+        # Mismo criterio que depurar_datos: si hay algún LEAD, se deduplica también el vacío
+        if df_final['LEAD'].replace('', pd.NA).notna().any():
+            df_final = df_final.drop_duplicates(subset=['LEAD'], keep='first').reset_index(drop=True)
+
+        logger.info(f"=== DEPURACIÓN POR BLOQUES COMPLETADA: {len(df_final)} registros de {filas_originales} ===")
+        return df_final, filas_originales
+
+    except Exception as e:
+        logger.exception("ERROR en depurar_csv_por_bloques:")
+        raise
+
+
+@medido("mapear_columnas")
 def mapear_columnas(df: pd.DataFrame, url_base: str = "https://apmanager.aplatam.com/admin/Ventas/Consulta/Lead/") -> pd.DataFrame:
     """
     Asegura que el DataFrame tenga exactamente las columnas finales en el orden esperado.
@@ -238,14 +480,7 @@ def mapear_columnas(df: pd.DataFrame, url_base: str = "https://apmanager.aplatam
     try:
         df = df.copy()
 
-        columnas_finales = [
-            'Asesor de ventas', 'WEB ID', 'ID', 'NIP', 'LEAD', 'Email',
-            'Nombre Apellido', 'Telefono Movil', 'Programa', 'PaidDate',
-            'Materias Pagadas', 'Monto de pago', 'Campaña', 'Factura',
-            'Correo Anáhuac', 'URL_Lead'
-        ]
-
-        for col in columnas_finales:
+        for col in COLUMNAS_FINALES:
             if col not in df.columns:
                 df[col] = ''
 
@@ -256,7 +491,7 @@ def mapear_columnas(df: pd.DataFrame, url_base: str = "https://apmanager.aplatam
             df['URL_Lead'] = ''
 
         # Reordenar y devolver
-        df = df[columnas_finales]
+        df = df[COLUMNAS_FINALES]
         return df
 
     except Exception as e:
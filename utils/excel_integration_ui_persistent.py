@@ -2,9 +2,10 @@
 import streamlit as st
 import pandas as pd
 import logging
-import msal
 import os
 import re
+import json
+import hashlib
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -23,11 +24,15 @@ def _looks_like_item_id(s: str) -> bool:
 def setup_excel_connection_persistent():
     """
     UI mínima para pedir AZURE_CLIENT_ID y URL/item_id del libro.
-    Guarda en st.session_state: excel_access_token, excel_share_url/item_id, excel_sheet_name, excel_connected
+    Guarda en st.session_state: excel_access_token, excel_cuenta (cuenta MSAL de esta sesión),
+    excel_share_url/item_id, excel_sheet_name, excel_connected
     """
     st.sidebar.markdown("### 📊 Conexión a Excel Online (persistente)")
+    st.sidebar.caption("El código se pide una vez por sesión del navegador; después el token se renueva solo para tu cuenta.")
     if "excel_connected" not in st.session_state:
         st.session_state.excel_connected = False
+    if st.session_state.get("excel_usuario"):
+        st.sidebar.caption(f"Cuenta de Microsoft: {st.session_state.excel_usuario}")
 
     client_id = st.secrets.get("AZURE_CLIENT_ID") or st.sidebar.text_input("AZURE_CLIENT_ID", type="password")
     if not client_id:
@@ -39,7 +44,7 @@ def setup_excel_connection_persistent():
         st.sidebar.error("La entrada es demasiado larga y no parece una URL válida.")
         return
 
-    if st.sidebar.button("🔐 Conectar (Device Code)"):
+    if st.sidebar.button("🔐 Conectar"):
         if not share_url:
             st.sidebar.error("Debes proporcionar la URL o el item_id del libro.")
             return
@@ -48,33 +53,37 @@ def setup_excel_connection_persistent():
             st.sidebar.error("La entrada no parece una URL de compartir ni un item_id válido.")
             return
 
-        with st.spinner("Iniciando Device Flow..."):
+        with st.spinner("Conectando..."):
             try:
-                tenant = os.environ.get("AZURE_TENANT_ID", "873b9e93-4463-4b67-a3a9-3dee5f35cec2")
-                authority = f"https://login.microsoftonline.com/{tenant}"
-                app = msal.PublicClientApplication(client_id, authority=authority)
-                flow = app.initiate_device_flow(scopes=CORRECT_SCOPES)
-                if "user_code" not in flow:
-                    st.sidebar.error("No se pudo iniciar Device Flow (respuesta inesperada).")
-                    logger.error("Device flow failed: %s", flow)
-                    return
-                with st.sidebar.expander("📱 Código de autenticación", expanded=True):
-                    st.code(flow.get("user_code", ""), language=None)
-                    st.markdown(flow.get("message", ""))
-
-                token = app.acquire_token_by_device_flow(flow)
-                if "access_token" not in token:
-                    st.sidebar.error("Autenticación fallida.")
-                    logger.error("Device flow returned no access_token: %s", token)
-                    return
-
-                access_token = token["access_token"]
+                authority = _authority()
 
                 # Importar GraphClient aquí para evitar imports top-level y ciclos
                 from .graph_client import GraphClient
 
-                gc = GraphClient(client_id=client_id, scopes=CORRECT_SCOPES, authority=authority)
-                gc.access_token = access_token
+                gc = GraphClient(client_id=client_id, scopes=CORRECT_SCOPES, authority=authority,
+                                 cuenta=st.session_state.get("excel_cuenta"))
+
+                # Primero el caché de tokens para la cuenta de esta sesión (nunca la de otro
+                # operador); el Device Code si la sesión aún no tiene cuenta
+                access_token = gc.adquirir_token_silencioso()
+                if access_token is None:
+                    flow = gc.app.initiate_device_flow(scopes=CORRECT_SCOPES)
+                    if "user_code" not in flow:
+                        st.sidebar.error("No se pudo iniciar Device Flow (respuesta inesperada).")
+                        logger.error("Device flow failed: %s", flow)
+                        return
+                    with st.sidebar.expander("📱 Código de autenticación", expanded=True):
+                        st.code(flow.get("user_code", ""), language=None)
+                        st.markdown(flow.get("message", ""))
+
+                    token = gc.app.acquire_token_by_device_flow(flow)
+                    if "access_token" not in token:
+                        st.sidebar.error("Autenticación fallida.")
+                        logger.error("Device flow returned no access_token: %s", token)
+                        return
+                    gc.registrar_token(token)
+                    access_token = gc.access_token
+                    st.session_state.excel_usuario = (token.get("id_token_claims") or {}).get("preferred_username")
 
                 # Intentar listar worksheets (la función en graph_client valida share_url vs item_id)
                 worksheets = gc.get_workbook_worksheets(share_url)
@@ -83,8 +92,10 @@ def setup_excel_connection_persistent():
                     return
 
                 st.session_state.excel_access_token = access_token
+                st.session_state.excel_cuenta = gc.cuenta
                 st.session_state.excel_share_url = share_url
                 st.session_state.excel_client_id = client_id
+                st.session_state.excel_authority = authority
                 st.session_state.temp_worksheets = worksheets
                 st.session_state.show_sheet_selector = True
                 st.rerun()
@@ -130,31 +141,34 @@ def send_to_connected_excel(df_to_append: pd.DataFrame, show_preview: bool = Tru
         return False
 
     # Importar GraphClient solo cuando se usa
-    from .graph_client import GraphClient
+    from .graph_client import SubidaInterrumpida
+    from .graph_serializer import dataframe_a_valores
 
     try:
-        gc = GraphClient(client_id=client_id, scopes=CORRECT_SCOPES)
-        gc.access_token = access_token
-
-        # Obtener tablas (graph_client debe exponer get_worksheet_tables)
-        tables = gc.get_worksheet_tables(share_or_item, sheet_name)
-        if tables:
-            table_id = tables[0].get("id")
-        else:
-            # crear tabla con encabezados del df
-            cols = df_to_append.columns.tolist()
-            last_col = _col_letter(len(cols) - 1) if len(cols) > 0 else "A"
-            header_range = f"{sheet_name}!A1:{last_col}1"
-            table_obj = gc.create_table_on_sheet(share_or_item, sheet_name, header_range=header_range, has_headers=True)
-            table_id = table_obj.get("id")
-
-        # preparar valores
-        values = []
-        for _, row in df_to_append.iterrows():
-            values.append([("" if pd.isna(row[c]) else str(row[c])) for c in df_to_append.columns])
-
-        # enviar en uno o varios requests
-        gc.add_rows_to_table(share_or_item, table_id, values)
+        # preparar valores (vectorizado, en el orden de las columnas del df)
+        values = dataframe_a_valores(df_to_append)
+
+        # Si un envío anterior de estas mismas filas se interrumpió, reanudar sin duplicar
+        clave = _clave_subida(share_or_item, sheet_name, values)
+        pendiente = st.session_state.get("excel_subida_pendiente") or {}
+        omitir = pendiente.get("omitir", []) if pendiente.get("clave") == clave else []
+        if omitir:
+            st.info("Reanudando envío interrumpido...")
+
+        barra = st.progress(0.0, text="Enviando filas a Excel...")
+        try:
+            st.session_state.excel_access_token = enviar_filas_excel(
+                client_id, st.session_state.get("excel_authority") or _authority(), share_or_item, sheet_name,
+                df_to_append.columns.tolist(), values, access_token=access_token,
+                cuenta=st.session_state.get("excel_cuenta"), omitir=omitir,
+                progreso=lambda hechas, total: barra.progress(hechas / total, text=f"Enviadas {hechas} de {total} filas"),
+            )
+        except SubidaInterrumpida as e:
+            st.session_state.excel_subida_pendiente = {"clave": clave, "omitir": e.completados}
+            st.error(f"{e}. Vuelve a enviar para reanudar desde el último lote confirmado.")
+            logger.exception("send_to_connected_excel interrumpido:")
+            return False
+        st.session_state.pop("excel_subida_pendiente", None)
         st.success("Datos enviados a Excel.")
         return True
 
@@ -163,6 +177,73 @@ def send_to_connected_excel(df_to_append: pd.DataFrame, show_preview: bool = Tru
         logger.exception("send_to_connected_excel error:")
         return False
 
+def enviar_filas_excel(client_id: str, authority: str, share_or_item: str, sheet_name: str, cols: list, values: list,
+                       access_token: str = None, cuenta: str = None, omitir=(), progreso=None) -> str:
+    """
+    Envío sin UI (sirve desde un hilo en segundo plano): añade `values` a la primera tabla
+    de la hoja o la crea con los encabezados `cols`; la creación y los lotes de filas
+    viajan juntos en llamadas $batch. Devuelve el access token usado.
+    Lanza SubidaInterrumpida si falla a medias.
+    """
+    from .graph_client import GraphClient
+
+    gc = GraphClient(client_id=client_id, scopes=CORRECT_SCOPES, authority=authority, cuenta=cuenta)
+    # Token de `cuenta` desde el caché (renovado si caducó); si no, el de la sesión, que es de la misma cuenta
+    gc.access_token = gc.adquirir_token_silencioso() or access_token
+
+    last_col = _col_letter(len(cols) - 1) if len(cols) > 0 else "A"
+    header_range = f"{sheet_name}!A1:{last_col}1"
+    gc.append_rows_to_sheet(share_or_item, sheet_name, values, header_range=header_range, omitir=omitir, progreso=progreso)
+    return gc.access_token
+
+def encolar_envio_excel(df_to_append: pd.DataFrame):
+    """
+    Encola el envío de df a la hoja conectada en la cola de trabajos en segundo plano
+    (una cola por libro y hoja). Devuelve el id del trabajo o None si no hay conexión.
+    Si el trabajo se interrumpe, su resultado trae {"clave", "omitir"} para reanudar.
+    """
+    if not st.session_state.get("excel_connected", False):
+        st.error("No hay conexión activa a un libro de Excel. Configura la conexión en la barra lateral.")
+        return None
+    share_or_item = st.session_state.get("excel_share_url")
+    sheet_name = st.session_state.get("excel_sheet_name")
+    if st.session_state.get("excel_access_token") is None or share_or_item is None or not sheet_name:
+        st.error("Faltan datos de conexión. Reconecta al libro.")
+        return None
+
+    from .graph_serializer import dataframe_a_valores
+    from .job_queue import cola_trabajos
+
+    values = dataframe_a_valores(df_to_append)
+    clave = _clave_subida(share_or_item, sheet_name, values)
+    pendiente = st.session_state.get("excel_subida_pendiente") or {}
+    omitir = pendiente.get("omitir", []) if pendiente.get("clave") == clave else []
+    return cola_trabajos().encolar(
+        "excel", f"excel:{share_or_item}|{sheet_name}", _trabajo_envio_excel,
+        st.session_state.get("excel_client_id"), st.session_state.get("excel_authority") or _authority(),
+        share_or_item, sheet_name, df_to_append.columns.tolist(), values,
+        st.session_state.get("excel_access_token"), st.session_state.get("excel_cuenta"), clave, omitir,
+        descripcion=f"Enviar {len(values)} filas a Excel ({sheet_name})",
+    )
+
+def _trabajo_envio_excel(trabajo, client_id, authority, share_or_item, sheet_name, cols, values, access_token, cuenta,
+                        clave, omitir):
+    from .graph_client import SubidaInterrumpida
+    from .instrumentation import medir_ejecucion
+    from .job_queue import ErrorTrabajo
+
+    try:
+        with medir_ejecucion() as medicion:
+            enviar_filas_excel(
+                client_id, authority, share_or_item, sheet_name, cols, values, access_token=access_token, cuenta=cuenta,
+                omitir=omitir,
+                progreso=lambda hechas, total: trabajo.progreso(hechas / total, f"Enviadas {hechas} de {total} filas"),
+            )
+    except SubidaInterrumpida as e:
+        raise ErrorTrabajo(f"{e}. Vuelve a enviar para reanudar desde el último lote confirmado.",
+                           {"clave": clave, "omitir": e.completados}) from e
+    return {"filas": len(values), "rendimiento": medicion.resumen()}
+
 def integrate_ui_and_append(share_url: str, df_to_append: pd.DataFrame):
     """
     Mantener firma para compatibilidad UDLA: usa send_to_connected_excel internamente.
@@ -177,6 +258,14 @@ def integrate_ui_and_append(share_url: str, df_to_append: pd.DataFrame):
     return send_to_connected_excel(df_to_append, show_preview=True)
 
 # helpers internos
+def _authority() -> str:
+    tenant = os.environ.get("AZURE_TENANT_ID", "873b9e93-4463-4b67-a3a9-3dee5f35cec2")
+    return f"https://login.microsoftonline.com/{tenant}"
+
+def _clave_subida(*partes) -> str:
+    """Identifica un envío (destino + filas) para poder reanudarlo tras un fallo."""
+    return hashlib.sha1(json.dumps(partes, ensure_ascii=False).encode("utf-8")).hexdigest()
+
 def _col_letter(idx: int) -> str:
     letters = ""
     n = idx + 1
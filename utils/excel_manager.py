@@ -1,6 +1,13 @@
 import pandas as pd
 import os
+import glob
+import hashlib
 import logging
+import re
+
+from .xlsx_incremental import LibroXlsx, LibroNoIncremental
+from .lead_index import IndiceLeads, hash_estatus
+from .instrumentation import etapa, medido
 
 logger = logging.getLogger(__name__)
 
@@ -18,10 +25,31 @@ COLUMNAS_REZAGADOS = [
     'Ciclo de inicio', 'Tickets', 'Activación de saldo'
 ]
 
+def _borrar_cache_antigua(ruta: str):
+    """
+    Borra las copias en .cache_maestro/ que dejaban versiones anteriores (pickles con
+    todas las hojas, datos personales incluidos) para este maestro.
+    """
+    ruta_abs = os.path.abspath(ruta)
+    directorio = os.path.join(os.path.dirname(ruta_abs), ".cache_maestro")
+    if not os.path.isdir(directorio):
+        return
+    prefijo = hashlib.sha1(ruta_abs.encode("utf-8")).hexdigest()[:16]
+    for viejo in glob.glob(os.path.join(directorio, f"{prefijo}_*.pkl")):
+        try:
+            os.remove(viejo)
+        except OSError:
+            pass
+    try:
+        os.rmdir(directorio)
+    except OSError:
+        pass
+
 def cargar_archivo_maestro(ruta: str) -> dict:
     if not os.path.exists(ruta):
         logger.info(f"Archivo maestro {ruta} no existe.")
         return {}
+    _borrar_cache_antigua(ruta)
     try:
         sheets = pd.read_excel(ruta, sheet_name=None)
         logger.info(f"Cargadas hojas: {list(sheets.keys())}")
@@ -30,6 +58,26 @@ def cargar_archivo_maestro(ruta: str) -> dict:
         logger.exception("Error cargando archivo maestro:")
         raise
 
+def estadisticas_maestro(ruta: str) -> list:
+    """
+    [{'Hoja', 'Registros', 'Columnas'}] de cada hoja del maestro, leyendo solo las
+    dimensiones y la fila de encabezados del XML (sin cargar el contenido de las hojas).
+    """
+    if not os.path.exists(ruta):
+        logger.info(f"Archivo maestro {ruta} no existe.")
+        return []
+    try:
+        with LibroXlsx(ruta) as libro:
+            resumen = []
+            for nombre in libro.nombres_hojas:
+                info = libro.resumen_hoja(nombre)
+                resumen.append({'Hoja': nombre, 'Registros': info['filas'], 'Columnas': info['columnas']})
+        logger.info(f"Estadísticas del maestro: {len(resumen)} hojas")
+        return resumen
+    except Exception as e:
+        logger.exception("Error leyendo estadísticas del maestro:")
+        raise
+
 def _ensure_maestro_structure(sheets: dict, periodo: str) -> dict:
     hoja_ventas = f"Ventas Nuevas Maestrías {periodo}"
     hoja_rezagados = f"Rezagados Maestrías {periodo}"
@@ -41,18 +89,135 @@ def _ensure_maestro_structure(sheets: dict, periodo: str) -> dict:
 
     return sheets
 
-def actualizar_maestro(df_depurado: pd.DataFrame, ruta: str, periodo: str, only_manage_rezagados: bool = False) -> tuple:
+def _columna_estatus(columnas) -> str:
+    if 'Estatus' in columnas:
+        return 'Estatus'
+    possible_status_cols = [c for c in columnas if 'estatus' in str(c).lower()]
+    return possible_status_cols[0] if possible_status_cols else None
+
+_REZAGADO_RE = re.compile('pospone', re.IGNORECASE)
+
+def _es_rezagado(valor) -> bool:
+    return valor is not None and _REZAGADO_RE.search(str(valor)) is not None
+
+@medido("actualizar_maestro")
+def actualizar_maestro(df_depurado: pd.DataFrame, ruta: str, periodo: str, only_manage_rezagados: bool = False, incremental: bool = True) -> tuple:
+    """
+    Añade df_depurado a la hoja de Ventas del período y mueve los rezagados.
+    Si el libro ya tiene las hojas del período, se actualiza de forma incremental
+    (solo se reescriben esas dos hojas); si no, se reescribe el libro completo.
+    Devuelve (filas_agregadas, rezagados_movidos).
+    """
+    if incremental and os.path.exists(ruta):
+        try:
+            return _actualizar_maestro_incremental(df_depurado, ruta, periodo, only_manage_rezagados)
+        except LibroNoIncremental as e:
+            logger.info(f"Actualización incremental no disponible ({e}); se reescribe el libro completo.")
+    return _actualizar_maestro_completo(df_depurado, ruta, periodo, only_manage_rezagados)
+
+def _actualizar_maestro_incremental(df_depurado: pd.DataFrame, ruta: str, periodo: str, only_manage_rezagados: bool = False) -> tuple:
     hoja_ventas = f"Ventas Nuevas Maestrías {periodo}"
     hoja_rezagados = f"Rezagados Maestrías {periodo}"
 
-    sheets = {}
-    if os.path.exists(ruta):
+    with IndiceLeads(ruta) as indice, LibroXlsx(ruta) as libro:
+        if hoja_ventas not in libro.nombres_hojas or hoja_rezagados not in libro.nombres_hojas:
+            raise LibroNoIncremental(f"El libro no contiene las hojas del período {periodo}.")
+        with etapa("maestro_leer"):
+            indice.asegurar_vigente(libro)
+            ventas = libro.hoja(hoja_ventas)
+            rezagados_hoja = libro.hoja(hoja_rezagados)
+
+        # Filas nuevas, deduplicadas por LEAD contra la hoja y dentro del lote
+        nuevas = []
+        if not only_manage_rezagados and df_depurado is not None and not df_depurado.empty:
+            df_nuevo = df_depurado.reindex(columns=COLUMNAS_VENTAS + [c for c in df_depurado.columns if c not in COLUMNAS_VENTAS])
+            df_nuevo = df_nuevo.astype(object).where(df_nuevo.notna(), None)
+            leads = indice.presentes(hoja_ventas, ('' if l is None else str(l) for l in df_nuevo['LEAD']))
+            for fila in df_nuevo.to_dict('records'):
+                lead = '' if fila['LEAD'] is None else str(fila['LEAD'])
+                if lead in leads:
+                    continue
+                leads.add(lead)
+                nuevas.append(fila)
+            logger.info(f"De {len(df_nuevo)} filas nuevas se quitaron {len(df_nuevo) - len(nuevas)} duplicados por LEAD.")
+
+        # Rezagados: filas existentes y nuevas cuyo estatus contiene 'pospone'.
+        # De las existentes solo se examinan las que cambiaron de Estatus desde la última
+        # revisión; si la hoja no ha cambiado desde entonces (mismo CRC) ni se lee.
+        columnas_nuevas = list(nuevas[0].keys()) if nuevas else []
+        estatus_col = _columna_estatus(ventas.encabezados + [c for c in columnas_nuevas if c not in ventas.encabezados])
+        rezagados = []
+        hashes_nuevos, leads_olvidados = {}, []
+        if estatus_col is not None:
+            idx_estatus = ventas.indice(estatus_col)
+            if idx_estatus is not None and indice.crc_revisado(hoja_ventas) != libro.crc(hoja_ventas):
+                idx_lead = ventas.indice('LEAD')
+                hashes = indice.hashes_estatus(hoja_ventas)
+                filas_movidas = []
+                examinadas = 0
+                for r, valores in ventas.filas:
+                    estatus = valores.get(idx_estatus, '')
+                    lead = valores.get(idx_lead, '') if idx_lead is not None else ''
+                    h = hash_estatus(estatus)
+                    if lead and hashes.get(lead) == h:
+                        continue
+                    examinadas += 1
+                    if _es_rezagado(estatus):
+                        filas_movidas.append((r, valores))
+                        if lead:
+                            leads_olvidados.append(lead)
+                    elif lead:
+                        hashes_nuevos[lead] = h
+                logger.info(f"Revisión de rezagados: {examinadas} de {len(ventas.filas)} filas con Estatus cambiado.")
+                ventas.eliminar_filas(r for r, _ in filas_movidas)
+                rezagados = ventas.filas_originales(r for r, _ in filas_movidas)
+            rezagados += [f for f in nuevas if _es_rezagado(f.get(estatus_col))]
+            nuevas_ventas = [f for f in nuevas if not _es_rezagado(f.get(estatus_col))]
+            for f in nuevas_ventas:
+                if f.get('LEAD') is not None and str(f.get('LEAD')) != '':
+                    hashes_nuevos[str(f.get('LEAD'))] = hash_estatus(f.get(estatus_col))
+        else:
+            nuevas_ventas = nuevas
+        ventas.agregar_filas(nuevas_ventas)
+
+        if rezagados:
+            leads_rezagados = indice.presentes(hoja_rezagados, ('' if f.get('LEAD') is None else str(f.get('LEAD')) for f in rezagados))
+            nuevos_rezagados = []
+            for fila in rezagados:
+                lead = '' if fila.get('LEAD') is None else str(fila.get('LEAD'))
+                if lead in leads_rezagados:
+                    continue
+                leads_rezagados.add(lead)
+                nuevos_rezagados.append(fila)
+            rezagados_hoja.asegurar_encabezados(COLUMNAS_REZAGADOS)
+            rezagados_hoja.agregar_filas(nuevos_rezagados)
+
         try:
-            sheets = pd.read_excel(ruta, sheet_name=None)
+            with etapa("maestro_escribir"):
+                libro.guardar()
+                indice.registrar_cambios(
+                    {h.nombre: h.cambios('LEAD') for h in (ventas, rezagados_hoja) if h.modificada},
+                    estatus={hoja_ventas: (hashes_nuevos, leads_olvidados)},
+                    revisadas=[hoja_ventas],
+                )
+            logger.info(f"Archivo maestro actualizado (incremental): {ruta} - {len(nuevas)} añadidas, {len(rezagados)} rezagados")
         except Exception as e:
-            logger.exception("Error leyendo archivo maestro existente:")
+            logger.exception("Error guardando archivo maestro:")
             raise
 
+    return len(nuevas), len(rezagados)
+
+def _actualizar_maestro_completo(df_depurado: pd.DataFrame, ruta: str, periodo: str, only_manage_rezagados: bool = False) -> tuple:
+    hoja_ventas = f"Ventas Nuevas Maestrías {periodo}"
+    hoja_rezagados = f"Rezagados Maestrías {periodo}"
+
+    try:
+        with etapa("maestro_leer"):
+            sheets = cargar_archivo_maestro(ruta)
+    except Exception as e:
+        logger.exception("Error leyendo archivo maestro existente:")
+        raise
+
     sheets = _ensure_maestro_structure(sheets, periodo)
 
     df_ventas_existente = sheets.get(hoja_ventas, pd.DataFrame(columns=COLUMNAS_VENTAS))
@@ -81,13 +246,9 @@ def actualizar_maestro(df_depurado: pd.DataFrame, ruta: str, periodo: str, only_
         df_ventas_actualizado = df_ventas_existente.copy()
 
     rezagado_mask = None
-    if 'Estatus' in df_ventas_actualizado.columns:
-        rezagado_mask = df_ventas_actualizado['Estatus'].astype(str).str.lower().str.contains('pospone', na=False)
-    else:
-        possible_status_cols = [c for c in df_ventas_actualizado.columns if 'estatus' in c.lower()]
-        if possible_status_cols:
-            col = possible_status_cols[0]
-            rezagado_mask = df_ventas_actualizado[col].astype(str).str.lower().str.contains('pospone', na=False)
+    estatus_col = _columna_estatus(list(df_ventas_actualizado.columns))
+    if estatus_col is not None:
+        rezagado_mask = df_ventas_actualizado[estatus_col].astype(str).str.contains(_REZAGADO_RE, na=False)
 
     if rezagado_mask is not None and rezagado_mask.any():
         rezagados = df_ventas_actualizado[rezagado_mask].copy()
@@ -109,7 +270,7 @@ def actualizar_maestro(df_depurado: pd.DataFrame, ruta: str, periodo: str, only_
     df_rezagados_actualizado = df_rezagados_actualizado.reindex(columns=COLUMNAS_REZAGADOS + [c for c in df_rezagados_actualizado.columns if c not in COLUMNAS_REZAGADOS], fill_value=pd.NA)
 
     try:
-        with pd.ExcelWriter(ruta, engine="openpyxl") as writer:
+        with etapa("maestro_escribir"), pd.ExcelWriter(ruta, engine="openpyxl") as writer:
             df_ventas_actualizado.to_excel(writer, sheet_name=hoja_ventas, index=False)
             df_rezagados_actualizado.to_excel(writer, sheet_name=hoja_rezagados, index=False)
             for sheet_name, df_sheet in sheets.items():
@@ -8,19 +8,27 @@ Funciones principales:
 """
 import streamlit as st
 import pandas as pd
+import hashlib
+import json
 from typing import Optional
-from .graph_client import GraphClient
+from .graph_client import GraphClient, SubidaInterrumpida
+from .graph_serializer import dataframe_a_valores
 import logging
 
 logger = logging.getLogger(__name__)
 
 def connect_with_device_flow_gc(gc: GraphClient) -> bool:
     """
-    Inicia Device Code Flow y espera a que el usuario complete el login.
+    Obtiene el token del caché para la cuenta de gc (la de esta sesión) si la tiene; si no,
+    inicia Device Code Flow y espera a que el usuario complete el login.
     Muestra el mensaje de Device Code en la UI (flow["message"]).
-    Devuelve True si la autenticación fue exitosa.
+    Devuelve True si la autenticación fue exitosa; la cuenta queda en st.session_state.excel_cuenta.
     """
     try:
+        # Cuenta de esta sesión con token guardado en el caché: sin Device Code
+        if gc.adquirir_token_silencioso():
+            st.success("Sesión de Microsoft recuperada.")
+            return True
         flow = gc.app.initiate_device_flow(scopes=gc.scopes)
         if "user_code" not in flow:
             st.error("No se pudo iniciar Device Flow (respuesta inesperada).")
@@ -30,7 +38,8 @@ def connect_with_device_flow_gc(gc: GraphClient) -> bool:
         st.info(flow.get("message", "Sigue las instrucciones para autenticarte en Microsoft."))
         token = gc.app.acquire_token_by_device_flow(flow)  # polling interno
         if "access_token" in token:
-            gc.access_token = token["access_token"]
+            gc.registrar_token(token)
+            st.session_state.excel_cuenta = gc.cuenta
             st.success("Autenticación completada correctamente.")
             return True
         else:
@@ -66,7 +75,7 @@ def integrate_ui_and_append(share_url: str, df_to_append: pd.DataFrame):
         st.warning("Se requiere AZURE_CLIENT_ID. Defínelo en Streamlit secrets o escríbelo en la caja lateral.")
         return
 
-    gc = GraphClient(client_id=client_id)
+    gc = GraphClient(client_id=client_id, cuenta=st.session_state.get("excel_cuenta"))
 
     # Botón de conexión / Device Code
     if st.button("Conectar a Excel Online (Device Code)"):
@@ -74,7 +83,9 @@ def integrate_ui_and_append(share_url: str, df_to_append: pd.DataFrame):
         if not ok:
             return
 
-    # Si no hay token aún, pedir al usuario que se conecte
+    # Si no hay token aún, probar el caché para la cuenta de esta sesión y si no, pedir al usuario que se conecte
+    if not getattr(gc, "access_token", None):
+        gc.adquirir_token_silencioso()
     if not getattr(gc, "access_token", None):
         st.info("Presiona 'Conectar a Excel Online (Device Code)' para iniciar autenticación.")
         return
@@ -149,32 +160,32 @@ def integrate_ui_and_append(share_url: str, df_to_append: pd.DataFrame):
                 headers = gc.get_table_headers(share_url, table_id) or cols
                 st.success("Tabla creada y seleccionada.")
 
-            # Mapear columnas del df al orden de headers
-            df = df_to_append.copy()
-            values = []
-            for _, row in df.iterrows():
-                row_vals = []
-                for h in headers:
-                    match_col = next((c for c in df.columns if c.strip().lower() == str(h).strip().lower()), None)
-                    if match_col:
-                        row_vals.append("" if pd.isna(row[match_col]) else str(row[match_col]))
-                    else:
-                        row_vals.append("")
-                values.append(row_vals)
+            # Mapear columnas del df al orden de headers (una sola vez) y serializar vectorizado
+            values = dataframe_a_valores(df_to_append, headers)
 
             if not values:
                 st.info("No hay filas para enviar.")
                 return
 
-            # Enviar en lotes de 100
+            # Enviar en lotes de hasta 100 filas (acotados en bytes), agrupados en llamadas $batch
+            # en orden; si un envío anterior de estas filas se interrumpió, se reanuda
             batch_size = 100
-            total_added = 0
-            for i in range(0, len(values), batch_size):
-                chunk = values[i:i+batch_size]
-                resp = gc.add_rows_to_table(share_url, table_id, chunk)
-                total_added += len(chunk)
-                st.info(f"Se envió lote {i//batch_size + 1}, filas: {len(chunk)}")
-            st.success(f"✅ Se añadieron {total_added} filas a la tabla.")
+            clave = hashlib.sha1(json.dumps([share_url, table_id, values], ensure_ascii=False).encode("utf-8")).hexdigest()
+            pendiente = st.session_state.get("excel_subida_pendiente") or {}
+            omitir = pendiente.get("omitir", []) if pendiente.get("clave") == clave else []
+            barra = st.progress(0.0, text="Enviando filas...")
+            try:
+                gc.add_rows_to_table(
+                    share_url, table_id, values, batch_size=batch_size, omitir=omitir,
+                    progreso=lambda hechas, total: barra.progress(hechas / total, text=f"Enviadas {hechas} de {total} filas"),
+                )
+            except SubidaInterrumpida as e:
+                st.session_state.excel_subida_pendiente = {"clave": clave, "omitir": e.completados}
+                st.error(f"{e}. Pulsa de nuevo 'Enviar' para reanudar desde el último lote confirmado.")
+                logger.exception("integrate_ui_and_append interrumpido:")
+                return
+            st.session_state.pop("excel_subida_pendiente", None)
+            st.success(f"✅ Se añadieron {len(values)} filas a la tabla.")
         except Exception as e:
             st.error("Error enviando filas a Excel Online.")
             st.exception(e)
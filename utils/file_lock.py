@@ -0,0 +1,53 @@
+"""
+Bloqueo exclusivo entre procesos sobre un archivo (fcntl en POSIX, msvcrt en Windows).
+Lo usan el historial, la cola de trabajos y utils.pipeline.
+"""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def bloquear(f, esperar: bool = True) -> bool:
+    """
+    Toma el bloqueo sobre el archivo abierto `f`. Con esperar=False no se bloquea:
+    devuelve False si otro proceso (u otro descriptor) ya lo tiene.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+    f.seek(0)
+    try:
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if esperar else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if esperar:
+            raise
+        return False
+    return True
+
+
+def desbloquear(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def bloqueo_exclusivo(ruta_lock: str):
+    """Bloqueo exclusivo sobre el archivo `ruta_lock` (se crea si no existe) mientras dura el bloque."""
+    os.makedirs(os.path.dirname(os.path.abspath(ruta_lock)), exist_ok=True)
+    with open(ruta_lock, 'a+b') as f:
+        bloquear(f)
+        try:
+            yield
+        finally:
+            desbloquear(f)
@@ -1,6 +1,63 @@
-# --- fragmento a reemplazar / mejorar en utils/graph_client.py ---
+"""
+Cliente mínimo de Microsoft Graph para libros de Excel Online.
 
+GraphClient mantiene una requests.Session con pool de conexiones (keep-alive), de
+modo que las llamadas sucesivas reutilizan la conexión TLS. Las respuestas 429/503
+(throttling) se reintentan con backoff exponencial respetando la cabecera
+Retry-After; las 502/504 y los fallos de conexión solo en métodos idempotentes, ya
+que la escritura pudo aplicarse. Todos los timeouts son configurables.
+
+batch() agrupa sub-peticiones en el endpoint JSON $batch (hasta 20 por llamada,
+con orden por dependsOn); la creación de tablas y el envío de filas lo usan para
+reducir las idas y vueltas a Graph.
+
+Las cachés son de proceso (la UI crea un GraphClient por envío) y sus claves incluyen
+la identidad del usuario, así una sesión nunca recibe lo que consultó otra cuenta: la
+resolución de una share URL a drives/{driveId}/items/{itemId} se hace una sola vez,
+la sesión de libro (createSession con persistChanges) se reutiliza mientras siga
+activa, y las listas de hojas, tablas y encabezados se guardan unos segundos (TTL).
+"""
+import base64
+import email.utils
+import logging
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .graph_serializer import cuerpo_filas, filas_json, serializar_batch
+from .instrumentation import medido
+from .token_cache import adquirir_token_silencioso, crear_app_msal, cuenta_de_resultado
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+DEFAULT_SCOPES = ["Files.ReadWrite", "User.Read"]
+DEFAULT_AUTHORITY = "https://login.microsoftonline.com/common"
+
+ESTADOS_REINTENTABLES = frozenset({429, 502, 503, 504})
+TAMANO_BATCH = 20
+# Graph cierra una sesión persistente tras ~5 min sin uso; se renueva antes
+INACTIVIDAD_SESION = 240
+# Margen con el que se renueva el access token antes de que caduque
+MARGEN_RENOVACION_TOKEN = 300
+TTL_METADATOS = 60
+# Límites de subida de filas: por sub-petición rows/add y por llamada $batch (Graph admite ~4 MB)
+MAX_FILAS_FRAGMENTO = 100
+MAX_BYTES_FRAGMENTO = 512 * 1024
+MAX_BYTES_BATCH = 3 * 1024 * 1024
+_METODOS_IDEMPOTENTES = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+# Graph no procesó la petición; 502/504 vienen de una pasarela y no lo garantizan
+_ESTADOS_THROTTLING = frozenset({429, 503})
+
+
+def _reintentable(status, idempotente: bool) -> bool:
+    return status in _ESTADOS_THROTTLING or (idempotente and status in ESTADOS_REINTENTABLES)
+
 
 def _looks_like_item_id(s: str) -> bool:
     """Validación simple para un item_id plausible (sin espacios, longitud razonable)."""
@@ -10,43 +67,614 @@ def _looks_like_item_id(s: str) -> bool:
     # item_id plausible: caracteres alfanuméricos, guiones, guion bajo, dos puntos; longitud 8-250
     return bool(re.match(r'^[A-Za-z0-9\-\_\:]{8,250}$', s))
 
-def get_workbook_worksheets(self, share_url_or_item: str):
+
+def _share_id_from_url(share_url: str) -> str:
+    """shareId de Graph para una URL de compartir: 'u!' + base64url sin relleno."""
+    codificado = base64.urlsafe_b64encode(share_url.strip().encode("utf-8")).decode("ascii")
+    return "u!" + codificado.rstrip("=")
+
+
+def _segundos_retry_after(valor):
+    """Segundos indicados por Retry-After (entero o fecha HTTP), o None si no es válido."""
+    if not valor:
+        return None
+    valor = valor.strip()
+    if valor.isdigit():
+        return float(valor)
+    try:
+        fecha = email.utils.parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, fecha.timestamp() - time.time())
+
+
+def _exito(respuesta) -> bool:
+    return respuesta is not None and 200 <= respuesta.get("status", 0) < 300
+
+
+def _mensaje_error(respuesta: dict) -> str:
+    body = respuesta.get("body")
+    if isinstance(body, dict) and isinstance(body.get("error"), dict):
+        return body["error"].get("message") or body["error"].get("code") or ""
+    return str(body or "")
+
+
+def _fragmentar_filas(filas: list, max_filas: int = MAX_FILAS_FRAGMENTO, max_bytes: int = MAX_BYTES_FRAGMENTO) -> list:
+    """[(inicio, fin, bytes)] de fragmentos consecutivos de `filas` (ya codificadas con filas_json) acotados en filas y bytes."""
+    fragmentos = []
+    inicio, acumulado = 0, 0
+    for i, fila in enumerate(filas):
+        tamano = len(fila.encode("utf-8")) + 1
+        if i > inicio and (i - inicio >= max_filas or acumulado + tamano > max_bytes):
+            fragmentos.append((inicio, i, acumulado))
+            inicio, acumulado = i, 0
+        acumulado += tamano
+    if inicio < len(filas):
+        fragmentos.append((inicio, len(filas), acumulado))
+    return fragmentos
+
+
+def _agrupar_fragmentos(fragmentos: list, indices, max_bytes: int = MAX_BYTES_BATCH) -> list:
+    """Agrupa índices de fragmentos en llamadas $batch de hasta 20 sub-peticiones y `max_bytes`."""
+    grupos, grupo, acumulado = [], [], 0
+    for idx in indices:
+        tamano = fragmentos[idx][2]
+        if grupo and (len(grupo) >= TAMANO_BATCH or acumulado + tamano > max_bytes):
+            grupos.append(grupo)
+            grupo, acumulado = [], 0
+        grupo.append(idx)
+        acumulado += tamano
+    if grupo:
+        grupos.append(grupo)
+    return grupos
+
+
+class SubidaInterrumpida(RuntimeError):
     """
-    Obtener worksheets desde una share URL o desde item_id.
-    Validamos la entrada y devolvemos un error claro si la cadena no es ni URL ni item_id plausible.
+    Falló upload_rows a mitad de la subida. `completados` son los índices de fragmento
+    ya aplicados en Graph: se pasan como `omitir` para reanudar sin duplicar filas.
     """
-    GRAPH_BASE = "https://graph.microsoft.com/v1.0"
-    if not isinstance(share_url_or_item, str):
-        raise ValueError("El identificador proporcionado no es una cadena. Proporciona la URL de compartir o el item_id.")
-    share_url_or_item = share_url_or_item.strip()
-
-    # Si es una posible share URL, usar /shares/{shareId}/driveItem/...
-    if share_url_or_item.lower().startswith(("http://", "https://")):
-        # Convertir a shareId y llamar a /shares/{shareId}/driveItem/workbook/worksheets
-        try:
-            share_id = _share_id_from_url(share_url_or_item)
-            url = f"{GRAPH_BASE}/shares/{share_id}/driveItem/workbook/worksheets"
-            r = requests.get(url, headers=self._headers())
+
+    def __init__(self, mensaje: str, completados: list, filas_completadas: int, total_filas: int):
+        super().__init__(mensaje)
+        self.completados = completados
+        self.filas_completadas = filas_completadas
+        self.total_filas = total_filas
+
+
+def _es_error_de_sesion(respuesta: dict) -> bool:
+    body = respuesta.get("body")
+    codigo = body.get("error", {}).get("code", "") if isinstance(body, dict) and isinstance(body.get("error"), dict) else ""
+    return "session" in str(codigo).lower()
+
+
+class _CacheTTL:
+    """Diccionario con caducidad por entrada, seguro entre hilos."""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, ttl: float):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            if ttl is not None and time.monotonic() - entrada[1] > ttl:
+                del self._datos[clave]
+                return None
+            return entrada[0]
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic())
+
+    def invalidar(self, prefijo: tuple, desde: int = 0):
+        """Elimina las entradas cuya clave (tupla) contiene `prefijo` a partir de la posición `desde`."""
+        with self._lock:
+            for clave in [c for c in self._datos if c[desde:desde + len(prefijo)] == prefijo]:
+                del self._datos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+_items_resueltos = _CacheTTL()
+_sesiones_libro = _CacheTTL()
+_metadatos = _CacheTTL()
+
+
+def limpiar_caches_graph():
+    """Olvida las rutas resueltas, las sesiones de libro y los metadatos en caché."""
+    for cache in (_items_resueltos, _sesiones_libro, _metadatos):
+        cache.limpiar()
+
+
+class GraphClient:
+    """
+    Acceso a Graph con un token delegado (Device Code).
+
+        gc = GraphClient(client_id=..., scopes=..., cuenta=id_cuenta_de_la_sesion)
+        gc.access_token = gc.adquirir_token_silencioso()   # o registrar_token(device flow)
+        gc.get_workbook_worksheets(share_url_o_item_id)
+
+    - cuenta: home_account_id (o nombre de usuario) de la cuenta MSAL con la que se
+      renueva el token en silencio; registrar_token() la fija a partir del Device Code.
+      Sin cuenta no hay renovación silenciosa.
+
+    - timeout: (conexión, lectura) en segundos para cada petición.
+    - max_reintentos: reintentos ante 429/503, y ante 502/504 o fallos de conexión
+      en métodos idempotentes.
+    - backoff_base / backoff_max: espera exponencial (base * 2**intento, con jitter)
+      cuando Graph no indica Retry-After; Retry-After siempre tiene prioridad.
+    - usar_sesion: abrir y reutilizar una sesión de libro con persistChanges.
+    - ttl_metadatos: segundos que se reutilizan las listas de hojas, tablas y encabezados.
+    """
+
+    def __init__(self, client_id: str = None, scopes=None, authority: str = None,
+                 timeout=(5, 60), max_reintentos: int = 5, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, tamano_pool: int = 10, graph_base: str = GRAPH_BASE,
+                 usar_sesion: bool = True, ttl_metadatos: float = TTL_METADATOS, cuenta: str = None):
+        self.client_id = client_id
+        self.scopes = list(scopes or DEFAULT_SCOPES)
+        self.authority = authority or DEFAULT_AUTHORITY
+        self.app = crear_app_msal(client_id, self.authority) if client_id else None
+        self.access_token = None
+        self.cuenta = cuenta
+        self._expira = None
+        self._lock_token = threading.Lock()
+        self.timeout = timeout
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.graph_base = graph_base.rstrip("/")
+        self.usar_sesion = usar_sesion
+        self.ttl_metadatos = ttl_metadatos
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=tamano_pool, pool_maxsize=tamano_pool)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
+
+    def cerrar(self):
+        self.session.close()
+
+    def registrar_token(self, resultado: dict):
+        """
+        Guarda el token de un resultado del Device Code y liga el cliente a la cuenta que
+        inició sesión (si no se puede determinar, el cliente queda sin cuenta).
+        """
+        if self.app is not None:
+            self.cuenta = cuenta_de_resultado(self.app, resultado)
+        self._guardar_token(resultado)
+
+    def _guardar_token(self, resultado: dict):
+        self.access_token = resultado["access_token"]
+        self._expira = time.time() + int(resultado.get("expires_in") or 0)
+        if self.app is not None and hasattr(self.app.token_cache, "guardar"):
+            self.app.token_cache.guardar()
+
+    def adquirir_token_silencioso(self):
+        """
+        Token de `cuenta` desde el caché de tokens (sin Device Code), renovado si hace falta.
+        Devuelve el access token o None si no hay cuenta o esa cuenta no tiene sesión guardada.
+        """
+        if self.app is None or not self.cuenta:
+            return None
+        resultado = adquirir_token_silencioso(self.app, self.scopes, self.cuenta)
+        if resultado is None:
+            return None
+        self._guardar_token(resultado)
+        return self.access_token
+
+    def _identidad(self) -> str:
+        """Clave del usuario en las cachés de proceso: la cuenta MSAL si se conoce (estable entre renovaciones)."""
+        return self.cuenta or self.access_token
+
+    def _renovar_token_si_caduca(self):
+        if self.app is None or self._expira is None or time.time() < self._expira - MARGEN_RENOVACION_TOKEN:
+            return
+        with self._lock_token:
+            if time.time() < self._expira - MARGEN_RENOVACION_TOKEN:
+                return
+            if self.adquirir_token_silencioso() is None:
+                logger.warning("No se pudo renovar el token de Graph desde el caché.")
+
+    def _headers(self) -> dict:
+        self._renovar_token_si_caduca()
+        if not self.access_token:
+            raise RuntimeError("GraphClient sin access_token: autentícate antes de llamar a Graph.")
+        return {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json"}
+
+    def _espera(self, intento: int, respuesta=None) -> float:
+        if respuesta is not None:
+            retry_after = _segundos_retry_after(respuesta.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        espera = min(self.backoff_base * (2 ** intento), self.backoff_max)
+        return espera * random.uniform(0.5, 1.0)
+
+    @medido("graph_http")
+    def _solicitud(self, metodo: str, ruta: str, idempotente: bool = None, **kwargs) -> requests.Response:
+        """
+        Petición a Graph (ruta relativa a graph_base o URL absoluta) con reintentos.
+        `idempotente` (por defecto, según el método) decide si se reintentan 502/504 y
+        fallos de conexión. Lanza requests.HTTPError si la respuesta final no es 2xx.
+        """
+        metodo = metodo.upper()
+        if idempotente is None:
+            idempotente = metodo in _METODOS_IDEMPOTENTES
+        url = ruta if ruta.startswith(("http://", "https://")) else f"{self.graph_base}/{ruta.lstrip('/')}"
+        kwargs.setdefault("timeout", self.timeout)
+        headers = {**self._headers(), **kwargs.pop("headers", {})}
+
+        for intento in range(self.max_reintentos + 1):
+            try:
+                r = self.session.request(metodo, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Sin respuesta: solo se reintenta si repetir la petición es seguro
+                seguro = idempotente or isinstance(e, requests.ConnectTimeout)
+                if not seguro or intento == self.max_reintentos:
+                    raise
+                espera = self._espera(intento)
+                logger.warning(f"Graph {metodo} {url}: {e.__class__.__name__}; reintento {intento + 1} en {espera:.1f}s")
+                time.sleep(espera)
+                continue
+
+            if _reintentable(r.status_code, idempotente) and intento < self.max_reintentos:
+                espera = self._espera(intento, r)
+                logger.warning(f"Graph {metodo} {url}: HTTP {r.status_code}; reintento {intento + 1} en {espera:.1f}s")
+                r.close()
+                time.sleep(espera)
+                continue
+
             r.raise_for_status()
-            return r.json().get("value", [])
-        except requests.HTTPError as he:
-            # Re-lanzamos para que el UI muestre el error HTTP que Graph devuelva
-            raise he
-        except Exception as e:
-            raise RuntimeError(f"No se pudo usar la share URL: {e}")
-
-    # Si no es URL, verificar si parece item_id válido
-    if _looks_like_item_id(share_url_or_item):
+            return r
+
+    def _json(self, metodo: str, ruta: str, **kwargs) -> dict:
+        r = self._solicitud(metodo, ruta, **kwargs)
+        return r.json() if r.content else {}
+
+    def _espera_batch(self, intento: int, respuestas: list) -> float:
+        esperas = [_segundos_retry_after(str((r.get("headers") or {}).get("Retry-After") or "")) for r in respuestas]
+        esperas = [e for e in esperas if e is not None]
+        if esperas:
+            return min(max(esperas), self.backoff_max)
+        return self._espera(intento)
+
+    def batch(self, solicitudes: list, lanzar: bool = True) -> dict:
+        """
+        Ejecuta sub-peticiones por el endpoint JSON $batch, en grupos de hasta 20.
+
+        Cada solicitud es {'id', 'method', 'url' (relativa a graph_base, con '/' inicial)}
+        y opcionalmente 'body', 'headers' y 'dependsOn' (ids que deben completarse antes).
+        Las dependencias hacia un grupo anterior ya se cumplieron y se omiten al enviar; si
+        esa dependencia falló, la solicitud no se envía y queda con status 424.
+        Las sub-respuestas 429/503, y 502/504 de métodos idempotentes (más las 424 que
+        dependen de ellas), se reintentan respetando Retry-After. Devuelve {id: {'status', 'headers', 'body'}}; con
+        lanzar=True, una sub-petición fallida lanza requests.HTTPError.
+        """
+        respuestas = {}
+        dependencias = {s["id"]: list(s.get("dependsOn") or []) for s in solicitudes}
+        idempotentes = {s["id"]: s["method"].upper() in _METODOS_IDEMPOTENTES for s in solicitudes}
+
+        def reintentable(id_):
+            r = respuestas.get(id_)
+            if r is None:
+                return False
+            if _reintentable(r.get("status"), idempotentes[id_]):
+                return True
+            return r.get("status") == 424 and any(reintentable(d) for d in dependencias.get(id_, []))
+
+        pendientes = list(solicitudes)
+        for intento in range(self.max_reintentos + 1):
+            for i in range(0, len(pendientes), TAMANO_BATCH):
+                enviar = []
+                for s in pendientes[i:i + TAMANO_BATCH]:
+                    ids_enviados = {e["id"] for e in enviar}
+                    deps = dependencias[s["id"]]
+                    fallida = next((d for d in deps if d not in ids_enviados and not _exito(respuestas.get(d))), None)
+                    if fallida is not None:
+                        respuestas[s["id"]] = {"id": s["id"], "status": 424, "headers": {},
+                                               "body": {"error": {"code": "failedDependency",
+                                                                  "message": f"Falló la sub-petición {fallida}"}}}
+                        continue
+                    sub = {k: v for k, v in s.items() if k != "dependsOn"}
+                    deps_grupo = [d for d in deps if d in ids_enviados]
+                    if deps_grupo:
+                        sub["dependsOn"] = deps_grupo
+                    enviar.append(sub)
+                if not enviar:
+                    continue
+                datos = self._json("POST", "$batch", data=serializar_batch(enviar),
+                                   idempotente=all(idempotentes[s["id"]] for s in enviar))
+                for r in datos.get("responses", []):
+                    respuestas[r["id"]] = r
+
+            pendientes = [s for s in solicitudes if reintentable(s["id"])]
+            if not pendientes or intento == self.max_reintentos:
+                break
+            espera = self._espera_batch(intento, [respuestas[s["id"]] for s in pendientes])
+            logger.warning(f"Graph $batch: {len(pendientes)} sub-peticiones con throttling; reintento {intento + 1} en {espera:.1f}s")
+            time.sleep(espera)
+
+        if lanzar:
+            self._lanzar_fallidas(solicitudes, respuestas)
+        return respuestas
+
+    @staticmethod
+    def _lanzar_fallidas(solicitudes: list, respuestas: dict):
+        fallidas = [(s["id"], respuestas.get(s["id"], {})) for s in solicitudes if not _exito(respuestas.get(s["id"]))]
+        if fallidas:
+            id_, r = fallidas[0]
+            raise requests.HTTPError(
+                f"{len(fallidas)} sub-peticiones de $batch fallaron; primera '{id_}': HTTP {r.get('status')} {_mensaje_error(r)}"
+            )
+
+    @staticmethod
+    def _subpeticion(id_: str, metodo: str, ruta: str, body=None, depends_on=None) -> dict:
+        sub = {"id": str(id_), "method": metodo, "url": "/" + ruta.lstrip("/")}
+        if body is not None:
+            sub["body"] = body
+            sub["headers"] = {"Content-Type": "application/json"}
+        if depends_on:
+            sub["dependsOn"] = [str(d) for d in depends_on]
+        return sub
+
+    def _subpeticiones_filas(self, ruta_tabla: str, filas: list, fragmentos: list, indices, depende: str = None) -> list:
+        """rows/add de los fragmentos indicados, encadenados con dependsOn para conservar el orden."""
+        subpeticiones = []
+        anterior = depende
+        for idx in indices:
+            inicio, fin, _ = fragmentos[idx]
+            id_ = f"filas{idx}"
+            subpeticiones.append(self._subpeticion(id_, "POST", f"{ruta_tabla}/rows/add",
+                                                   cuerpo_filas(filas[inicio:fin]),
+                                                   [anterior] if anterior else None))
+            anterior = id_
+        return subpeticiones
+
+    def _ruta_item(self, share_url_or_item: str) -> str:
+        """
+        Ruta del driveItem para una share URL o un item_id. Una share URL se resuelve
+        una sola vez a drives/{driveId}/items/{itemId}.
+        """
+        if not isinstance(share_url_or_item, str):
+            raise ValueError("El identificador proporcionado no es una cadena. Proporciona la URL de compartir o el item_id.")
+        share_url_or_item = share_url_or_item.strip()
+        if share_url_or_item.lower().startswith(("http://", "https://")):
+            clave = (self._identidad(), share_url_or_item)
+            ruta = _items_resueltos.obtener(clave, None)
+            if ruta is None:
+                item = self._json("GET", f"shares/{_share_id_from_url(share_url_or_item)}/driveItem",
+                                  params={"$select": "id,parentReference"})
+                ruta = f"drives/{item['parentReference']['driveId']}/items/{item['id']}"
+                _items_resueltos.guardar(clave, ruta)
+                logger.info(f"Share URL resuelta a {ruta}")
+            return ruta
+        if _looks_like_item_id(share_url_or_item):
+            return f"me/drive/items/{share_url_or_item}"
+        raise ValueError("El valor proporcionado no parece una URL de compartir (https://...) ni un item_id válido. Pega la URL de compartir de OneDrive/SharePoint o el item_id correcto.")
+
+    def _sesion(self, ruta: str):
+        """Id de la sesión de libro para `ruta` (se crea si no hay una activa), o None sin sesión."""
+        if not self.usar_sesion:
+            return None
+        clave = (self._identidad(), ruta)
+        id_sesion = _sesiones_libro.obtener(clave, INACTIVIDAD_SESION)
+        if id_sesion is None:
+            try:
+                id_sesion = self._json("POST", f"{ruta}/workbook/createSession", json={"persistChanges": True})["id"]
+            except (requests.HTTPError, KeyError) as e:
+                logger.warning(f"No se pudo abrir sesión de libro para {ruta}, se continúa sin sesión: {e}")
+                return None
+        # Cada uso renueva la marca de tiempo (la inactividad es lo que cierra la sesión)
+        _sesiones_libro.guardar(clave, id_sesion)
+        return id_sesion
+
+    def cerrar_sesion_libro(self, share_url_or_item: str):
+        """Cierra la sesión de libro abierta para el archivo, si la hay."""
+        ruta = self._ruta_item(share_url_or_item)
+        clave = (self._identidad(), ruta)
+        id_sesion = _sesiones_libro.obtener(clave, INACTIVIDAD_SESION)
+        _sesiones_libro.invalidar(clave)
+        if id_sesion is not None:
+            self._solicitud("POST", f"{ruta}/workbook/closeSession", headers={"workbook-session-id": id_sesion})
+
+    def _json_libro(self, metodo: str, ruta: str, subruta: str, **kwargs) -> dict:
+        """Petición a {ruta}/workbook/{subruta} dentro de la sesión de libro; si caducó, se reabre una vez."""
+        for intento in range(2):
+            id_sesion = self._sesion(ruta)
+            headers = {"workbook-session-id": id_sesion} if id_sesion else {}
+            try:
+                return self._json(metodo, f"{ruta}/workbook/{subruta}", headers=headers, **kwargs)
+            except requests.HTTPError as e:
+                respuesta = e.response
+                cuerpo = {}
+                if respuesta is not None:
+                    try:
+                        cuerpo = respuesta.json()
+                    except ValueError:
+                        pass
+                if intento == 0 and id_sesion and _es_error_de_sesion({"body": cuerpo}):
+                    logger.info("Sesión de libro caducada, se abre una nueva.")
+                    _sesiones_libro.invalidar((self._identidad(), ruta))
+                    continue
+                raise
+
+    def _batch_libro(self, ruta: str, subpeticiones: list, lanzar: bool = True) -> dict:
+        """batch() con la sesión de libro en cada sub-petición; si la sesión caducó, se reabre una vez."""
+        for intento in range(2):
+            id_sesion = self._sesion(ruta)
+            enviar = []
+            for sub in subpeticiones:
+                sub = dict(sub)
+                if id_sesion:
+                    sub["headers"] = {**sub.get("headers", {}), "workbook-session-id": id_sesion}
+                enviar.append(sub)
+            respuestas = self.batch(enviar, lanzar=False)
+            sin_exitos = not any(_exito(r) for r in respuestas.values())
+            if intento == 0 and id_sesion and sin_exitos and any(_es_error_de_sesion(r) for r in respuestas.values()):
+                logger.info("Sesión de libro caducada, se abre una nueva.")
+                _sesiones_libro.invalidar((self._identidad(), ruta))
+                continue
+            break
+        if lanzar:
+            self._lanzar_fallidas(subpeticiones, respuestas)
+        return respuestas
+
+    def get_workbook_worksheets(self, share_url_or_item: str) -> list:
+        """Worksheets del libro, a partir de una share URL o de un item_id."""
+        ruta = self._ruta_item(share_url_or_item)
+        clave = (self._identidad(), ruta, "worksheets")
+        hojas = _metadatos.obtener(clave, self.ttl_metadatos)
+        if hojas is None:
+            hojas = self._json_libro("GET", ruta, "worksheets").get("value", [])
+            _metadatos.guardar(clave, hojas)
+        return hojas
+
+    def get_worksheet_tables(self, share_url_or_item: str, sheet_name: str) -> list:
+        ruta = self._ruta_item(share_url_or_item)
+        clave = (self._identidad(), ruta, "tables", sheet_name)
+        tablas = _metadatos.obtener(clave, self.ttl_metadatos)
+        if tablas is None:
+            hoja = requests.utils.quote(sheet_name, safe="")
+            tablas = self._json_libro("GET", ruta, f"worksheets/{hoja}/tables").get("value", [])
+            _metadatos.guardar(clave, tablas)
+        return tablas
+
+    def create_table_on_sheet(self, share_url_or_item: str, sheet_name: str, header_range: str, has_headers: bool = True) -> dict:
+        ruta = self._ruta_item(share_url_or_item)
+        address = header_range if "!" in header_range else f"{sheet_name}!{header_range}"
+        tabla = self._json_libro("POST", ruta, "tables/add", json={"address": address, "hasHeaders": has_headers})
+        # La tabla nueva es del libro: se olvidan las listas de tablas de cualquier identidad
+        _metadatos.invalidar((ruta, "tables"), desde=1)
+        return tabla
+
+    def get_table_headers(self, share_url_or_item: str, table_id: str) -> list:
+        ruta = self._ruta_item(share_url_or_item)
+        clave = (self._identidad(), ruta, "headers", table_id)
+        encabezados = _metadatos.obtener(clave, self.ttl_metadatos)
+        if encabezados is None:
+            datos = self._json_libro("GET", ruta, f"tables/{table_id}/headerRowRange")
+            encabezados = (datos.get("values") or [[]])[0]
+            _metadatos.guardar(clave, encabezados)
+        return encabezados
+
+    @medido("graph_subida")
+    def upload_rows(self, share_url_or_item: str, ruta_tabla: str, values: list, max_filas: int = MAX_FILAS_FRAGMENTO,
+                    max_bytes: int = MAX_BYTES_FRAGMENTO, omitir=(), progreso=None) -> int:
+        """
+        Sube `values` a la tabla en `ruta_tabla` (relativa al item) por fragmentos acotados en
+        filas y bytes. Los fragmentos se agrupan en llamadas $batch (encadenados con dependsOn
+        dentro de cada una) y las llamadas se envían una tras otra, en el orden de `values`:
+        lo confirmado en Graph es siempre un prefijo, que es lo que supone `omitir` al
+        reanudar, y el libro no recibe escrituras concurrentes en la misma sesión.
+
+        - omitir: índices de fragmento ya subidos (SubidaInterrumpida.completados) para reanudar.
+        - progreso(filas_subidas, total_filas): se llama al completarse cada llamada.
+        Devuelve el número de filas subidas; si algo falla lanza SubidaInterrumpida.
+        """
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # La codificación de las filas avanza mientras se resuelve el item
+            codificando = pool.submit(filas_json, values)
+            ruta = self._ruta_item(share_url_or_item)
+            filas_codificadas = codificando.result()
+        return self._subir_filas(ruta, ruta_tabla, filas_codificadas, max_filas, max_bytes, omitir, progreso)
+
+    def _subir_filas(self, ruta: str, ruta_tabla: str, filas_codificadas: list, max_filas: int = MAX_FILAS_FRAGMENTO,
+                     max_bytes: int = MAX_BYTES_FRAGMENTO, omitir=(), progreso=None) -> int:
+        """upload_rows con el item ya resuelto y las filas ya codificadas con filas_json."""
+        ruta_tabla = f"{ruta}/workbook/{ruta_tabla.lstrip('/')}"
+        fragmentos = _fragmentar_filas(filas_codificadas, max_filas, max_bytes)
+        completados = set(omitir)
+        grupos = _agrupar_fragmentos(fragmentos, [i for i in range(len(fragmentos)) if i not in completados])
+        filas = lambda indices: sum(fragmentos[i][1] - fragmentos[i][0] for i in indices)
+        total = len(filas_codificadas)
+        subidas = filas(completados)
+        if progreso is not None and subidas:
+            progreso(subidas, total)
+
+        preparar = lambda grupo: self._subpeticiones_filas(ruta_tabla, filas_codificadas, fragmentos, grupo)
+        error = None
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # Solo se adelanta el armado del cuerpo de la siguiente llamada; los envíos son secuenciales
+            siguiente = pool.submit(preparar, grupos[0]) if grupos else None
+            for n, grupo in enumerate(grupos):
+                subpeticiones = siguiente.result()
+                siguiente = pool.submit(preparar, grupos[n + 1]) if n + 1 < len(grupos) else None
+                try:
+                    respuestas = self._batch_libro(ruta, subpeticiones, lanzar=False)
+                except Exception as e:
+                    error = str(e)
+                    break
+                ok = [i for i in grupo if _exito(respuestas.get(f"filas{i}"))]
+                completados.update(ok)
+                subidas += filas(ok)
+                fallidas = [i for i in grupo if i not in ok]
+                if fallidas:
+                    r = respuestas.get(f"filas{fallidas[0]}", {})
+                    error = f"fragmento {fallidas[0]}: HTTP {r.get('status')} {_mensaje_error(r)}"
+                    break
+                if progreso is not None:
+                    progreso(subidas, total)
+
+        if error is not None:
+            raise SubidaInterrumpida(f"Subida interrumpida tras {subidas} de {total} filas: {error}",
+                                     sorted(completados), subidas, total)
+        logger.info(f"Subidas {subidas} filas en {len(fragmentos)} fragmentos ({len(grupos)} llamadas $batch)")
+        return subidas
+
+    def add_rows_to_table(self, share_url_or_item: str, table_id: str, values: list, batch_size: int = MAX_FILAS_FRAGMENTO,
+                          **opciones) -> int:
+        """Añade filas a la tabla; ver upload_rows para `opciones` (progreso, reanudación)."""
+        return self.upload_rows(share_url_or_item, f"tables/{table_id}", values, max_filas=batch_size, **opciones)
+
+    def append_rows_to_sheet(self, share_url_or_item: str, sheet_name: str, values: list,
+                             header_range: str = None, batch_size: int = MAX_FILAS_FRAGMENTO, **opciones) -> dict:
+        """
+        Añade filas a la primera tabla de la hoja; si la hoja no tiene tablas, la crea
+        con `header_range` en la misma llamada $batch que el primer grupo de filas.
+        Devuelve la tabla usada. `opciones` se pasan a upload_rows.
+        """
+        ruta = self._ruta_item(share_url_or_item)
+        hoja = requests.utils.quote(sheet_name, safe="")
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # La codificación de las filas avanza mientras se consultan las tablas de la hoja
+            codificando = pool.submit(filas_json, values)
+            tablas = self.get_worksheet_tables(share_url_or_item, sheet_name)
+            filas_codificadas = codificando.result()
+        if tablas:
+            self._subir_filas(ruta, f"tables/{tablas[0]['id']}", filas_codificadas, batch_size, **opciones)
+            return tablas[0]
+
+        if not header_range:
+            raise ValueError(f"La hoja '{sheet_name}' no tiene tablas y no se indicó header_range para crearla.")
+        ruta_tabla = f"worksheets/{hoja}/tables/itemAt(index=0)"
+        fragmentos = _fragmentar_filas(filas_codificadas, batch_size, opciones.get("max_bytes", MAX_BYTES_FRAGMENTO))
+        primer_grupo = _agrupar_fragmentos(fragmentos, range(len(fragmentos)))[:1]
+        primer_grupo = primer_grupo[0] if primer_grupo else []
+        subpeticiones = [self._subpeticion("crear", "POST", f"{ruta}/workbook/worksheets/{hoja}/tables/add",
+                                           {"address": header_range, "hasHeaders": True})]
+        subpeticiones += self._subpeticiones_filas(f"{ruta}/workbook/{ruta_tabla}", filas_codificadas, fragmentos, primer_grupo, depende="crear")
         try:
-            url = f"{GRAPH_BASE}/me/drive/items/{share_url_or_item}/workbook/worksheets"
-            r = requests.get(url, headers=self._headers())
-            r.raise_for_status()
-            return r.json().get("value", [])
-        except requests.HTTPError as he:
-            raise he
-        except Exception as e:
-            raise RuntimeError(f"Error consultando por item_id: {e}")
-
-    # Si llega aquí, la entrada no es ni URL ni item_id válido -> lanzar error claro
-    raise ValueError("El valor proporcionado no parece una URL de compartir (https://...) ni un item_id válido. Pega la URL de compartir de OneDrive/SharePoint o el item_id correcto.")
-# --- fin del fragmento ---
+            respuestas = self._batch_libro(ruta, subpeticiones, lanzar=False)
+        finally:
+            _metadatos.invalidar((ruta, "tables"), desde=1)
+        self._lanzar_fallidas(subpeticiones[:1], respuestas)
+        tabla = respuestas["crear"].get("body") or {}
+        if tabla.get("id"):
+            ruta_tabla = f"tables/{tabla['id']}"
+        # Las filas que no entraron en la primera llamada (o fallaron en ella) se suben como en una reanudación
+        subidos = [i for i in primer_grupo if _exito(respuestas.get(f"filas{i}"))]
+        opciones["omitir"] = sorted(set(opciones.get("omitir", ())) | set(subidos))
+        self._subir_filas(ruta, ruta_tabla, filas_codificadas, batch_size, **opciones)
+        return tabla
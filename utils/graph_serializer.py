@@ -0,0 +1,85 @@
+"""
+Serialización de DataFrames al payload `values` de Microsoft Graph.
+
+- dataframe_a_valores: resuelve una sola vez qué columna del df corresponde a cada
+  encabezado de la tabla y construye la matriz de textos de forma vectorizada.
+- filas_json / cuerpo_filas: cada fila se codifica a JSON una única vez y los cuerpos
+  de rows/add se arman concatenando esos fragmentos.
+- serializar_batch: cuerpo de $batch en el que los cuerpos ya codificados (JsonCrudo)
+  se insertan tal cual, sin volver a pasar por json.dumps.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+
+class JsonCrudo(str):
+    """Texto JSON ya serializado; serializar_batch lo inserta sin recodificarlo."""
+
+
+def _clave(nombre) -> str:
+    return str(nombre).strip().lower()
+
+
+def mapear_encabezados(columnas, encabezados) -> list:
+    """
+    Para cada encabezado, la posición de la columna del df con el mismo nombre (sin
+    distinguir mayúsculas ni espacios en los extremos; gana la primera) o None.
+    """
+    posiciones = {}
+    for i, columna in enumerate(columnas):
+        posiciones.setdefault(_clave(columna), i)
+    return [posiciones.get(_clave(h)) for h in encabezados]
+
+
+def dataframe_a_valores(df: pd.DataFrame, encabezados=None) -> list:
+    """
+    Matriz [[str]] para Graph. Sin `encabezados` se usan las columnas del df en orden;
+    con ellos, cada columna de salida es la del df que coincide con el encabezado (o
+    vacía si no hay). Los valores nulos se envían como "".
+    """
+    if encabezados is None:
+        posiciones = list(range(df.shape[1]))
+    else:
+        posiciones = mapear_encabezados(df.columns, encabezados)
+    presentes = [p for p in posiciones if p is not None]
+    n_filas = len(df)
+
+    if presentes:
+        datos = df.iloc[:, presentes]
+        texto = datos.astype(object).where(datos.notna(), "").astype(str).to_numpy(dtype=object)
+    else:
+        texto = np.empty((n_filas, 0), dtype=object)
+
+    if len(presentes) == len(posiciones):
+        return texto.tolist()
+    salida = np.full((n_filas, len(posiciones)), "", dtype=object)
+    destino = [j for j, p in enumerate(posiciones) if p is not None]
+    if destino:
+        salida[:, destino] = texto
+    return salida.tolist()
+
+
+def filas_json(valores: list) -> list:
+    """Cada fila codificada a JSON (una sola vez) para armar los cuerpos por fragmentos."""
+    codificar = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    return [codificar(fila) for fila in valores]
+
+
+def cuerpo_filas(filas: list) -> JsonCrudo:
+    """Cuerpo de rows/add a partir de filas ya codificadas con filas_json."""
+    return JsonCrudo('{"index":null,"values":[' + ",".join(filas) + "]}")
+
+
+def serializar_batch(subpeticiones: list) -> bytes:
+    """Cuerpo JSON de una llamada $batch; los `body` JsonCrudo se insertan tal cual."""
+    partes = []
+    for sub in subpeticiones:
+        body = sub.get("body")
+        if isinstance(body, JsonCrudo):
+            resto = json.dumps({k: v for k, v in sub.items() if k != "body"}, ensure_ascii=False)
+            partes.append(resto[:-1] + ',"body":' + body + "}")
+        else:
+            partes.append(json.dumps(sub, ensure_ascii=False))
+    return ('{"requests":[' + ",".join(partes) + "]}").encode("utf-8")
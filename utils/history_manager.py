@@ -1,135 +1,380 @@
+import csv
+import io
 import json
 import os
+import tempfile
 from datetime import datetime
+from itertools import islice
 import pandas as pd
 import streamlit as st
 import logging
 
+from .file_lock import bloqueo_exclusivo
+
 logger = logging.getLogger(__name__)
 
+ARCHIVO_HISTORIAL = "historial_depuraciones.jsonl"
+ARCHIVO_HISTORIAL_LEGADO = "historial_depuraciones.json"
+ARCHIVO_RESUMEN = "resumen_historial.json"
+
+_CAMPOS_SUMA = ('filas_originales', 'filas_depuradas', 'filas_agregadas', 'rezagados_movidos')
+_AGRUPACIONES = {'por_dia': 'timestamp', 'por_program_type': 'program_type', 'por_periodo': 'periodo'}
+_TAMANO_PAGINA = 50
+# Cada cuántos registros se guarda su posición en bytes en el resumen (para paginar sin leer el resto)
+_PASO_DESPLAZAMIENTOS = _TAMANO_PAGINA
+
+def _bloqueo(history_dir: str):
+    """Bloqueo exclusivo entre procesos sobre history_dir/.historial.lock."""
+    return bloqueo_exclusivo(os.path.join(history_dir, ".historial.lock"))
+
+def _migrar_historial_legado(history_dir: str):
+    """
+    Convierte una sola vez el historial antiguo (arreglo JSON) a JSONL. El archivo
+    original se conserva renombrado como .json.migrado. Debe llamarse con el bloqueo tomado.
+    """
+    legado = os.path.join(history_dir, ARCHIVO_HISTORIAL_LEGADO)
+    if not os.path.exists(legado):
+        return
+    try:
+        with open(legado, 'r', encoding='utf-8') as f:
+            registros = json.load(f)
+    except json.JSONDecodeError:
+        logger.warning("Archivo de historial antiguo corrupto, no se migra")
+        registros = []
+    if not isinstance(registros, list):
+        registros = [registros]
+    with open(os.path.join(history_dir, ARCHIVO_HISTORIAL), 'a', encoding='utf-8') as f:
+        for registro in registros:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    os.replace(legado, legado + ".migrado")
+    logger.info(f"Historial migrado a JSONL: {len(registros)} registros")
+
+def _acumulado_vacio() -> dict:
+    acumulado = {'depuraciones': 0, 'suma_eficiencia': 0.0, 'con_eficiencia': 0}
+    acumulado.update({c: 0 for c in _CAMPOS_SUMA})
+    return acumulado
+
+def _resumen_vacio() -> dict:
+    resumen = {'tamano_historial': 0, 'total': _acumulado_vacio(), 'desplazamientos': []}
+    resumen.update({agrupacion: {} for agrupacion in _AGRUPACIONES})
+    return resumen
+
+def _clave_agrupacion(registro: dict, campo: str) -> str:
+    valor = registro.get(campo)
+    if valor is None or valor == '':
+        return 'Sin dato'
+    return str(valor)[:10] if campo == 'timestamp' else str(valor)
+
+def _acumular(acumulado: dict, registro: dict):
+    acumulado['depuraciones'] += 1
+    for campo in _CAMPOS_SUMA:
+        acumulado[campo] += registro.get(campo) or 0
+    originales = registro.get('filas_originales') or 0
+    if originales:
+        acumulado['suma_eficiencia'] += (registro.get('filas_depuradas') or 0) / originales * 100
+        acumulado['con_eficiencia'] += 1
+
+def _agregar_a_resumen(resumen: dict, registro: dict, desplazamiento: int):
+    """Suma el registro a los totales; `desplazamiento` es el byte del JSONL en que empieza su línea."""
+    if resumen['total']['depuraciones'] % _PASO_DESPLAZAMIENTOS == 0:
+        resumen['desplazamientos'].append(desplazamiento)
+    _acumular(resumen['total'], registro)
+    for agrupacion, campo in _AGRUPACIONES.items():
+        grupo = resumen[agrupacion].setdefault(_clave_agrupacion(registro, campo), _acumulado_vacio())
+        _acumular(grupo, registro)
+
+def _tamano_historial(history_dir: str) -> int:
+    history_file = os.path.join(history_dir, ARCHIVO_HISTORIAL)
+    return os.path.getsize(history_file) if os.path.exists(history_file) else 0
+
+def _resumen_al_dia(resumen, history_dir: str) -> bool:
+    return resumen is not None and 'desplazamientos' in resumen \
+        and resumen.get('tamano_historial') == _tamano_historial(history_dir)
+
+def _leer_resumen(history_dir: str):
+    ruta = os.path.join(history_dir, ARCHIVO_RESUMEN)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        logger.warning("Resumen de historial ilegible, se reconstruye")
+        return None
+
+def _escribir_resumen(history_dir: str, resumen: dict):
+    fd, tmp = tempfile.mkstemp(suffix=".json", dir=history_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(resumen, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(history_dir, ARCHIVO_RESUMEN))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _resumen_vigente(history_dir: str) -> dict:
+    """
+    Resumen correspondiente al JSONL actual; si falta, es de una versión anterior o no
+    coincide en tamaño (historial migrado o editado fuera de la app) se reconstruye
+    recorriendo el historial una vez. Debe llamarse con el bloqueo tomado.
+    """
+    resumen = _leer_resumen(history_dir)
+    if _resumen_al_dia(resumen, history_dir):
+        return resumen
+    resumen = _resumen_vacio()
+    history_file = os.path.join(history_dir, ARCHIVO_HISTORIAL)
+    if os.path.exists(history_file):
+        for desplazamiento, registro in _leer_registros(history_file):
+            _agregar_a_resumen(resumen, registro, desplazamiento)
+    resumen['tamano_historial'] = _tamano_historial(history_dir)
+    logger.info(f"Resumen de historial reconstruido: {resumen['total']['depuraciones']} registros")
+    return resumen
+
+def cargar_resumen_historial(history_dir: str) -> dict:
+    """
+    Totales del historial precalculados: 'total' y, por día, program_type y período,
+    {'depuraciones', 'filas_originales', 'filas_depuradas', 'filas_agregadas',
+    'rezagados_movidos', 'suma_eficiencia', 'con_eficiencia'}, más 'desplazamientos'
+    (posición en bytes de uno de cada _PASO_DESPLAZAMIENTOS registros del JSONL).
+    """
+    try:
+        resumen = _leer_resumen(history_dir)
+        if _resumen_al_dia(resumen, history_dir) and not os.path.exists(os.path.join(history_dir, ARCHIVO_HISTORIAL_LEGADO)):
+            return resumen
+        os.makedirs(history_dir, exist_ok=True)
+        with _bloqueo(history_dir):
+            _migrar_historial_legado(history_dir)
+            resumen = _resumen_vigente(history_dir)
+            _escribir_resumen(history_dir, resumen)
+        return resumen
+    except Exception as e:
+        logger.exception(f"Error cargando resumen de historial: {e}")
+        return _resumen_vacio()
+
 def guardar_historial(info_depuracion: dict, history_dir: str):
+    """
+    Añade una línea al historial JSONL (bajo bloqueo, sin reescribir el archivo) y
+    actualiza los totales precalculados de resumen_historial.json.
+    """
     try:
-        history_file = os.path.join(history_dir, "historial_depuraciones.json")
-        
-        historial = []
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    historial = json.load(f)
-            except json.JSONDecodeError:
-                logger.warning("Archivo de historial corrupto, creando uno nuevo")
-                historial = []
-        
-        historial.append(info_depuracion)
-        
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(historial, f, indent=2, ensure_ascii=False)
-        
+        os.makedirs(history_dir, exist_ok=True)
+        history_file = os.path.join(history_dir, ARCHIVO_HISTORIAL)
+        linea = json.dumps(info_depuracion, ensure_ascii=False) + "\n"
+
+        with _bloqueo(history_dir):
+            _migrar_historial_legado(history_dir)
+            resumen = _resumen_vigente(history_dir)
+            desplazamiento = _tamano_historial(history_dir)
+            with open(history_file, 'a', encoding='utf-8') as f:
+                f.write(linea)
+                f.flush()
+                os.fsync(f.fileno())
+            _agregar_a_resumen(resumen, info_depuracion, desplazamiento)
+            resumen['tamano_historial'] = _tamano_historial(history_dir)
+            _escribir_resumen(history_dir, resumen)
+
         logger.info(f"Historial guardado exitosamente en {history_file}")
-        
+
     except Exception as e:
         logger.exception(f"Error guardando historial: {e}")
         raise
 
-def cargar_historial(history_dir: str) -> list:
+def _leer_registros(history_file: str, desde: int = 0):
+    """Genera (desplazamiento, registro) de cada línea válida del JSONL a partir del byte `desde`."""
+    with open(history_file, 'rb') as f:
+        f.seek(desde)
+        posicion = desde
+        for linea in f:
+            inicio, posicion = posicion, posicion + len(linea)
+            if not linea.strip():
+                continue
+            try:
+                yield inicio, json.loads(linea)
+            except ValueError:
+                logger.warning(f"Línea del historial en el byte {inicio} corrupta, se omite")
+
+def iterar_historial(history_dir: str):
+    """Genera los registros del historial uno a uno, sin cargar el archivo completo."""
+    if os.path.exists(os.path.join(history_dir, ARCHIVO_HISTORIAL_LEGADO)):
+        with _bloqueo(history_dir):
+            _migrar_historial_legado(history_dir)
+
+    history_file = os.path.join(history_dir, ARCHIVO_HISTORIAL)
+    if not os.path.exists(history_file):
+        return
+
+    for _, registro in _leer_registros(history_file):
+        yield registro
+
+def cargar_historial(history_dir: str, lazy: bool = False):
+    """
+    Registros del historial. Con lazy=True devuelve un generador (ver iterar_historial);
+    si no, una lista.
+    """
+    if lazy:
+        return iterar_historial(history_dir)
     try:
-        history_file = os.path.join(history_dir, "historial_depuraciones.json")
-        
-        if not os.path.exists(history_file):
-            return []
-        
-        with open(history_file, 'r', encoding='utf-8') as f:
-            historial = json.load(f)
-        
-        return historial
-        
+        return list(iterar_historial(history_dir))
     except Exception as e:
         logger.exception(f"Error cargando historial: {e}")
         return []
 
-def mostrar_estadisticas(historial: list):
-    if not historial:
+def leer_pagina_historial(history_dir: str, pagina: int, tamano: int = _TAMANO_PAGINA, resumen: dict = None) -> list:
+    """
+    Registros de una página del historial, del más reciente al más antiguo (página 0 =
+    los `tamano` más recientes). Se salta con seek() a la posición guardada en el resumen
+    más cercana, así que solo se leen como mucho _PASO_DESPLAZAMIENTOS registros de más.
+    """
+    if resumen is None:
+        resumen = cargar_resumen_historial(history_dir)
+    fin = max(resumen['total']['depuraciones'] - pagina * tamano, 0)
+    inicio = max(fin - tamano, 0)
+    history_file = os.path.join(history_dir, ARCHIVO_HISTORIAL)
+    if fin == inicio or not os.path.exists(history_file):
+        return []
+    desplazamientos = resumen.get('desplazamientos') or [0]
+    marca = min(inicio // _PASO_DESPLAZAMIENTOS, len(desplazamientos) - 1)
+    base = marca * _PASO_DESPLAZAMIENTOS
+    registros = [r for _, r in islice(_leer_registros(history_file, desplazamientos[marca]), inicio - base, fin - base)]
+    registros.reverse()
+    return registros
+
+def _tabla_detalle(registros: list) -> pd.DataFrame:
+    df = pd.DataFrame(registros)
+    for campo in ('timestamp', 'archivo', 'filtro_horas', 'filtro_dias', 'periodo') + _CAMPOS_SUMA:
+        if campo not in df.columns:
+            df[campo] = None
+    horas = pd.to_numeric(df['filtro_horas'], errors='coerce')
+    dias = pd.to_numeric(df['filtro_dias'], errors='coerce')
+    filtro = dias.astype('Int64').astype(str) + 'd'
+    con_horas = horas.fillna(0) != 0
+    filtro[con_horas] = horas[con_horas].astype('Int64').astype(str) + 'h'
+    return pd.DataFrame({
+        'Fecha/Hora': pd.to_datetime(df['timestamp']).dt.strftime('%d/%m/%Y %H:%M:%S'),
+        'Archivo': df['archivo'],
+        'Originales': df['filas_originales'],
+        'Depuradas': df['filas_depuradas'],
+        'Agregadas': df['filas_agregadas'],
+        'Rezagados': df['rezagados_movidos'],
+        'Filtro': filtro,
+        'Período': df['periodo'],
+    })
+
+def _historial_csv(history_dir: str) -> bytes:
+    """CSV del historial completo, generado por bloques (solo al pulsar Descargar)."""
+    salida = io.StringIO()
+    registros = iterar_historial(history_dir)
+    encabezado = True
+    while True:
+        bloque = list(islice(registros, 1000))
+        if not bloque:
+            break
+        _tabla_detalle(bloque).to_csv(salida, index=False, header=encabezado)
+        encabezado = False
+    return salida.getvalue().encode('utf-8')
+
+def _rendimiento_json(history_dir: str) -> bytes:
+    """Tiempos por etapa de cada depuración que los tiene, en JSON (para seguir regresiones)."""
+    campos = ('timestamp', 'archivo', 'program_type', 'periodo', 'filas_originales', 'filas_depuradas')
+    ejecuciones = [{**{c: r.get(c) for c in campos}, 'rendimiento': r['rendimiento']}
+                   for r in iterar_historial(history_dir) if r.get('rendimiento')]
+    return json.dumps(ejecuciones, ensure_ascii=False, indent=2).encode('utf-8')
+
+def _tabla_agrupada(grupos: dict, etiqueta: str) -> pd.DataFrame:
+    df = pd.DataFrame.from_dict(grupos, orient='index')
+    df.index.name = etiqueta
+    df['eficiencia'] = (df['filas_depuradas'] / df['filas_originales'].where(df['filas_originales'] != 0) * 100).round(2)
+    return df.sort_index()
+
+def mostrar_estadisticas(history_dir: str, resumen: dict = None):
+    """Pestaña de historial: métricas y gráficas desde los totales precalculados y tabla paginada."""
+    if resumen is None:
+        resumen = cargar_resumen_historial(history_dir)
+    total = resumen['total']
+    if not total['depuraciones']:
         st.info("📭 No hay datos en el historial")
         return
-    
-    df_hist = pd.DataFrame(historial)
-    df_hist['timestamp'] = pd.to_datetime(df_hist['timestamp'])
-    df_hist = df_hist.sort_values('timestamp', ascending=False)
-    
+
     st.subheader("📊 Resumen General")
     col1, col2, col3, col4 = st.columns(4)
-    
+
     with col1:
-        st.metric("Total depuraciones", len(df_hist))
+        st.metric("Total depuraciones", total['depuraciones'])
     with col2:
-        st.metric("Total registros procesados", df_hist['filas_originales'].sum())
+        st.metric("Total registros procesados", total['filas_originales'])
     with col3:
-        st.metric("Total registros depurados", df_hist['filas_depuradas'].sum())
+        st.metric("Total registros depurados", total['filas_depuradas'])
     with col4:
-        st.metric("Total rezagados", df_hist['rezagados_movidos'].sum())
-    
+        st.metric("Total rezagados", total['rezagados_movidos'])
+
     st.subheader("📋 Historial Detallado")
-    
-    df_display = df_hist.copy()
-    df_display['Fecha/Hora'] = df_display['timestamp'].dt.strftime('%d/%m/%Y %H:%M:%S')
-    df_display['Archivo'] = df_display['archivo']
-    df_display['Originales'] = df_display['filas_originales']
-    df_display['Depuradas'] = df_display['filas_depuradas']
-    df_display['Agregadas'] = df_display['filas_agregadas']
-    df_display['Rezagados'] = df_display['rezagados_movidos']
-    df_display['Filtro'] = df_display.apply(
-        lambda x: f"{x['filtro_horas']}h" if x['filtro_horas'] else f"{x['filtro_dias']}d", 
-        axis=1
+
+    paginas = max((total['depuraciones'] - 1) // _TAMANO_PAGINA + 1, 1)
+    pagina = st.number_input(
+        f"Página (de {paginas}, {_TAMANO_PAGINA} registros por página, más recientes primero)",
+        min_value=1, max_value=paginas, value=1, step=1,
     )
-    df_display['Período'] = df_display['periodo']
-    
-    columns_to_show = ['Fecha/Hora', 'Archivo', 'Originales', 'Depuradas', 'Agregadas', 'Rezagados', 'Filtro', 'Período']
+    registros = leer_pagina_historial(history_dir, int(pagina) - 1, resumen=resumen)
     st.dataframe(
-        df_display[columns_to_show],
+        _tabla_detalle(registros),
         use_container_width=True,
         hide_index=True
     )
-    
+
     st.subheader("📈 Visualizaciones")
-    
-    tab1, tab2, tab3 = st.tabs(["Registros por día", "Eficiencia de depuración", "Rezagados"])
-    
+
+    tab1, tab2, tab3, tab4 = st.tabs(["Registros por día", "Eficiencia de depuración", "Rezagados", "Por programa y período"])
+    df_por_dia = _tabla_agrupada(resumen['por_dia'], 'Fecha')
+
     with tab1:
-        df_por_dia = df_hist.copy()
-        df_por_dia['Fecha'] = df_por_dia['timestamp'].dt.date
-        df_agrupado = df_por_dia.groupby('Fecha').agg({
-            'filas_originales': 'sum',
-            'filas_depuradas': 'sum',
-            'filas_agregadas': 'sum'
-        }).reset_index()
-        
         st.write("Registros procesados por día")
-        st.line_chart(df_agrupado.set_index('Fecha')[['filas_originales', 'filas_depuradas', 'filas_agregadas']])
-    
+        st.line_chart(df_por_dia[['filas_originales', 'filas_depuradas', 'filas_agregadas']])
+
     with tab2:
-        df_hist['eficiencia'] = (df_hist['filas_depuradas'] / df_hist['filas_originales'] * 100).round(2)
-        
-        st.write("Porcentaje de registros que pasaron el filtro de depuración")
-        st.bar_chart(df_hist.set_index('timestamp')['eficiencia'])
-        
-        st.metric(
-            "Eficiencia promedio", 
-            f"{df_hist['eficiencia'].mean():.2f}%",
-            help="Porcentaje promedio de registros que pasan el filtro de depuración"
-        )
-    
+        st.write("Porcentaje de registros que pasaron el filtro de depuración, por día")
+        st.bar_chart(df_por_dia['eficiencia'])
+
+        col1, col2 = st.columns(2)
+        with col1:
+            promedio = total['suma_eficiencia'] / total['con_eficiencia'] if total['con_eficiencia'] else 0.0
+            st.metric(
+                "Eficiencia promedio",
+                f"{promedio:.2f}%",
+                help="Porcentaje promedio de registros que pasan el filtro de depuración"
+            )
+        with col2:
+            acumulada = total['filas_depuradas'] / total['filas_originales'] * 100 if total['filas_originales'] else 0.0
+            st.metric(
+                "Eficiencia acumulada",
+                f"{acumulada:.2f}%",
+                help="Registros depurados sobre registros procesados en todo el historial"
+            )
+
     with tab3:
-        st.write("Rezagados identificados por depuración")
-        st.bar_chart(df_hist.set_index('timestamp')['rezagados_movidos'])
-        
-        st.metric("Total rezagados histórico", df_hist['rezagados_movidos'].sum())
-    
+        st.write("Rezagados identificados por día")
+        st.bar_chart(df_por_dia['rezagados_movidos'])
+
+        st.metric("Total rezagados histórico", total['rezagados_movidos'])
+
+    with tab4:
+        columnas = ['depuraciones', 'filas_originales', 'filas_depuradas', 'filas_agregadas', 'rezagados_movidos', 'eficiencia']
+        st.write("Por tipo de programa")
+        st.dataframe(_tabla_agrupada(resumen['por_program_type'], 'Tipo de programa')[columnas], use_container_width=True)
+        st.write("Por período")
+        st.dataframe(_tabla_agrupada(resumen['por_periodo'], 'Período')[columnas], use_container_width=True)
+
     st.subheader("💾 Exportar Historial")
-    
-    csv = df_display[columns_to_show].to_csv(index=False).encode('utf-8')
+
     st.download_button(
         label="📥 Descargar historial como CSV",
-        data=csv,
+        data=lambda: _historial_csv(history_dir),
         file_name=f"historial_depuraciones_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
         mime="text/csv",
     )
+    st.download_button(
+        label="📥 Descargar rendimiento por etapa (JSON)",
+        data=lambda: _rendimiento_json(history_dir),
+        file_name=f"rendimiento_depuraciones_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        mime="application/json",
+    )
@@ -0,0 +1,174 @@
+"""
+Medición por etapas del pipeline (tiempo y memoria).
+
+    with medir_ejecucion() as medicion:        # activa la medición en este hilo/contexto
+        with etapa("leer_csv"):
+            ...
+    medicion.resumen()  # {"leer_csv": {"segundos", "llamadas", "memoria_pico_kb", "rss_pico_kb"}, ...}
+
+Fuera de medir_ejecucion, `etapa` y `@medido` no hacen nada (coste despreciable), así
+que las funciones del pipeline quedan instrumentadas siempre. Las etapas que se repiten
+(ej. una por bloque del CSV) se acumulan bajo el mismo nombre. El RSS es el aumento del
+pico del proceso (ru_maxrss), que solo crece, y se mide siempre. La memoria de
+tracemalloc (pico durante la etapa por encima de lo que había al empezarla) es opcional:
+multiplica varias veces el tiempo de las etapas con muchos objetos Python (ej. escribir
+el maestro con openpyxl), así que solo se activa con memoria=True o con la variable de
+entorno DEPURADOR_TRACEMALLOC=1.
+
+La medición vive en un ContextVar: los hilos nuevos (ej. el que prepara los cuerpos de
+la subida a Graph) no la heredan y solo se mide la etapa que los engloba. tracemalloc es
+global al proceso: con varias mediciones simultáneas (otra sesión, un trabajo en segundo
+plano) los picos de memoria son aproximados.
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_FIN = object()
+_medicion_actual = contextvars.ContextVar("medicion_etapas", default=None)
+# Mediciones activas que usan tracemalloc: se detiene cuando termina la última
+_usuarios_tracemalloc = 0
+_tracemalloc_propio = False
+_lock_tracemalloc = threading.Lock()
+
+
+def _rss_pico_kb() -> int:
+    if resource is None:
+        return 0
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico // 1024 if sys.platform == "darwin" else pico  # macOS lo da en bytes
+
+
+class MedicionEtapas:
+    def __init__(self, memoria: bool = False):
+        self.memoria = memoria
+        self.etapas = {}
+        self._pila = []  # picos de tracemalloc de las etapas abiertas
+
+    def _datos(self, nombre: str) -> dict:
+        return self.etapas.setdefault(nombre, {"segundos": 0.0, "llamadas": 0, "memoria_pico_kb": 0, "rss_pico_kb": 0})
+
+    def _registrar(self, nombre: str, segundos: float, memoria_kb: int, rss_kb: int):
+        datos = self._datos(nombre)
+        datos["segundos"] += segundos
+        datos["llamadas"] += 1
+        datos["memoria_pico_kb"] = max(datos["memoria_pico_kb"], memoria_kb)
+        datos["rss_pico_kb"] += rss_kb
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        self._datos(nombre)
+        medir_memoria = self.memoria and tracemalloc.is_tracing()
+        if medir_memoria:
+            inicio_mem, pico_previo = tracemalloc.get_traced_memory()
+            # El pico de la etapa envolvente hasta ahora no se pierde al reiniciarlo
+            if self._pila:
+                self._pila[-1] = max(self._pila[-1], pico_previo)
+            tracemalloc.reset_peak()
+            self._pila.append(0)
+        rss_inicio = _rss_pico_kb()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - t0
+            memoria_kb = 0
+            if medir_memoria:
+                pico = max(self._pila.pop(), tracemalloc.get_traced_memory()[1])
+                memoria_kb = max(0, pico - inicio_mem) // 1024
+                if self._pila:
+                    self._pila[-1] = max(self._pila[-1], pico)
+            self._registrar(nombre, segundos, memoria_kb, _rss_pico_kb() - rss_inicio)
+
+    def agregar(self, etapas: dict):
+        """Acumula las etapas medidas en otro proceso o hilo (ej. workers de utils.pipeline)."""
+        for nombre, datos in (etapas or {}).items():
+            actual = self._datos(nombre)
+            actual["segundos"] += datos.get("segundos", 0.0)
+            actual["llamadas"] += datos.get("llamadas", 0)
+            actual["memoria_pico_kb"] = max(actual["memoria_pico_kb"], datos.get("memoria_pico_kb", 0))
+            actual["rss_pico_kb"] += datos.get("rss_pico_kb", 0)
+
+    def resumen(self) -> dict:
+        """Etapas en el orden en que empezaron, con los segundos redondeados a ms."""
+        return {nombre: {**datos, "segundos": round(datos["segundos"], 3)} for nombre, datos in self.etapas.items()}
+
+    def json(self) -> str:
+        return json.dumps(self.resumen(), ensure_ascii=False, indent=2)
+
+
+@contextmanager
+def medir_ejecucion(memoria: bool = None):
+    """
+    Activa la medición de etapas en el contexto actual. Con memoria=True (por defecto,
+    según DEPURADOR_TRACEMALLOC) también se mide la memoria con tracemalloc.
+    """
+    global _usuarios_tracemalloc, _tracemalloc_propio
+    if memoria is None:
+        memoria = os.environ.get("DEPURADOR_TRACEMALLOC", "").strip().lower() in ("1", "true", "si", "sí")
+    medicion = MedicionEtapas(memoria)
+    if memoria:
+        with _lock_tracemalloc:
+            if _usuarios_tracemalloc == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracemalloc_propio = True
+            _usuarios_tracemalloc += 1
+    token = _medicion_actual.set(medicion)
+    try:
+        yield medicion
+    finally:
+        _medicion_actual.reset(token)
+        if memoria:
+            with _lock_tracemalloc:
+                _usuarios_tracemalloc -= 1
+                if _usuarios_tracemalloc == 0 and _tracemalloc_propio:
+                    tracemalloc.stop()
+                    _tracemalloc_propio = False
+
+
+@contextmanager
+def etapa(nombre: str):
+    """Mide el bloque si hay una medición activa; si no, no hace nada."""
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        yield
+        return
+    with medicion.etapa(nombre):
+        yield
+
+
+def iterar_medido(iterable, nombre: str):
+    """Itera midiendo como la etapa `nombre` la obtención de cada elemento (ej. cada bloque leído del CSV)."""
+    iterador = iter(iterable)
+    while True:
+        with etapa(nombre):
+            elemento = next(iterador, _FIN)
+        if elemento is _FIN:
+            return
+        yield elemento
+
+
+def medido(nombre: str = None):
+    """Decorador: mide cada llamada a la función como la etapa `nombre` (por defecto, su nombre)."""
+    def decorador(func):
+        nombre_etapa = nombre or func.__name__
+
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            if _medicion_actual.get() is None:
+                return func(*args, **kwargs)
+            with etapa(nombre_etapa):
+                return func(*args, **kwargs)
+        return envoltura
+    return decorador
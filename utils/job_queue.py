@@ -0,0 +1,243 @@
+"""
+Cola local de trabajos en segundo plano (consolidación del maestro, envíos a Excel Online).
+
+Los trabajos corren en un pool de hilos compartido del proceso de Streamlit: el botón
+responde al instante y la sesión solo consulta el estado. Cada recurso (ruta del
+maestro, libro y hoja de Excel) tiene su propia cola FIFO que atiende un solo hilo a
+la vez, así dos operadores que consolidan a la vez quedan en cola en lugar de
+escribir el mismo .xlsx en paralelo; recursos distintos avanzan en paralelo. La cola
+de un recurso se descarta en cuanto se vacía. Con `bloquear_archivo` el trabajo toma además un bloqueo de
+archivo (<ruta>.lock), el mismo que usa utils.pipeline, para excluir a otros procesos.
+
+El estado se guarda en un SQLite (history/trabajos.sqlite, tabla trabajos) que
+cualquier sesión puede consultar. Cada trabajo guarda el proceso que lo ejecuta
+(`propietario`); mientras vive, el proceso mantiene bloqueado su archivo en
+<base>.procesos/. Al arrancar, solo los trabajos pendientes o en curso de procesos
+que ya no existen (su archivo está libre) se marcan como 'interrumpido'.
+"""
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .file_lock import bloquear, bloqueo_exclusivo, desbloquear
+
+logger = logging.getLogger(__name__)
+
+RUTA_DEFECTO = os.path.join("history", "trabajos.sqlite")
+# Hilos compartidos por todos los recursos (cada recurso usa como mucho uno a la vez)
+MAX_HILOS = 4
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+INTERRUMPIDO = "interrumpido"
+ESTADOS_FINALES = (COMPLETADO, ERROR, INTERRUMPIDO)
+
+_colas = {}
+_lock_colas = threading.Lock()
+
+
+class ErrorTrabajo(Exception):
+    """Error de un trabajo con datos para la UI (ej. el punto desde el que reanudar)."""
+
+    def __init__(self, mensaje: str, resultado=None):
+        super().__init__(mensaje)
+        self.resultado = resultado
+
+
+def bloqueo_archivo(ruta: str):
+    """Bloqueo exclusivo entre procesos sobre <ruta>.lock."""
+    return bloqueo_exclusivo(ruta + ".lock")
+
+
+def clave_archivo(ruta: str) -> str:
+    """Recurso de un archivo local, igual para cualquier forma de escribir su ruta."""
+    return "archivo:" + os.path.normcase(os.path.realpath(ruta))
+
+
+class Trabajo:
+    """Lo que recibe la función del trabajo para informar su avance."""
+
+    def __init__(self, cola: "ColaTrabajos", id_trabajo: str):
+        self.cola = cola
+        self.id = id_trabajo
+
+    def progreso(self, fraccion: float, mensaje: str = None):
+        self.cola._actualizar(self.id, progreso=max(0.0, min(1.0, float(fraccion))), mensaje=mensaje)
+
+
+class ColaTrabajos:
+    def __init__(self, ruta: str = RUTA_DEFECTO, max_hilos: int = MAX_HILOS):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="trabajo")
+        # recurso -> tareas en espera; la clave existe mientras un hilo atiende el recurso
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self.propietario = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._dir_procesos = ruta + ".procesos"
+        os.makedirs(self._dir_procesos, exist_ok=True)
+        # Se mantiene abierto y bloqueado mientras viva el proceso; el sistema lo libera al terminar
+        self._archivo_vivo = open(os.path.join(self._dir_procesos, f"{self.propietario}.lock"), 'a+b')
+        bloquear(self._archivo_vivo)
+        with self._conexion() as con:
+            con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id TEXT PRIMARY KEY, tipo TEXT NOT NULL, recurso TEXT NOT NULL, descripcion TEXT,
+                    estado TEXT NOT NULL, progreso REAL NOT NULL DEFAULT 0, mensaje TEXT, resultado TEXT,
+                    creado REAL NOT NULL, iniciado REAL, terminado REAL, propietario TEXT
+                );
+                CREATE INDEX IF NOT EXISTS ix_trabajos_recurso_estado ON trabajos (recurso, estado);
+                """
+            )
+            if "propietario" not in {c[1] for c in con.execute("PRAGMA table_info(trabajos)")}:
+                con.execute("ALTER TABLE trabajos ADD COLUMN propietario TEXT")
+        self._marcar_interrumpidos()
+
+    def _procesos_vivos(self) -> set:
+        """Propietarios cuyo proceso sigue en marcha; borra los archivos de los que terminaron."""
+        vivos = {self.propietario}
+        for archivo in glob.glob(os.path.join(self._dir_procesos, "*.lock")):
+            propietario = os.path.basename(archivo)[:-len(".lock")]
+            if propietario == self.propietario:
+                continue
+            with open(archivo, 'a+b') as f:
+                if not bloquear(f, esperar=False):
+                    vivos.add(propietario)
+                    continue
+                desbloquear(f)
+            try:
+                os.remove(archivo)
+            except OSError:
+                pass
+        return vivos
+
+    def _marcar_interrumpidos(self):
+        # Los hilos de un proceso que ya terminó no van a completar sus trabajos; los de
+        # otros procesos vivos (otra instancia de la app con la misma base) siguen su curso
+        vivos = sorted(self._procesos_vivos())
+        with self._conexion() as con:
+            n = con.execute(
+                "UPDATE trabajos SET estado = ?, mensaje = 'La app se reinició antes de terminar', terminado = ? "
+                f"WHERE estado IN (?, ?) AND (propietario IS NULL OR propietario NOT IN ({','.join('?' * len(vivos))}))",
+                (INTERRUMPIDO, time.time(), PENDIENTE, EN_CURSO, *vivos),
+            ).rowcount
+        if n:
+            logger.warning(f"{n} trabajos de una ejecución anterior marcados como interrumpidos.")
+
+    @contextmanager
+    def _conexion(self):
+        # Una conexión por operación (se usa desde los hilos de la UI y de los trabajos);
+        # confirma al salir sin error y siempre se cierra
+        con = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _programar(self, recurso: str, tarea):
+        with self._lock:
+            if recurso in self._pendientes:
+                self._pendientes[recurso].append(tarea)
+                return
+            self._pendientes[recurso] = deque([tarea])
+        self._pool.submit(self._atender, recurso)
+
+    def _atender(self, recurso: str):
+        """Ejecuta en orden las tareas del recurso hasta vaciar su cola, y la descarta."""
+        while True:
+            with self._lock:
+                tareas = self._pendientes[recurso]
+                if not tareas:
+                    del self._pendientes[recurso]
+                    return
+                tarea = tareas.popleft()
+            try:
+                tarea()
+            except Exception:
+                # Que un fallo al registrar el estado no deje el recurso bloqueado
+                logger.exception(f"Error ejecutando un trabajo de {recurso}:")
+
+    def encolar(self, tipo: str, recurso: str, funcion, *args, descripcion: str = None,
+                bloquear_archivo: str = None, **kwargs) -> str:
+        """
+        Encola funcion(trabajo, *args, **kwargs) detrás de los trabajos del mismo recurso.
+        La función devuelve un resultado serializable a JSON. Devuelve el id del trabajo.
+        """
+        id_trabajo = uuid.uuid4().hex
+        with self._conexion() as con:
+            con.execute(
+                "INSERT INTO trabajos (id, tipo, recurso, descripcion, estado, creado, propietario) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (id_trabajo, tipo, recurso, descripcion, PENDIENTE, time.time(), self.propietario),
+            )
+        self._programar(recurso, lambda: self._ejecutar(id_trabajo, funcion, args, kwargs, bloquear_archivo))
+        logger.info(f"Trabajo {tipo} {id_trabajo} encolado para {recurso}")
+        return id_trabajo
+
+    def _ejecutar(self, id_trabajo, funcion, args, kwargs, bloquear_archivo):
+        self._actualizar(id_trabajo, estado=EN_CURSO, iniciado=time.time())
+        try:
+            if bloquear_archivo:
+                with bloqueo_archivo(bloquear_archivo):
+                    resultado = funcion(Trabajo(self, id_trabajo), *args, **kwargs)
+            else:
+                resultado = funcion(Trabajo(self, id_trabajo), *args, **kwargs)
+        except Exception as e:
+            logger.exception(f"Trabajo {id_trabajo} fallido:")
+            self._actualizar(id_trabajo, estado=ERROR, mensaje=str(e), terminado=time.time(),
+                             resultado=json.dumps(getattr(e, "resultado", None), ensure_ascii=False, default=str))
+            return
+        self._actualizar(id_trabajo, estado=COMPLETADO, progreso=1.0, terminado=time.time(),
+                         resultado=json.dumps(resultado, ensure_ascii=False, default=str))
+
+    def _actualizar(self, id_trabajo: str, **campos):
+        campos = {k: v for k, v in campos.items() if v is not None}
+        if not campos:
+            return
+        asignaciones = ", ".join(f"{k} = ?" for k in campos)
+        with self._conexion() as con:
+            con.execute(f"UPDATE trabajos SET {asignaciones} WHERE id = ?", (*campos.values(), id_trabajo))
+
+    def estados(self, ids) -> list:
+        """Estado de los trabajos indicados (en ese orden), con 'en_cola' = trabajos delante."""
+        ids = list(ids)
+        if not ids:
+            return []
+        with self._conexion() as con:
+            con.row_factory = sqlite3.Row
+            filas = {f["id"]: dict(f) for f in con.execute(
+                f"SELECT * FROM trabajos WHERE id IN ({','.join('?' * len(ids))})", ids)}
+            for fila in filas.values():
+                fila["resultado"] = json.loads(fila["resultado"]) if fila["resultado"] else None
+                fila["en_cola"] = 0
+                if fila["estado"] == PENDIENTE:
+                    fila["en_cola"] = con.execute(
+                        "SELECT COUNT(*) FROM trabajos WHERE recurso = ? AND estado IN (?, ?) AND creado < ?",
+                        (fila["recurso"], PENDIENTE, EN_CURSO, fila["creado"]),
+                    ).fetchone()[0]
+        return [filas[i] for i in ids if i in filas]
+
+    def estado(self, id_trabajo: str) -> dict:
+        estados = self.estados([id_trabajo])
+        return estados[0] if estados else None
+
+
+def cola_trabajos(ruta: str = RUTA_DEFECTO) -> ColaTrabajos:
+    """Cola compartida por todas las sesiones del proceso para esa base de datos."""
+    ruta = os.path.abspath(ruta)
+    with _lock_colas:
+        if ruta not in _colas:
+            _colas[ruta] = ColaTrabajos(ruta)
+        return _colas[ruta]
@@ -0,0 +1,190 @@
+"""
+Índice persistente de LEAD para el libro maestro.
+
+Se guarda en un SQLite junto al .xlsx (conglomerado_maestrias.leads.sqlite) con
+la tabla leads(hoja, lead, fila). Permite responder "¿este LEAD ya está en la
+hoja?" sin abrir el libro. Guarda también mtime y tamaño del .xlsx y el CRC de
+cada hoja: si la firma no coincide con el archivo actual (el libro se editó
+fuera de la app o se reescribió completo), se reindexan solo las hojas cuyo
+contenido cambió.
+
+La tabla estatus(hoja, lead, hash) recuerda el Estatus de cada fila en la última
+revisión de rezagados, para examinar únicamente las filas que cambiaron.
+"""
+import os
+import sqlite3
+import logging
+import zlib
+
+from .xlsx_incremental import LibroXlsx
+
+logger = logging.getLogger(__name__)
+
+_TAMANO_CONSULTA = 500
+_VERSION = "2"
+
+
+def ruta_indice(ruta_maestro: str) -> str:
+    return os.path.splitext(ruta_maestro)[0] + ".leads.sqlite"
+
+
+def hash_estatus(texto) -> int:
+    return zlib.crc32(("" if texto is None else str(texto)).encode("utf-8"))
+
+
+def _firma_archivo(ruta: str) -> tuple:
+    st = os.stat(ruta)
+    return str(st.st_mtime_ns), str(st.st_size)
+
+
+class IndiceLeads:
+    def __init__(self, ruta_maestro: str):
+        self.ruta_maestro = ruta_maestro
+        self.ruta = ruta_indice(ruta_maestro)
+        self._con = sqlite3.connect(self.ruta)
+        self._con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS leads (hoja TEXT NOT NULL, lead TEXT NOT NULL, fila INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS ix_leads_hoja_lead ON leads (hoja, lead);
+            CREATE TABLE IF NOT EXISTS estatus (hoja TEXT NOT NULL, lead TEXT NOT NULL, hash INTEGER NOT NULL,
+                                                PRIMARY KEY (hoja, lead));
+            CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
+
+    def cerrar(self):
+        self._con.close()
+
+    def _meta(self) -> dict:
+        return dict(self._con.execute("SELECT clave, valor FROM meta"))
+
+    def vigente(self) -> bool:
+        """True si el índice corresponde al .xlsx actual (mismo mtime y tamaño)."""
+        if not os.path.exists(self.ruta_maestro):
+            return False
+        meta = self._meta()
+        if meta.get("version") != _VERSION:
+            return False
+        return (meta.get("mtime_ns"), meta.get("size")) == _firma_archivo(self.ruta_maestro)
+
+    def asegurar_vigente(self, libro: LibroXlsx = None):
+        """
+        Si la firma del .xlsx no coincide, reindexa las hojas cuyo CRC cambió.
+        `libro` (abierto) permite reutilizar las hojas ya parseadas por el llamador.
+        """
+        if self.vigente():
+            return
+        if libro is None:
+            with LibroXlsx(self.ruta_maestro) as libro_propio:
+                self._reindexar(libro_propio)
+        else:
+            self._reindexar(libro)
+
+    def reconstruir(self):
+        """Relee la columna LEAD de todas las hojas del libro y rehace el índice."""
+        with self._con:
+            self._con.execute("DELETE FROM meta WHERE clave LIKE 'crc:%'")
+        with LibroXlsx(self.ruta_maestro) as libro:
+            self._reindexar(libro)
+
+    def _reindexar(self, libro: LibroXlsx):
+        meta = self._meta()
+        if meta.get("version") != _VERSION:
+            meta = {}
+        crcs = libro.crcs()
+        cambiadas = [n for n, crc in crcs.items() if meta.get(f"crc:{n}") != str(crc)]
+        with self._con:
+            if not meta:
+                self._con.execute("DELETE FROM leads")
+            hojas_indexadas = [r[0] for r in self._con.execute("SELECT DISTINCT hoja FROM leads")]
+            for hoja in hojas_indexadas:
+                if hoja not in crcs:
+                    self._con.execute("DELETE FROM leads WHERE hoja = ?", (hoja,))
+                    self._con.execute("DELETE FROM estatus WHERE hoja = ?", (hoja,))
+            n_entradas = 0
+            for hoja in cambiadas:
+                filas = [(hoja, lead, fila) for fila, lead in libro.hoja(hoja).columna("LEAD")]
+                self._con.execute("DELETE FROM leads WHERE hoja = ?", (hoja,))
+                self._con.executemany("INSERT INTO leads (hoja, lead, fila) VALUES (?, ?, ?)", filas)
+                n_entradas += len(filas)
+            self._con.execute("DELETE FROM meta WHERE clave LIKE 'crc:%'")
+            self._guardar_firma(crcs)
+        logger.info(f"Índice de LEAD actualizado: {len(cambiadas)} de {len(crcs)} hojas reindexadas ({n_entradas} entradas) en {self.ruta}")
+
+    def presentes(self, hoja: str, leads) -> set:
+        """Subconjunto de `leads` que ya existe en la hoja."""
+        leads = list(dict.fromkeys(str(l) for l in leads))
+        encontrados = set()
+        for i in range(0, len(leads), _TAMANO_CONSULTA):
+            lote = leads[i:i + _TAMANO_CONSULTA]
+            marcadores = ",".join("?" * len(lote))
+            cur = self._con.execute(
+                f"SELECT DISTINCT lead FROM leads WHERE hoja = ? AND lead IN ({marcadores})", [hoja, *lote]
+            )
+            encontrados.update(r[0] for r in cur)
+        return encontrados
+
+    def filas(self, hoja: str) -> dict:
+        """{lead: fila} de una hoja."""
+        return {lead: fila for lead, fila in self._con.execute("SELECT lead, fila FROM leads WHERE hoja = ?", (hoja,))}
+
+    def crc_revisado(self, hoja: str):
+        """CRC que tenía la hoja tras la última revisión de rezagados (o None)."""
+        valor = self._meta().get(f"estatus_crc:{hoja}")
+        return int(valor) if valor is not None else None
+
+    def hashes_estatus(self, hoja: str) -> dict:
+        """{lead: hash del Estatus} registrado en la última revisión de rezagados."""
+        return {lead: h for lead, h in self._con.execute("SELECT lead, hash FROM estatus WHERE hoja = ?", (hoja,))}
+
+    def registrar_cambios(self, cambios: dict, estatus: dict = None, revisadas=()):
+        """
+        Aplica en una sola transacción los cambios hechos al libro y guarda su nueva firma.
+        - cambios: {hoja: (filas_eliminadas, [(fila, lead), ...] añadidas)}; las filas
+          posteriores a una eliminada se renumeran igual que en la hoja.
+        - estatus: {hoja: ({lead: hash} a registrar, [leads] a olvidar)}.
+        - revisadas: hojas cuya revisión de rezagados queda al día con el libro guardado.
+        """
+        with LibroXlsx(self.ruta_maestro) as libro:
+            crcs = libro.crcs()
+        with self._con:
+            for hoja, (eliminadas, agregadas) in cambios.items():
+                eliminadas = sorted(set(eliminadas))
+                if eliminadas:
+                    self._con.execute("CREATE TEMP TABLE IF NOT EXISTS eliminadas (fila INTEGER PRIMARY KEY)")
+                    self._con.execute("DELETE FROM eliminadas")
+                    self._con.executemany("INSERT INTO eliminadas (fila) VALUES (?)", [(f,) for f in eliminadas])
+                    self._con.execute("DELETE FROM leads WHERE hoja = ? AND fila IN (SELECT fila FROM eliminadas)", (hoja,))
+                    self._con.execute(
+                        "UPDATE leads SET fila = fila - (SELECT COUNT(*) FROM eliminadas e WHERE e.fila < leads.fila) "
+                        "WHERE hoja = ?",
+                        (hoja,),
+                    )
+                self._con.executemany(
+                    "INSERT INTO leads (hoja, lead, fila) VALUES (?, ?, ?)",
+                    [(hoja, str(lead), fila) for fila, lead in agregadas],
+                )
+            for hoja, (registrar, olvidar) in (estatus or {}).items():
+                self._con.executemany(
+                    "INSERT OR REPLACE INTO estatus (hoja, lead, hash) VALUES (?, ?, ?)",
+                    [(hoja, lead, h) for lead, h in registrar.items()],
+                )
+                self._con.executemany("DELETE FROM estatus WHERE hoja = ? AND lead = ?", [(hoja, lead) for lead in olvidar])
+            for hoja in revisadas:
+                self._con.execute(
+                    "INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", (f"estatus_crc:{hoja}", str(crcs[hoja]))
+                )
+            self._guardar_firma(crcs)
+
+    def _guardar_firma(self, crcs: dict):
+        mtime_ns, size = _firma_archivo(self.ruta_maestro)
+        valores = [("version", _VERSION), ("mtime_ns", mtime_ns), ("size", size)]
+        valores += [(f"crc:{hoja}", str(crc)) for hoja, crc in crcs.items()]
+        self._con.executemany("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", valores)
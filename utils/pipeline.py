@@ -0,0 +1,237 @@
+"""
+Pipeline de depuración sin Streamlit, para ejecuciones programadas (ej. nocturnas).
+
+Depura en paralelo (un proceso por archivo) todos los CSV vwCRMLeads de una carpeta con
+depurar_csv_por_bloques + mapear_columnas, y con el resultado combinado hace una sola
+actualización del maestro, registra la ejecución en el historial y, opcionalmente,
+envía las filas a Excel Online usando la sesión guardada en el caché de tokens.
+
+Uso:
+    python -m utils.pipeline CARPETA [--maestro RUTA] [--periodo 202592]
+        [--horas 48 | --dias N] [--desde-medianoche] [--programa Maestrías]
+        [--procesos N] [--excel-url URL --hoja NOMBRE --cuenta USUARIO]
+        [--rendimiento RUTA.json [--memoria]]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from .data_processor import depurar_csv_por_bloques, mapear_columnas
+from .excel_manager import actualizar_maestro
+from .history_manager import guardar_historial
+from .instrumentation import MedicionEtapas, medir_ejecucion
+from .job_queue import bloqueo_archivo
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "data"
+HISTORY_DIR = "history"
+DEFAULT_MAESTRO = os.path.join(DATA_DIR, "conglomerado_maestrias.xlsx")
+URL_BASE = "https://apmanager.aplatam.com/admin/Ventas/Consulta/Lead/"
+PROGRAMAS = ["Maestrías", "Licenciaturas Anáhuac"]
+
+
+def depurar_archivo(ruta: str, timestamp_referencia: datetime, hours: int = 48, days: int = None,
+                    start_from_prev_midnight: bool = False, program_type: str = None, url_base: str = URL_BASE) -> tuple:
+    """
+    Depura y mapea un CSV (se ejecuta en un proceso del pool).
+    Devuelve (ruta, df_mapeado, filas_originales, rendimiento por etapa).
+    """
+    with medir_ejecucion() as medicion:
+        df_depurado, filas_originales = depurar_csv_por_bloques(
+            ruta,
+            hours=hours,
+            days=days,
+            timestamp_referencia=timestamp_referencia,
+            start_from_prev_midnight=start_from_prev_midnight,
+            program_type=program_type,
+        )
+        if not df_depurado.empty:
+            df_depurado = mapear_columnas(df_depurado, url_base)
+    return ruta, df_depurado, filas_originales, medicion.resumen()
+
+
+def depurar_archivos(rutas: list, procesos: int = None, **opciones) -> tuple:
+    """
+    Depura los CSV en paralelo. Devuelve (resultados, errores): resultados en el orden de
+    `rutas` como (ruta, df_mapeado, filas_originales, rendimiento) y errores como {ruta: excepción}.
+    """
+    resultados, errores = {}, {}
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = {pool.submit(depurar_archivo, ruta, **opciones): ruta for ruta in rutas}
+        for futuro in as_completed(futuros):
+            ruta = futuros[futuro]
+            try:
+                resultados[ruta] = futuro.result()
+                logger.info(f"{os.path.basename(ruta)}: {len(resultados[ruta][1])} de {resultados[ruta][2]} filas tras depurar")
+            except Exception as e:
+                errores[ruta] = e
+                logger.error(f"{os.path.basename(ruta)}: error al depurar: {e}")
+    return [resultados[r] for r in rutas if r in resultados], errores
+
+
+def enviar_a_excel(df: pd.DataFrame, share_url: str, hoja: str, cuenta: str, client_id: str = None):
+    """
+    Añade df a la hoja de Excel Online como `cuenta` (nombre de usuario o home_account_id),
+    con su sesión del caché persistente de tokens (iniciada antes desde la app); sin sesión
+    guardada de esa cuenta no se puede pedir Device Code aquí.
+    """
+    from .excel_integration_ui_persistent import CORRECT_SCOPES, _authority, _col_letter
+    from .graph_client import GraphClient
+    from .graph_serializer import dataframe_a_valores
+
+    client_id = client_id or os.environ.get("AZURE_CLIENT_ID")
+    if not client_id:
+        raise RuntimeError("Se requiere AZURE_CLIENT_ID para enviar a Excel Online.")
+    if not cuenta:
+        raise RuntimeError("Indica la cuenta de Microsoft con la que enviar a Excel Online.")
+    gc = GraphClient(client_id=client_id, scopes=CORRECT_SCOPES, authority=_authority(), cuenta=cuenta)
+    if gc.adquirir_token_silencioso() is None:
+        raise RuntimeError(f"No hay una sesión de Microsoft guardada para {cuenta}; conéctate una vez desde la app.")
+
+    header_range = f"{hoja}!A1:{_col_letter(len(df.columns) - 1)}1"
+    gc.append_rows_to_sheet(share_url, hoja, dataframe_a_valores(df), header_range=header_range)
+
+
+def ejecutar_pipeline(rutas: list, maestro: str = DEFAULT_MAESTRO, periodo: str = "202592", hours: int = 48,
+                      days: int = None, start_from_prev_midnight: bool = False, program_type: str = "Maestrías",
+                      url_base: str = URL_BASE, procesos: int = None, history_dir: str = HISTORY_DIR,
+                      timestamp_referencia: datetime = None, excel_url: str = None, hoja_excel: str = None,
+                      cuenta_excel: str = None) -> dict:
+    """
+    Depura `rutas` en paralelo, consolida todo en el maestro con una sola escritura y
+    guarda una entrada de historial para la ejecución, con el rendimiento por etapa
+    (el de los workers sumado). Un LEAD presente en varios archivos (exportaciones que
+    se solapan) cuenta una sola vez, con la fila del primero. Devuelve esa entrada más
+    los archivos con error ('errores').
+    """
+    if excel_url and not (hoja_excel and cuenta_excel):
+        raise ValueError("Para enviar a Excel Online se requieren hoja_excel y cuenta_excel.")
+    if timestamp_referencia is None:
+        timestamp_referencia = datetime.now()
+    if days is not None:
+        hours = None
+
+    resultados, errores = depurar_archivos(
+        rutas, procesos,
+        timestamp_referencia=timestamp_referencia,
+        hours=hours,
+        days=days,
+        start_from_prev_midnight=start_from_prev_midnight,
+        program_type=program_type,
+        url_base=url_base,
+    )
+    rendimiento = MedicionEtapas()
+    for _, _, _, etapas in resultados:
+        rendimiento.agregar(etapas)
+    partes = [df for _, df, _, _ in resultados if not df.empty]
+    df_total = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+    if 'LEAD' in df_total.columns:
+        antes = len(df_total)
+        df_total = df_total.drop_duplicates(subset=['LEAD'], keep='first').reset_index(drop=True)
+        logger.info(f"De {antes} filas de {len(partes)} archivos se quitaron {antes - len(df_total)} LEAD repetidos.")
+
+    added, moved_rezagados = 0, 0
+    if not df_total.empty:
+        with medir_ejecucion() as medicion:
+            # Mismo bloqueo que las consolidaciones encoladas desde la app
+            with bloqueo_archivo(maestro):
+                added, moved_rezagados = actualizar_maestro(df_total, maestro, periodo)
+            if excel_url:
+                enviar_a_excel(df_total, excel_url, hoja_excel, cuenta_excel)
+                logger.info(f"Enviadas {len(df_total)} filas a Excel Online ({hoja_excel}).")
+        rendimiento.agregar(medicion.resumen())
+
+    info_depuracion = {
+        'timestamp': timestamp_referencia.strftime('%Y-%m-%d %H:%M:%S'),
+        'archivo': ", ".join(os.path.basename(r) for r, _, _, _ in resultados),
+        'filas_originales': sum(n for _, _, n, _ in resultados),
+        'filas_depuradas': len(df_total),
+        'filas_agregadas': added,
+        'rezagados_movidos': moved_rezagados,
+        'filtro_horas': hours,
+        'filtro_dias': days,
+        'periodo': periodo,
+        'program_type': program_type,
+        'rendimiento': rendimiento.resumen()
+    }
+    if resultados:
+        guardar_historial(info_depuracion, history_dir)
+    return {**info_depuracion, 'errores': {os.path.basename(r): str(e) for r, e in errores.items()}}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("carpeta", help="Carpeta con los CSV vwCRMLeads (o un CSV)")
+    parser.add_argument("--maestro", default=DEFAULT_MAESTRO)
+    parser.add_argument("--periodo", default="202592")
+    filtro = parser.add_mutually_exclusive_group()
+    filtro.add_argument("--horas", type=int, default=48)
+    filtro.add_argument("--dias", type=int)
+    parser.add_argument("--desde-medianoche", action="store_true", help="Incluir desde medianoche del día anterior")
+    parser.add_argument("--programa", choices=PROGRAMAS, default="Maestrías")
+    parser.add_argument("--url-base", default=URL_BASE)
+    parser.add_argument("--procesos", type=int, help="Procesos en paralelo (por defecto, núcleos disponibles)")
+    parser.add_argument("--referencia", type=datetime.fromisoformat, help="Fecha/hora de referencia del filtro (ISO); por defecto ahora")
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--excel-url", help="URL de compartir o item_id del libro de Excel Online")
+    parser.add_argument("--hoja", help="Hoja de Excel Online a la que añadir las filas")
+    parser.add_argument("--cuenta", help="Cuenta de Microsoft (usuario) con la que enviar a Excel Online; "
+                                         "debe haber iniciado sesión antes desde la app")
+    parser.add_argument("--rendimiento", help="Guardar en este archivo el rendimiento por etapa (JSON)")
+    parser.add_argument("--memoria", action="store_true", help="Medir también la memoria por etapa con tracemalloc (más lento)")
+    args = parser.parse_args(argv)
+
+    if args.excel_url and not args.hoja:
+        parser.error("--excel-url requiere --hoja")
+    if args.excel_url and not args.cuenta:
+        parser.error("--excel-url requiere --cuenta")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.memoria:
+        # Por entorno para que también lo vean los procesos del pool
+        os.environ["DEPURADOR_TRACEMALLOC"] = "1"
+
+    if os.path.isdir(args.carpeta):
+        rutas = sorted(glob.glob(os.path.join(args.carpeta, "*.csv")))
+    else:
+        rutas = [args.carpeta]
+    if not rutas:
+        logger.error(f"No hay archivos CSV en {args.carpeta}")
+        return 1
+
+    resumen = ejecutar_pipeline(
+        rutas,
+        maestro=args.maestro,
+        periodo=args.periodo,
+        hours=args.horas,
+        days=args.dias,
+        start_from_prev_midnight=args.desde_medianoche,
+        program_type=args.programa,
+        url_base=args.url_base,
+        procesos=args.procesos,
+        history_dir=args.history_dir,
+        timestamp_referencia=args.referencia,
+        excel_url=args.excel_url,
+        hoja_excel=args.hoja,
+        cuenta_excel=args.cuenta,
+    )
+    logger.info(f"{len(rutas)} archivos: {resumen['filas_depuradas']} filas depuradas de {resumen['filas_originales']}, "
+                f"{resumen['filas_agregadas']} agregadas al maestro, {resumen['rezagados_movidos']} rezagados movidos")
+    if args.rendimiento:
+        with open(args.rendimiento, "w", encoding="utf-8") as f:
+            json.dump(resumen['rendimiento'], f, ensure_ascii=False, indent=2)
+    for archivo, error in resumen['errores'].items():
+        logger.error(f"{archivo}: {error}")
+    return 1 if resumen['errores'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Caché persistente y cifrada de tokens MSAL.
+
+Los tokens (incluido el refresh token) se guardan en disco cifrados con Fernet
+(`cryptography`, dependencia de msal), de modo que una nueva sesión del navegador
+o un reinicio de la app obtienen el token con acquire_token_silent en lugar de
+repetir el Device Code. MSAL renueva el access token con el refresh token cuando
+está por caducar.
+
+- Archivo: MSAL_TOKEN_CACHE o ~/.depurador/msal_token_cache.bin
+- Clave: MSAL_CACHE_KEY (clave Fernet en base64, variable de entorno o st.secrets) o,
+  si no está definida, una clave guardada en el llavero del sistema (paquete opcional
+  `keyring`). Sin ninguna de las dos el caché solo vive en memoria: la clave nunca se
+  escribe junto al archivo cifrado.
+
+El caché es del proceso y puede contener varias cuentas de Microsoft (una por operador).
+Los tokens solo se piden en silencio para una cuenta explícita (home_account_id de la
+sesión que hizo el Device Code, o la indicada al pipeline); nunca se toma otra del caché.
+"""
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import msal
+from cryptography.fernet import Fernet, InvalidToken
+
+try:
+    import keyring
+except ImportError:  # opcional
+    keyring = None
+
+logger = logging.getLogger(__name__)
+
+_DIRECTORIO_DEFECTO = os.path.join(os.path.expanduser("~"), ".depurador")
+_caches = {}
+_lock_caches = threading.Lock()
+_SERVICIO_LLAVERO = "depurador"
+_USUARIO_LLAVERO = "msal_cache_key"
+
+
+def ruta_cache_tokens() -> str:
+    return os.environ.get("MSAL_TOKEN_CACHE") or os.path.join(_DIRECTORIO_DEFECTO, "msal_token_cache.bin")
+
+
+def _escribir_privado(ruta: str, datos: bytes):
+    """Escritura atómica con permisos 0600."""
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directorio)
+    try:
+        os.chmod(tmp, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _clave_llavero():
+    """Clave guardada en el llavero del sistema (se crea la primera vez), o None si no hay llavero."""
+    if keyring is None:
+        return None
+    try:
+        clave = keyring.get_password(_SERVICIO_LLAVERO, _USUARIO_LLAVERO)
+        if not clave:
+            clave = Fernet.generate_key().decode("ascii")
+            keyring.set_password(_SERVICIO_LLAVERO, _USUARIO_LLAVERO, clave)
+            logger.info("Generada clave de cifrado del caché de tokens en el llavero del sistema")
+        return clave
+    except Exception as e:  # sin backend (servidores sin sesión gráfica), llavero bloqueado...
+        logger.warning(f"Llavero del sistema no disponible: {e}")
+        return None
+
+
+def _clave_cifrado():
+    """Clave Fernet de MSAL_CACHE_KEY o del llavero del sistema; None si no hay ninguna."""
+    clave = os.environ.get("MSAL_CACHE_KEY")
+    if not clave:
+        try:
+            import streamlit as st
+            clave = st.secrets.get("MSAL_CACHE_KEY")
+        except Exception:
+            clave = None
+    clave = clave or _clave_llavero()
+    if not clave:
+        return None
+    return clave.encode("ascii") if isinstance(clave, str) else clave
+
+
+class CacheTokensCifrada(msal.SerializableTokenCache):
+    """
+    SerializableTokenCache que se carga y guarda cifrado en `ruta`. Sin clave de cifrado
+    (ver _clave_cifrado) no se lee ni se escribe el archivo: `persistente` es False.
+    """
+
+    def __init__(self, ruta: str = None):
+        super().__init__()
+        self.ruta = ruta or ruta_cache_tokens()
+        clave = _clave_cifrado()
+        self._fernet = Fernet(clave) if clave else None
+        self._lock_archivo = threading.Lock()
+        if os.path.exists(self.ruta + ".key"):
+            logger.warning(f"{self.ruta}.key es una clave de una versión anterior y ya no se usa; bórrala.")
+        if self._fernet is None:
+            logger.warning("Sin MSAL_CACHE_KEY ni llavero del sistema: la sesión de Microsoft no se guarda en disco.")
+        elif os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, "rb") as f:
+                    self.deserialize(self._fernet.decrypt(f.read()).decode("utf-8"))
+            except (InvalidToken, ValueError, OSError):
+                logger.warning("Caché de tokens ilegible (¿otra clave?); se empieza vacío.")
+
+    @property
+    def persistente(self) -> bool:
+        return self._fernet is not None
+
+    def guardar(self):
+        """Persiste el caché si cambió desde la última escritura (y hay clave de cifrado)."""
+        with self._lock_archivo:
+            if self._fernet is None or not self.has_state_changed:
+                return
+            _escribir_privado(self.ruta, self._fernet.encrypt(self.serialize().encode("utf-8")))
+            self.has_state_changed = False
+
+
+def cache_tokens(ruta: str = None) -> CacheTokensCifrada:
+    """Caché de tokens compartido por el proceso para esa ruta."""
+    ruta = ruta or ruta_cache_tokens()
+    with _lock_caches:
+        if ruta not in _caches:
+            _caches[ruta] = CacheTokensCifrada(ruta)
+        return _caches[ruta]
+
+
+def crear_app_msal(client_id: str, authority: str, ruta: str = None) -> msal.PublicClientApplication:
+    """PublicClientApplication que usa el caché persistente."""
+    return msal.PublicClientApplication(client_id, authority=authority, token_cache=cache_tokens(ruta))
+
+
+def cuenta_de_resultado(app: msal.PublicClientApplication, resultado: dict):
+    """
+    home_account_id de la cuenta que obtuvo `resultado` (ej. el del Device Code), como lo
+    calcula MSAL: uid.utid de client_info o, si no viene, la cuenta del caché con el oid
+    y el tenant del id token. None si no se puede determinar.
+    """
+    client_info = resultado.get("client_info")
+    if client_info:
+        try:
+            datos = json.loads(base64.urlsafe_b64decode(client_info + "=" * (-len(client_info) % 4)))
+            if datos.get("uid") and datos.get("utid"):
+                return f"{datos['uid']}.{datos['utid']}"
+        except ValueError:
+            pass
+    claims = resultado.get("id_token_claims") or {}
+    oid = claims.get("oid") or claims.get("sub")
+    if not oid:
+        return None
+    cuenta = next((c for c in app.get_accounts()
+                   if c.get("local_account_id") == oid and c.get("realm") == claims.get("tid")), None)
+    return cuenta.get("home_account_id") if cuenta else None
+
+
+def buscar_cuenta(app: msal.PublicClientApplication, cuenta: str):
+    """Cuenta del caché con ese home_account_id o nombre de usuario (sin distinguir mayúsculas), o None."""
+    if not cuenta:
+        return None
+    usuario = cuenta.lower()
+    return next((c for c in app.get_accounts()
+                 if c.get("home_account_id") == cuenta or (c.get("username") or "").lower() == usuario), None)
+
+
+def adquirir_token_silencioso(app: msal.PublicClientApplication, scopes, cuenta: str):
+    """
+    Token del caché para la cuenta indicada (home_account_id o nombre de usuario),
+    renovado con el refresh token si está por caducar, o None si esa cuenta no tiene
+    sesión guardada. Nunca usa otra cuenta del caché. Persiste el caché si MSAL lo actualizó.
+    """
+    encontrada = buscar_cuenta(app, cuenta)
+    if encontrada is None:
+        return None
+    resultado = app.acquire_token_silent(list(scopes), account=encontrada)
+    if not resultado or "access_token" not in resultado:
+        return None
+    if isinstance(app.token_cache, CacheTokensCifrada):
+        app.token_cache.guardar()
+    return resultado
@@ -0,0 +1,520 @@
+"""
+Escritura incremental sobre el libro maestro (.xlsx).
+
+Trabaja directamente sobre el paquete OOXML (zip): solo se leen y reescriben las
+partes XML de las hojas que se modifican. El resto de entradas del zip (otras
+hojas, estilos, sharedStrings...) se copian con el mismo contenido, así que el
+coste de una actualización depende de las hojas tocadas y no de la antigüedad
+del libro.
+
+Las celdas nuevas se escriben como inlineStr para no tener que modificar
+sharedStrings.xml; las filas copiadas de otra hoja del libro conservan su tipo,
+estilo y valor originales.
+
+Eliminar filas solo renumera <row r> y <c r>. Si algo más apunta a filas de la
+hoja (fórmulas, celdas combinadas, hipervínculos, nombres definidos...) se lanza
+LibroNoIncremental para que el llamador reescriba el libro completo.
+"""
+import io
+import os
+import re
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from xml.sax.saxutils import escape
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL_DOC = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+_TAG_ROW = f"{{{NS_MAIN}}}row"
+_TAG_C = f"{{{NS_MAIN}}}c"
+_TAG_V = f"{{{NS_MAIN}}}v"
+_TAG_T = f"{{{NS_MAIN}}}t"
+_TAG_SI = f"{{{NS_MAIN}}}si"
+_TAG_DIMENSION = f"{{{NS_MAIN}}}dimension"
+
+_REF_RE = re.compile(r"([A-Z]+)(\d+)$")
+_DIMENSION_FIN_RE = re.compile(r"(?:^|:)([A-Z]+)(\d+)$")
+_ROW_CHUNK_RE = re.compile(rb"<row\b[^>]*?(?:/>|>.*?</row>)", re.S)
+_ROW_R_RE = re.compile(rb'(<row\b[^>]*?\br=")(\d+)(")')
+_CELL_R_RE = re.compile(rb'(<c\b[^>]*?\br="[A-Z]+)(\d+)(")')
+_SHEETDATA_RE = re.compile(rb"<sheetData\s*/>|(<sheetData\b[^>]*>)(.*?)</sheetData>", re.S)
+_DIMENSION_RE = re.compile(rb'<dimension\b[^>]*?\bref="[^"]*"\s*/>')
+_XML_INVALIDO_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_CELDA_RE = re.compile(rb"<c\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+_CELDA_REF_RE = re.compile(rb'\br="([A-Z]+)\d+"')
+_CELDA_TIPO_ESTILO_RE = re.compile(rb'\b(t|s)="([^"]*)"')
+_FORMULA_RE = re.compile(rb"<f\b[^>]*?(?:/>|>.*?</f>)", re.S)
+# Partes de una hoja que guardan referencias a sus filas
+_REFERENCIAS_FILAS_RE = re.compile(
+    rb"<(f|mergeCells|hyperlinks|conditionalFormatting|dataValidations|autoFilter|tableParts|"
+    rb"drawing|legacyDrawing|rowBreaks|protectedRanges|ignoredErrors)\b"
+)
+_NOMBRE_DEFINIDO_RE = re.compile(rb"<definedName\b[^>]*>(.*?)</definedName>", re.S)
+
+
+class LibroNoIncremental(ValueError):
+    """El libro o la hoja no admiten la ruta incremental (hoja inexistente, formato inesperado...)."""
+
+
+def col_letra(idx: int) -> str:
+    """Convierte índice 0->A, 25->Z, 26->AA."""
+    letters = ""
+    n = idx + 1
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _col_indice(letras: str) -> int:
+    n = 0
+    for ch in letras:
+        n = n * 26 + (ord(ch) - 64)
+    return n - 1
+
+
+def _leer_shared_strings(zin: zipfile.ZipFile, hasta: int = None) -> list:
+    """Lista de sharedStrings; con `hasta` se deja de leer al llegar a ese índice."""
+    if "xl/sharedStrings.xml" not in zin.namelist():
+        return []
+    shared = []
+    with zin.open("xl/sharedStrings.xml") as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == _TAG_SI:
+                shared.append("".join(t.text or "" for t in elem.iter(_TAG_T)))
+                elem.clear()
+                if hasta is not None and len(shared) > hasta:
+                    break
+    return shared
+
+
+def _valor_celda(c, shared: list) -> str:
+    tipo = c.get("t")
+    if tipo == "inlineStr":
+        return "".join(t.text or "" for t in c.iter(_TAG_T))
+    v = c.find(_TAG_V)
+    if v is None or v.text is None:
+        return ""
+    if tipo == "s":
+        return shared[int(v.text)]
+    return v.text
+
+
+class CeldaXlsx(str):
+    """Texto de una celda existente que conserva sus atributos t/s y su XML interior (<v>, <is>)."""
+
+    def __new__(cls, texto: str, atributos: str, interior: str):
+        celda = super().__new__(cls, texto)
+        celda.atributos = atributos
+        celda.interior = interior
+        return celda
+
+
+def _celda_xml(ref: str, valor) -> str:
+    if isinstance(valor, CeldaXlsx):
+        return f'<c r="{ref}"{valor.atributos}>{valor.interior}</c>'
+    texto = _XML_INVALIDO_RE.sub("", str(valor))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(texto)}</t></is></c>'
+
+
+def _celdas_fila(elem) -> list:
+    """[(indice_columna, tipo, texto)] de una fila; para t="s" el texto es el índice en sharedStrings."""
+    celdas = []
+    for c in elem.iter(_TAG_C):
+        m = _REF_RE.match(c.get("r") or "")
+        if not m:
+            continue
+        tipo = c.get("t")
+        texto = c.findtext(_TAG_V) if tipo == "s" else _valor_celda(c, None)
+        celdas.append((_col_indice(m.group(1)), tipo, texto))
+    return celdas
+
+
+def _encabezados_de_celdas(celdas: list, obtener_shared) -> list:
+    indices_shared = [int(texto) for _, tipo, texto in celdas if tipo == "s" and texto]
+    shared = obtener_shared(max(indices_shared)) if indices_shared else []
+    valores = {i: (shared[int(texto)] if tipo == "s" and texto else texto or "") for i, tipo, texto in celdas}
+    n = max(valores) + 1 if valores else 0
+    return [valores.get(i, "") for i in range(n)]
+
+
+class HojaXlsx:
+    """
+    Una hoja del libro: encabezados y valores (como texto) de sus filas, más las
+    modificaciones pendientes (encabezados añadidos, filas eliminadas y añadidas).
+    Al crearla solo se lee la fila de encabezados; el resto de filas se parsea la
+    primera vez que se accede a `filas`.
+    """
+
+    def __init__(self, nombre: str, parte: str, xml: bytes, obtener_shared, referencias_externas=None):
+        self.nombre = nombre
+        self.parte = parte
+        self._xml = xml
+        self._obtener_shared = obtener_shared
+        self._referencias_externas = referencias_externas
+        self._filas = None
+        self._encabezados_nuevos = []
+        self._eliminar = set()
+        self._nuevas = []
+        self._numeros_nuevas = []
+        self.encabezados = self._leer_encabezados()
+
+    def _leer_encabezados(self) -> list:
+        for _, elem in ET.iterparse(io.BytesIO(self._xml), events=("end",)):
+            if elem.tag != _TAG_ROW:
+                continue
+            if elem.get("r") is None:
+                raise LibroNoIncremental(f"La hoja '{self.nombre}' tiene filas sin atributo r.")
+            if elem.get("r") != "1":
+                return []
+            return _encabezados_de_celdas(_celdas_fila(elem), self._obtener_shared)
+        return []
+
+    @property
+    def filas(self) -> list:
+        """[(numero_fila, {indice_columna: texto})], sin la fila de encabezados."""
+        if self._filas is None:
+            shared = self._obtener_shared()
+            filas = []
+            for _, elem in ET.iterparse(io.BytesIO(self._xml), events=("end",)):
+                if elem.tag != _TAG_ROW:
+                    continue
+                if elem.get("r") is None:
+                    raise LibroNoIncremental(f"La hoja '{self.nombre}' tiene filas sin atributo r.")
+                r = int(elem.get("r"))
+                if r != 1:
+                    valores = {}
+                    for c in elem.iter(_TAG_C):
+                        m = _REF_RE.match(c.get("r") or "")
+                        if not m:
+                            raise LibroNoIncremental(f"La hoja '{self.nombre}' tiene celdas sin referencia.")
+                        valores[_col_indice(m.group(1))] = _valor_celda(c, shared)
+                    filas.append((r, valores))
+                elem.clear()
+            self._filas = filas
+        return self._filas
+
+    def indice(self, nombre: str):
+        """Índice de la columna con ese encabezado (o None)."""
+        try:
+            return self.encabezados.index(nombre)
+        except ValueError:
+            return None
+
+    def columna(self, nombre: str) -> list:
+        """[(numero_fila, texto)] para la columna indicada."""
+        idx = self.indice(nombre)
+        if idx is None:
+            return []
+        return [(r, valores.get(idx, "")) for r, valores in self.filas]
+
+    def filas_originales(self, numeros) -> list:
+        """
+        [{encabezado: CeldaXlsx}] de las filas indicadas, en ese orden. Las celdas conservan
+        tipo, estilo y valor (sin la fórmula) para copiarlas a otra hoja del mismo libro.
+        """
+        numeros = list(numeros)
+        buscadas = set(numeros)
+        textos = {r: valores for r, valores in self.filas if r in buscadas}
+        encontradas = {}
+        for chunk_m in _ROW_CHUNK_RE.finditer(self._xml):
+            chunk = chunk_m.group(0)
+            r = int(_ROW_R_RE.search(chunk).group(2))
+            if r not in buscadas:
+                continue
+            celdas = {}
+            for c in _CELDA_RE.finditer(chunk):
+                atributos = c.group(1)
+                idx = _col_indice(_CELDA_REF_RE.search(atributos).group(1).decode())
+                if idx >= len(self.encabezados) or not self.encabezados[idx]:
+                    continue
+                extra = "".join(f' {k.decode()}="{v.decode()}"' for k, v in _CELDA_TIPO_ESTILO_RE.findall(atributos))
+                interior = _FORMULA_RE.sub(b"", c.group(2) or b"").decode("utf-8")
+                celdas[self.encabezados[idx]] = CeldaXlsx(textos[r].get(idx, ""), extra, interior)
+            encontradas[r] = celdas
+        return [encontradas.get(r, {}) for r in numeros]
+
+    def asegurar_encabezados(self, nombres):
+        """Añade al final de la fila 1 los encabezados que falten."""
+        for nombre in nombres:
+            if nombre not in self.encabezados:
+                self.encabezados.append(nombre)
+                self._encabezados_nuevos.append((len(self.encabezados) - 1, nombre))
+
+    def eliminar_filas(self, numeros):
+        """
+        Marca filas para eliminarlas al serializar. Lanza LibroNoIncremental si la hoja o
+        el libro tienen referencias a sus filas que quedarían desplazadas.
+        """
+        numeros = set(numeros)
+        if numeros and not self._eliminar:
+            m = _REFERENCIAS_FILAS_RE.search(self._xml)
+            externas = self._referencias_externas() if self._referencias_externas else None
+            if m or externas:
+                motivo = f"<{m.group(1).decode()}>" if m else externas
+                raise LibroNoIncremental(f"La hoja '{self.nombre}' tiene referencias a sus filas ({motivo}); no se pueden eliminar filas.")
+        self._eliminar.update(numeros)
+
+    def agregar_filas(self, filas):
+        """Añade filas (dicts encabezado -> valor); los encabezados desconocidos se crean."""
+        for fila in filas:
+            self.asegurar_encabezados(fila.keys())
+            self._nuevas.append(fila)
+
+    def cambios(self, nombre: str) -> tuple:
+        """
+        (filas_eliminadas, [(fila, valor)]) de las filas añadidas para la columna `nombre`.
+        Los números de fila de las añadidas solo se conocen después de serializar().
+        """
+        agregadas = [(numero, "" if fila.get(nombre) is None else str(fila.get(nombre)))
+                     for numero, fila in zip(self._numeros_nuevas, self._nuevas)]
+        return sorted(self._eliminar), agregadas
+
+    @property
+    def modificada(self) -> bool:
+        return bool(self._encabezados_nuevos or self._eliminar or self._nuevas)
+
+    def serializar(self) -> bytes:
+        """XML de la hoja con las modificaciones aplicadas sobre el texto original."""
+        if not self.modificada:
+            return self._xml
+        m = _SHEETDATA_RE.search(self._xml)
+        if not m:
+            raise LibroNoIncremental(f"La hoja '{self.nombre}' no tiene sheetData.")
+        apertura = m.group(1) or b"<sheetData>"
+        contenido = m.group(2) or b""
+
+        if self._eliminar:
+            contenido, ultima = self._contenido_con_eliminaciones(contenido)
+        else:
+            contenido, ultima = self._contenido_sin_eliminaciones(contenido)
+
+        self._numeros_nuevas = []
+        partes = [contenido]
+        for fila in self._nuevas:
+            ultima += 1
+            self._numeros_nuevas.append(ultima)
+            celdas = "".join(
+                _celda_xml(f"{col_letra(i)}{ultima}", fila[nombre])
+                for i, nombre in enumerate(self.encabezados)
+                if nombre in fila and fila[nombre] is not None and str(fila[nombre]) != ""
+            )
+            partes.append(f'<row r="{ultima}">{celdas}</row>'.encode("utf-8"))
+
+        sheet_data = apertura + b"".join(partes) + b"</sheetData>"
+        xml = self._xml[:m.start()] + sheet_data + self._xml[m.end():]
+        ref = f"A1:{col_letra(max(len(self.encabezados), 1) - 1)}{max(ultima, 1)}".encode()
+        return _DIMENSION_RE.sub(lambda _: b'<dimension ref="' + ref + b'"/>', xml, count=1)
+
+    def _contenido_sin_eliminaciones(self, contenido: bytes) -> tuple:
+        # Solo se toca la fila 1 (si hay encabezados nuevos); las filas se añaden al final
+        if self._encabezados_nuevos:
+            primera = _ROW_CHUNK_RE.search(contenido)
+            if primera and _ROW_R_RE.search(primera.group(0)).group(2) == b"1":
+                contenido = contenido[:primera.start()] + self._con_encabezados_nuevos(primera.group(0)) + contenido[primera.end():]
+            else:
+                contenido = self._con_encabezados_nuevos(b'<row r="1"/>') + contenido
+        pos = contenido.rfind(b"<row ")
+        ultima = int(_ROW_R_RE.match(contenido, pos).group(2)) if pos >= 0 else 0
+        return contenido, ultima
+
+    def _contenido_con_eliminaciones(self, contenido: bytes) -> tuple:
+        eliminadas = sorted(self._eliminar)
+        partes = []
+        ultima = 0
+        tiene_encabezado = False
+        for chunk_m in _ROW_CHUNK_RE.finditer(contenido):
+            chunk = chunk_m.group(0)
+            r = int(_ROW_R_RE.search(chunk).group(2))
+            if r in self._eliminar:
+                continue
+            nuevo_r = r - bisect_left(eliminadas, r)
+            if nuevo_r != r:
+                nr = str(nuevo_r).encode()
+                chunk = _ROW_R_RE.sub(lambda x: x.group(1) + nr + x.group(3), chunk, count=1)
+                chunk = _CELL_R_RE.sub(lambda x: x.group(1) + nr + x.group(3), chunk)
+            if r == 1:
+                tiene_encabezado = True
+                chunk = self._con_encabezados_nuevos(chunk)
+            partes.append(chunk)
+            ultima = max(ultima, nuevo_r)
+
+        if not tiene_encabezado and self._encabezados_nuevos:
+            partes.insert(0, self._con_encabezados_nuevos(b'<row r="1"/>'))
+            ultima = max(ultima, 1)
+        return b"".join(partes), ultima
+
+    def _con_encabezados_nuevos(self, chunk: bytes) -> bytes:
+        if not self._encabezados_nuevos:
+            return chunk
+        celdas = "".join(_celda_xml(f"{col_letra(i)}1", nombre) for i, nombre in self._encabezados_nuevos).encode("utf-8")
+        if chunk.endswith(b"/>"):
+            return chunk[:-2] + b">" + celdas + b"</row>"
+        return chunk[:-len(b"</row>")] + celdas + b"</row>"
+
+
+class LibroXlsx:
+    """
+    Acceso incremental a un .xlsx existente.
+
+        with LibroXlsx(ruta) as libro:
+            ventas = libro.hoja("Ventas ...")
+            ventas.agregar_filas([...])
+            libro.guardar()
+
+    Solo se parsean las hojas pedidas con hoja(); guardar() reescribe únicamente
+    las que tengan cambios, sustituye el archivo de forma atómica y cierra el libro.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._zin = None
+        self._partes = {}
+        self._hojas = {}
+        self._shared = None
+        self._shared_completo = False
+
+    def __enter__(self):
+        self._zin = zipfile.ZipFile(self.ruta)
+        self._partes = self._rutas_hojas()
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
+
+    def cerrar(self):
+        if self._zin is not None:
+            self._zin.close()
+            self._zin = None
+
+    def _rutas_hojas(self) -> dict:
+        try:
+            wb = ET.fromstring(self._zin.read("xl/workbook.xml"))
+            rels = ET.fromstring(self._zin.read("xl/_rels/workbook.xml.rels"))
+        except KeyError as e:
+            raise LibroNoIncremental(f"Paquete xlsx incompleto: {e}")
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+        partes = {}
+        for sheet in wb.iter(f"{{{NS_MAIN}}}sheet"):
+            target = targets.get(sheet.get(f"{{{NS_REL_DOC}}}id"), "")
+            partes[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+        return partes
+
+    def _obtener_shared(self, hasta: int = None) -> list:
+        """sharedStrings leídos de forma perezosa: solo hasta el índice pedido, o todos."""
+        falta = self._shared is None or (not self._shared_completo and (hasta is None or hasta >= len(self._shared)))
+        if falta:
+            self._shared = _leer_shared_strings(self._zin, hasta=hasta)
+            self._shared_completo = hasta is None or len(self._shared) <= hasta
+        return self._shared
+
+    @property
+    def nombres_hojas(self) -> list:
+        return list(self._partes)
+
+    def crc(self, nombre: str) -> int:
+        """CRC32 de la parte XML de la hoja (del directorio central del zip, sin leerla)."""
+        return self._zin.getinfo(self._partes[nombre]).CRC
+
+    def crcs(self) -> dict:
+        return {nombre: self.crc(nombre) for nombre in self._partes}
+
+    def hoja(self, nombre: str) -> HojaXlsx:
+        if nombre not in self._hojas:
+            if nombre not in self._partes:
+                raise LibroNoIncremental(f"El libro no contiene la hoja '{nombre}'.")
+            parte = self._partes[nombre]
+            self._hojas[nombre] = HojaXlsx(nombre, parte, self._zin.read(parte), self._obtener_shared,
+                                           lambda: self._referencias_a_hoja(nombre))
+        return self._hojas[nombre]
+
+    def _referencias_a_hoja(self, nombre: str):
+        """
+        Qué apunta a filas de la hoja desde fuera de su XML (nombres definidos, fórmulas
+        de otras hojas, tablas dinámicas, relaciones de la hoja), o None.
+        """
+        parte = self._partes[nombre]
+        variantes = {escape(v).encode("utf-8") for v in (nombre, nombre.replace("'", "''"))}
+
+        def menciona(datos: bytes) -> bool:
+            return any(v in datos for v in variantes)
+
+        if any(menciona(m.group(1)) for m in _NOMBRE_DEFINIDO_RE.finditer(self._zin.read("xl/workbook.xml"))):
+            return "nombres definidos"
+        for otra, otra_parte in self._partes.items():
+            if otra != nombre:
+                datos = self._zin.read(otra_parte)
+                if menciona(datos) and _FORMULA_RE.search(datos):
+                    return f"fórmulas de la hoja '{otra}'"
+        rels = f"{os.path.dirname(parte)}/_rels/{os.path.basename(parte)}.rels"
+        for info in self._zin.infolist():
+            if info.filename.startswith("xl/pivotCache/") and menciona(self._zin.read(info.filename)):
+                return "tablas dinámicas"
+            if info.filename == rels and re.search(rb"/(pivotTable|table|comments|drawing)\"", self._zin.read(rels)):
+                return "relaciones de la hoja"
+        return None
+
+    def resumen_hoja(self, nombre: str) -> dict:
+        """
+        {'filas', 'columnas', 'encabezados'} de una hoja leyendo solo el elemento
+        <dimension> y la fila de encabezados, sin cargar el resto de celdas.
+        'filas' no cuenta la fila de encabezados; una hoja sin filas es 0x0.
+        """
+        if nombre not in self._partes:
+            raise LibroNoIncremental(f"El libro no contiene la hoja '{nombre}'.")
+        dimension = None
+        celdas_encabezado = []
+        ultima_fila = 0
+        with self._zin.open(self._partes[nombre]) as f:
+            for _, elem in ET.iterparse(f, events=("end",)):
+                if elem.tag == _TAG_DIMENSION:
+                    dimension = _DIMENSION_FIN_RE.search(elem.get("ref") or "")
+                elif elem.tag == _TAG_ROW:
+                    r = int(elem.get("r") or ultima_fila + 1)
+                    if r == 1:
+                        celdas_encabezado = _celdas_fila(elem)
+                    ultima_fila = max(ultima_fila, r)
+                    elem.clear()
+                    # Con <dimension> basta con la primera fila; sin él se recorre la hoja en streaming
+                    if dimension is not None:
+                        break
+
+        encabezados = _encabezados_de_celdas(celdas_encabezado, self._obtener_shared)
+        if not ultima_fila:
+            # sheetData vacío o ausente: openpyxl escribe igualmente <dimension ref="A1"/>
+            return {"filas": 0, "columnas": 0, "encabezados": []}
+        if dimension is not None:
+            columnas = _col_indice(dimension.group(1)) + 1
+            ultima_fila = int(dimension.group(2))
+        else:
+            columnas = len(encabezados)
+        return {
+            "filas": max(ultima_fila - 1, 0),
+            "columnas": columnas,
+            "encabezados": encabezados,
+        }
+
+    def guardar(self):
+        reemplazos = {h.parte: h.serializar() for h in self._hojas.values() if h.modificada}
+        if not reemplazos:
+            return
+        directorio = os.path.dirname(os.path.abspath(self.ruta))
+        fd, tmp = tempfile.mkstemp(suffix=".xlsx", dir=directorio)
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp, "w") as zout:
+                for info in self._zin.infolist():
+                    datos = reemplazos.get(info.filename)
+                    if datos is None:
+                        datos = self._zin.read(info.filename)
+                    zout.writestr(info, datos)
+            # Cerrar el original antes de sustituirlo (necesario en Windows)
+            self.cerrar()
+            os.replace(tmp, self.ruta)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise